@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+  converters.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import argparse
+import datetime
+import math
+import timeit
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from fields.converters import timestamp_to_date, timestamp_to_datetime
+
+
+def _row_wise_date(field_name: str):
+    def converter(df: DataFrame) -> Series:
+        def to_date(ts):
+            if math.isnan(ts):
+                return '1970-01-01'
+            return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+
+        return df[field_name].apply(to_date)
+
+    return converter
+
+
+def _row_wise_datetime(field_name: str):
+    def converter(df: DataFrame) -> Series:
+        def to_datetime(ts):
+            if math.isnan(ts):
+                return '1970-01-01 00:00:00'
+            return datetime.datetime.fromtimestamp(ts) \
+                .strftime('%Y-%m-%d %H:%M:%S')
+
+        return df[field_name].apply(to_datetime)
+
+    return converter
+
+
+def _create_data_frame(rows: int) -> DataFrame:
+    start = int(datetime.datetime(2017, 10, 28).timestamp())
+    timestamps = np.random.randint(start, start + 3 * 86400, rows)
+    df = DataFrame({'ts': timestamps.astype('float64')})
+    df.loc[df.sample(frac=0.01).index, 'ts'] = np.nan
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timestamp converters '
+                                                 'benchmark')
+    parser.add_argument('--rows', type=int, default=25000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    df = _create_data_frame(args.rows)
+    cases = [
+        ('date', _row_wise_date('ts'), timestamp_to_date('ts')),
+        ('datetime', _row_wise_datetime('ts'), timestamp_to_datetime('ts')),
+    ]
+    for name, row_wise, vectorized in cases:
+        pd.testing.assert_series_equal(row_wise(df), vectorized(df),
+                                       check_names=False)
+        row_wise_time = min(timeit.repeat(lambda: row_wise(df),
+                                          number=1, repeat=args.repeat))
+        vectorized_time = min(timeit.repeat(lambda: vectorized(df),
+                                            number=1, repeat=args.repeat))
+        print('{name}: row-wise {row_wise:.4f}s, vectorized '
+              '{vectorized:.4f}s, speed-up x{speed_up:.1f}'.format(
+                  name=name,
+                  row_wise=row_wise_time,
+                  vectorized=vectorized_time,
+                  speed_up=row_wise_time / vectorized_time
+              ))
+
+
+if __name__ == '__main__':
+    main()
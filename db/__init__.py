@@ -11,8 +11,15 @@
 """
 from .db import Database
 from .clickhouse import ClickhouseDatabase
+from .clickhouse_cluster import ClickhouseClusterDatabase, \
+    ClickhouseUnavailableError
+from .parquet import ParquetDatabase
+from .sqlite import SqliteDatabase
 
 __all__ = (
     "Database",
     "ClickhouseDatabase",
+    "ClickhouseClusterDatabase", "ClickhouseUnavailableError",
+    "ParquetDatabase",
+    "SqliteDatabase",
 )
@@ -11,8 +11,8 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 import logging
-import re
-from typing import Tuple, List
+import time
+from typing import Tuple, List, Optional, Dict, Set
 
 import requests
 
@@ -21,14 +21,39 @@ from .db import Database
 logger = logging.getLogger(__name__)
 
 
+class ClickhouseError(ValueError):
+    RETRIABLE_STATUS_CODES = (502, 503, 504)
+
+    def __init__(self, status_code: Optional[int], text: str):
+        super().__init__(text)
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def retriable(self) -> bool:
+        return self.status_code in self.RETRIABLE_STATUS_CODES
+
+
 class ClickhouseDatabase(Database):
     QUERY_LOG_LIMIT = 200
+    MIGRATABLE_ENGINES = (
+        'MergeTree',
+        'ReplicatedMergeTree',
+        'Merge',
+        'Distributed',
+    )
 
-    def __init__(self, url: str, login: str, password: str, db_name: str):
+    def __init__(self, url: str, login: str, password: str, db_name: str,
+                 timeout: Optional[float] = None, insert_retries: int = 0,
+                 retry_backoff: float = 1.0, dedup_window: int = 100):
         super().__init__(db_name)
         self.url = url
         self.login = login
         self.password = password
+        self.timeout = timeout
+        self.insert_retries = insert_retries
+        self.retry_backoff = retry_backoff
+        self.dedup_window = dedup_window
 
     def _get_clickhouse_auth(self) -> Tuple[str, str]:
         auth = None
@@ -36,18 +61,28 @@ class ClickhouseDatabase(Database):
             auth = (self.login, self.password)
         return auth
 
-    def _query_clickhouse(self, query_text: str, **params):
+    def _query_url(self, url: str, query_text: str, **params):
         log_data = query_text
         if len(log_data) > self.QUERY_LOG_LIMIT:
             log_data = log_data[:self.QUERY_LOG_LIMIT] + '[...]'
         log_data = log_data.replace('\n', ' ')
         logger.debug('Query ClickHouse: {} >>> {}'.format(params, log_data))
         auth = self._get_clickhouse_auth()
-        r = requests.post(self.url, data=query_text, params=params, auth=auth)
+        r = requests.post(url, data=query_text, params=params, auth=auth,
+                          timeout=self.timeout)
         if r.status_code == 200:
             return r.text
         else:
-            raise ValueError(r.text)
+            raise ClickhouseError(r.status_code, r.text)
+
+    def _query_clickhouse(self, query_text: str, **params):
+        return self._query_url(self.url, query_text, **params)
+
+    def _query_ddl(self, query_text: str):
+        self._query_clickhouse(query_text)
+
+    def _query_data(self, query_text: str):
+        self._query_clickhouse(query_text)
 
     def _upload_clickhouse_data(self, table_name: str, content: str) -> str:
         query = 'INSERT INTO {db}.{table} FORMAT TabSeparatedWithNames' \
@@ -63,11 +98,11 @@ class ClickhouseDatabase(Database):
         query = 'DROP DATABASE IF EXISTS {db}'.format(
             db=self.db_name
         )
-        self._query_clickhouse(query)
+        self._query_ddl(query)
 
     def create_database(self):
-        query = 'CREATE DATABASE {db}'.format(db=self.db_name)
-        self._query_clickhouse(query)
+        query = 'CREATE DATABASE IF NOT EXISTS {db}'.format(db=self.db_name)
+        self._query_ddl(query)
 
     def table_exists(self, table_name: str):
         query = 'SHOW TABLES FROM {db}'.format(db=self.db_name)
@@ -79,21 +114,26 @@ class ClickhouseDatabase(Database):
             db=self.db_name,
             table=table_name
         )
-        self._query_clickhouse(query)
+        self._query_ddl(query)
 
-    def _table_engine(self, date_field: str, sampling_field: str,
-                      primary_key_fields: List[str]):
+    def _table_engine(self, table_name: str, date_field: str,
+                      sampling_field: str, primary_key_fields: List[str]):
         primary_keys = [date_field] + primary_key_fields
-        merge_tree_args = [date_field]
+        engine = 'MergeTree() PARTITION BY toYYYYMM({})'.format(date_field)
+        sampling_expression = None
         if sampling_field:
             sampling_expression = 'cityHash64({})'.format(sampling_field)
             primary_keys.append(sampling_expression)
-            merge_tree_args.append(sampling_expression)
-        primary_keys_expression = '({})'.format(', '.join(primary_keys))
-        merge_tree_args += [primary_keys_expression, '8192']
-        engine = 'MergeTree({merge_tree_args})'.format(
-            merge_tree_args=', '.join(merge_tree_args)
-        )
+        engine += ' ORDER BY ({})'.format(', '.join(primary_keys))
+        if sampling_expression:
+            engine += ' SAMPLE BY {}'.format(sampling_expression)
+        settings = ['index_granularity = 8192']
+        if self.dedup_window:
+            # Plain MergeTree ignores insert_deduplication_token without it
+            settings.append('non_replicated_deduplication_window = {}'.format(
+                self.dedup_window
+            ))
+        engine += ' SETTINGS {}'.format(', '.join(settings))
         return engine
 
     def create_table(self, table_name: str, fields: List[Tuple[str, str]],
@@ -101,10 +141,10 @@ class ClickhouseDatabase(Database):
                      primary_key_fields: List[str]):
         fields_string = ','.join(('{} {}'.format(f, f_type)
                                   for (f, f_type) in fields))
-        engine = self._table_engine(date_field, sampling_field,
+        engine = self._table_engine(table_name, date_field, sampling_field,
                                     primary_key_fields)
         q = '''
-            CREATE TABLE {db}.{table} ({fields})
+            CREATE TABLE IF NOT EXISTS {db}.{table} ({fields})
             ENGINE = {engine}
         '''.format(
             db=self.db_name,
@@ -112,7 +152,29 @@ class ClickhouseDatabase(Database):
             fields=fields_string,
             engine=engine
         )
-        self._query_clickhouse(q)
+        self._query_ddl(q)
+
+    def _versioned_table_engine(self, table_name: str,
+                                version_field: str) -> str:
+        return 'ReplacingMergeTree({})'.format(version_field)
+
+    def create_versioned_table(self, table_name: str,
+                               fields: List[Tuple[str, str]],
+                               key_fields: List[str], version_field: str):
+        fields_string = ','.join(('{} {}'.format(f, f_type)
+                                  for (f, f_type) in fields))
+        q = '''
+            CREATE TABLE IF NOT EXISTS {db}.{table} ({fields})
+            ENGINE = {engine}
+            ORDER BY ({key_fields})
+        '''.format(
+            db=self.db_name,
+            table=table_name,
+            fields=fields_string,
+            engine=self._versioned_table_engine(table_name, version_field),
+            key_fields=', '.join(key_fields)
+        )
+        self._query_ddl(q)
 
     def create_merge_table(self, table_name: str,
                            fields: List[Tuple[str, str]],
@@ -120,7 +182,7 @@ class ClickhouseDatabase(Database):
         fields_string = ','.join(('{} {}'.format(f, f_type)
                                   for (f, f_type) in fields))
         q = '''
-            CREATE TABLE {db}.{table} ({fields})
+            CREATE TABLE IF NOT EXISTS {db}.{table} ({fields})
             ENGINE = Merge({db}, '{merge_re}')
         '''.format(
             db=self.db_name,
@@ -128,26 +190,107 @@ class ClickhouseDatabase(Database):
             fields=fields_string,
             merge_re=merge_re
         )
-        self._query_clickhouse(q)
+        self._query_ddl(q)
+
+    def _tables_schemes(self, table_re: str) \
+            -> Dict[str, Tuple[str, List[Tuple[str, str]], Set[str]]]:
+        tables_query = '''
+            SELECT name, engine
+            FROM system.tables
+            WHERE database = '{db}' AND match(name, '{table_re}')
+            FORMAT TabSeparated
+        '''.format(db=self.db_name, table_re=table_re)
+        columns_query = '''
+            SELECT table, name, type,
+                is_in_partition_key OR is_in_sorting_key
+                    OR is_in_sampling_key
+            FROM system.columns
+            WHERE database = '{db}' AND match(table, '{table_re}')
+            FORMAT TabSeparated
+        '''.format(db=self.db_name, table_re=table_re)
+        schemes = dict()
+        for line in self._query_clickhouse(tables_query).splitlines():
+            table, engine = line.split('\t')
+            schemes[table] = (engine, [], set())
+        for line in self._query_clickhouse(columns_query).splitlines():
+            table, column, column_type, is_key = line.split('\t')
+            if table in schemes:
+                schemes[table][1].append((column, column_type))
+                if is_key == '1':
+                    schemes[table][2].add(column)
+        return schemes
+
+    @staticmethod
+    def _scheme_alterations(current: List[Tuple[str, str]],
+                            fields: List[Tuple[str, str]],
+                            key_columns: Optional[Set[str]] = None) \
+            -> List[str]:
+        current_types = dict(current)
+        alterations = []
+        previous = None
+        for f, f_type in fields:
+            if f not in current_types:
+                position = 'FIRST'
+                if previous:
+                    position = 'AFTER {}'.format(previous)
+                alterations.append('ADD COLUMN IF NOT EXISTS {} {} {}'.format(
+                    f, f_type, position
+                ))
+            elif current_types[f] != f_type:
+                if key_columns and f in key_columns:
+                    logger.warning(
+                        'Key column {} is not modified from {} to {}'.format(
+                            f, current_types[f], f_type
+                        )
+                    )
+                else:
+                    alterations.append('MODIFY COLUMN {} {}'.format(
+                        f, f_type
+                    ))
+            previous = f
+        return alterations
+
+    def migrate_scheme(self, table_re: str,
+                       fields: List[Tuple[str, str]]) -> int:
+        fields = list(fields)
+        migrated = 0
+        schemes = self._tables_schemes(table_re)
+        for table, (engine, columns, key_columns) in schemes.items():
+            if engine not in self.MIGRATABLE_ENGINES:
+                logger.warning('Table {} with engine {} is not '
+                               'migrated'.format(table, engine))
+                continue
+            alterations = self._scheme_alterations(columns, fields,
+                                                   key_columns)
+            if not alterations:
+                continue
+            logger.info('Migrating {}: {}'.format(
+                table, ', '.join(alterations)
+            ))
+            self._query_ddl('ALTER TABLE {db}.{table} {alterations}'.format(
+                db=self.db_name,
+                table=table,
+                alterations=', '.join(alterations)
+            ))
+            migrated += 1
+        return migrated
 
     def is_valid_scheme(self, table_name: str, fields: List[Tuple[str, str]],
                         date_field: str, sampling_field: str,
                         primary_key_fields: List[str]) -> bool:
-        scheme_query = 'SHOW CREATE TABLE {db}.{table}'.format(
-            db=self.db_name,
-            table=table_name
-        )
-        curr_scheme = self._query_clickhouse(scheme_query)  # type:str
-        engine = self._table_engine(date_field, sampling_field,
+        table_re = '^{}$'.format(table_name)
+        scheme = self._tables_schemes(table_re).get(table_name)
+        if scheme is None:
+            return False
+        curr_engine, columns, _ = scheme
+        engine = self._table_engine(table_name, date_field, sampling_field,
                                     primary_key_fields)
-        fields_re = re.compile('\s*,\s*'.join(('{}\s*{}'.format(f, f_type)
-                                               for (f, f_type) in fields)))
-        # TODO: check engine?
-        match = fields_re.search(curr_scheme)
-        return match is not None
+        if engine.split('(')[0] != curr_engine:
+            return False
+        return len(self._scheme_alterations(columns, list(fields))) == 0
 
     def query(self, query_text: str):
-        self._query_clickhouse(query_text)
+        return self._query_clickhouse(query_text)
 
     def _create_table_like(self, source_table: str, new_table: str):
         query = self._query_clickhouse('SHOW CREATE TABLE {db}.{table}'.format(
@@ -159,12 +302,49 @@ class ClickhouseDatabase(Database):
                 'CREATE TABLE {}.{}'.format(self.db_name, source_table),
                 'CREATE TABLE {}.{}'.format(self.db_name, new_table)
             )
-            self._query_clickhouse(new_query)
+            self._query_ddl(new_query)
 
-    def insert(self, table_name: str, tsv_content: str):
-        query = 'INSERT INTO {db}.{table} FORMAT TabSeparatedWithNames' \
-            .format(db=self.db_name, table=table_name)
-        return self._query_clickhouse(tsv_content, query=query)
+    def _insert_query(self, tsv_content: str, shard: Optional[int],
+                      **params):
+        return self._query_clickhouse(tsv_content, **params)
+
+    @property
+    def deduplicates_inserts(self) -> bool:
+        return self.dedup_window > 0
+
+    def _is_retriable(self, error: Exception) -> bool:
+        if isinstance(error, requests.ConnectTimeout):
+            # Nothing is sent when the connection is not established
+            return True
+        if not self.deduplicates_inserts:
+            # A retry after an ambiguous failure could insert a chunk twice
+            return False
+        if isinstance(error, ClickhouseError):
+            return error.retriable
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def insert(self, table_name: str, tsv_content: str,
+               shard: Optional[int] = None,
+               dedup_token: Optional[str] = None):
+        params = {
+            'query': 'INSERT INTO {db}.{table} FORMAT TabSeparatedWithNames'
+                .format(db=self.db_name, table=table_name)
+        }
+        if dedup_token:
+            params['insert_deduplication_token'] = dedup_token
+        attempt = 0
+        while True:
+            try:
+                return self._insert_query(tsv_content, shard, **params)
+            except Exception as e:
+                if attempt >= self.insert_retries or not self._is_retriable(e):
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                logger.warning('Insert into {} failed: {}. '
+                               'Retry {} in {}s'.format(table_name, e,
+                                                        attempt, delay))
+                time.sleep(delay)
 
     def copy_data(self, source_table: str, target_table: str):
         query = '''
@@ -176,7 +356,7 @@ class ClickhouseDatabase(Database):
             from_table=source_table,
             to_table=target_table,
         )
-        self._query_clickhouse(query)
+        self._query_data(query)
 
     def _copy_data_distinct(self, source_table: str, target_table: str,
                             unique_fields: List[str]):
@@ -196,12 +376,13 @@ class ClickhouseDatabase(Database):
             to_table=target_table,
             unique_fields=', '.join(unique_fields)
         )
-        self._query_clickhouse(query)
+        self._query_data(query)
 
     def insert_distinct(self, table_name: str, tsv_content: str,
-                        unique_fields: List[str], temp_table_name: str):
+                        unique_fields: List[str], temp_table_name: str,
+                        shard: Optional[int] = None):
         self.drop_table(temp_table_name)
         self._create_table_like(table_name, temp_table_name)
-        self.insert(temp_table_name, tsv_content)
+        self.insert(temp_table_name, tsv_content, shard)
         self._copy_data_distinct(temp_table_name, table_name, unique_fields)
         pass
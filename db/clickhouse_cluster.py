@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+  clickhouse_cluster.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import datetime
+import logging
+import zlib
+from typing import List, Optional, Tuple
+
+import requests
+
+from .clickhouse import ClickhouseDatabase, ClickhouseError
+
+logger = logging.getLogger(__name__)
+
+
+class ClickhouseUnavailableError(ClickhouseError):
+    def __init__(self, text: str):
+        super().__init__(503, text)
+
+
+class ClickhouseReplica(object):
+    def __init__(self, url: str):
+        self.url = url
+        self.failed_at = None  # type: Optional[datetime.datetime]
+        self.pending_ddl = []  # type: List[str]
+
+    @property
+    def healthy(self) -> bool:
+        return self.failed_at is None
+
+
+class ClickhouseShard(object):
+    def __init__(self, number: int, urls: List[str]):
+        self.number = number
+        self.replicas = [ClickhouseReplica(url) for url in urls]
+        self._next_replica = 0
+
+    def replicas_order(self) -> List[ClickhouseReplica]:
+        start = self._next_replica % len(self.replicas)
+        self._next_replica = start + 1
+        return self.replicas[start:] + self.replicas[:start]
+
+
+class ClickhouseClusterDatabase(ClickhouseDatabase):
+    DISTRIBUTED_PREFIX = 'distributed_'
+    HEALTH_CHECK_TIMEOUT = 5
+
+    def __init__(self, shards: List[List[str]], login: str, password: str,
+                 db_name: str, cluster_name: Optional[str],
+                 sharding_key: str, replicated: bool,
+                 health_check_interval: datetime.timedelta,
+                 timeout: Optional[float] = None, insert_retries: int = 0,
+                 retry_backoff: float = 1.0, dedup_window: int = 100):
+        if len(shards) == 0 or not all(shards):
+            raise ValueError('Every ClickHouse shard needs a replica')
+        super().__init__(shards[0][0], login, password, db_name, timeout,
+                         insert_retries, retry_backoff, dedup_window)
+        self._shards = [ClickhouseShard(i, urls)
+                        for i, urls in enumerate(shards)]
+        self._cluster_name = cluster_name
+        self._sharding_key = sharding_key
+        self._replicated = replicated
+        self._health_check_interval = health_check_interval
+
+    @property
+    def shards_count(self) -> int:
+        return len(self._shards)
+
+    @property
+    def sharding_key(self) -> Optional[str]:
+        return self._sharding_key
+
+    def _all_replicas(self) -> List[ClickhouseReplica]:
+        return [replica
+                for shard in self._shards
+                for replica in shard.replicas]
+
+    def _check_health(self, replica: ClickhouseReplica) -> bool:
+        now = datetime.datetime.now()
+        if now - replica.failed_at < self._health_check_interval:
+            return False
+        try:
+            r = requests.get('{}/ping'.format(replica.url.rstrip('/')),
+                             timeout=self.HEALTH_CHECK_TIMEOUT)
+            healthy = r.status_code == 200
+        except requests.RequestException:
+            healthy = False
+        if healthy:
+            logger.info('ClickHouse replica {} is back'.format(replica.url))
+            replica.failed_at = None
+            return self._replay_ddl(replica)
+        replica.failed_at = now
+        return False
+
+    def _replay_ddl(self, replica: ClickhouseReplica) -> bool:
+        while replica.pending_ddl:
+            query_text = replica.pending_ddl[0]
+            try:
+                self._query_url(replica.url, query_text)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._mark_failed(replica, e)
+                return False
+            except ClickhouseError as e:
+                logger.warning('Failed to replay DDL on {}: {}'.format(
+                    replica.url, e
+                ))
+            replica.pending_ddl.pop(0)
+        return True
+
+    def _is_available(self, replica: ClickhouseReplica) -> bool:
+        return replica.healthy or self._check_health(replica)
+
+    def _available_replicas(self) -> List[ClickhouseReplica]:
+        replicas = [replica for replica in self._all_replicas()
+                    if self._is_available(replica)]
+        if not replicas:
+            raise ClickhouseUnavailableError('No healthy replicas')
+        return replicas
+
+    def _mark_failed(self, replica: ClickhouseReplica,
+                     error: Exception):
+        logger.warning('ClickHouse replica {} failed: {}'.format(
+            replica.url, error
+        ))
+        replica.failed_at = datetime.datetime.now()
+
+    def _query_shard(self, shard: ClickhouseShard, query_text: str,
+                     **params):
+        for replica in shard.replicas_order():
+            if not self._is_available(replica):
+                continue
+            try:
+                return self._query_url(replica.url, query_text, **params)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._mark_failed(replica, e)
+        raise ClickhouseUnavailableError(
+            'No healthy replicas in shard {}'.format(shard.number)
+        )
+
+    def _query_clickhouse(self, query_text: str, **params):
+        return self._query_shard(self._shards[0], query_text, **params)
+
+    def _query_ddl(self, query_text: str):
+        applied = 0
+        for replica in self._all_replicas():
+            if self._is_available(replica):
+                try:
+                    self._query_url(replica.url, query_text)
+                    applied += 1
+                    continue
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._mark_failed(replica, e)
+            logger.warning('DDL is postponed for ClickHouse replica {}'.format(
+                replica.url
+            ))
+            replica.pending_ddl.append(query_text)
+        if applied == 0:
+            raise ClickhouseUnavailableError('No healthy replicas for DDL')
+
+    def _query_data(self, query_text: str):
+        for shard in self._shards:
+            self._query_shard(shard, query_text)
+
+    def database_exists(self):
+        query = 'SHOW DATABASES'
+        for replica in self._available_replicas():
+            dbs = self._query_url(replica.url, query).strip().split('\n')
+            if self.db_name not in dbs:
+                return False
+        return True
+
+    def table_exists(self, table_name: str):
+        query = 'SHOW TABLES FROM {db}'.format(db=self.db_name)
+        for replica in self._available_replicas():
+            tables = self._query_url(replica.url, query).strip().split('\n')
+            if table_name not in tables:
+                return False
+        return True
+
+    def _zookeeper_path(self, table_name: str) -> str:
+        return '/clickhouse/tables/{{shard}}/{db}/{table}'.format(
+            db=self.db_name,
+            table=table_name
+        )
+
+    def _table_engine(self, table_name: str, date_field: str,
+                      sampling_field: str, primary_key_fields: List[str]):
+        engine = super()._table_engine(table_name, date_field,
+                                       sampling_field, primary_key_fields)
+        if not self._replicated:
+            return engine
+        return engine.replace(
+            'MergeTree()',
+            "ReplicatedMergeTree('{path}', '{{replica}}')".format(
+                path=self._zookeeper_path(table_name)
+            ),
+            1
+        )
+
+    @property
+    def deduplicates_inserts(self) -> bool:
+        return self._replicated or super().deduplicates_inserts
+
+    def _versioned_table_engine(self, table_name: str,
+                                version_field: str) -> str:
+        if not self._replicated:
+            return super()._versioned_table_engine(table_name, version_field)
+        return "ReplicatedReplacingMergeTree('{path}', '{{replica}}', " \
+               "{version})".format(path=self._zookeeper_path(table_name),
+                                   version=version_field)
+
+    def _create_table_like(self, source_table: str, new_table: str):
+        query = self._query_clickhouse('SHOW CREATE TABLE {db}.{table}'.format(
+            db=self.db_name,
+            table=source_table
+        ))  # type:str
+        if query:
+            new_query = query.replace(
+                'CREATE TABLE {}.{}'.format(self.db_name, source_table),
+                'CREATE TABLE {}.{}'.format(self.db_name, new_table)
+            ).replace(
+                self._zookeeper_path(source_table),
+                self._zookeeper_path(new_table)
+            )
+            self._query_ddl(new_query)
+
+    def distributed_table_name(self, table_name: str) -> str:
+        return '{}{}'.format(self.DISTRIBUTED_PREFIX, table_name)
+
+    def create_merge_table(self, table_name: str,
+                           fields: List[Tuple[str, str]],
+                           merge_re: str):
+        super().create_merge_table(table_name, fields, merge_re)
+        if not self._cluster_name:
+            return
+        q = '''
+            CREATE TABLE IF NOT EXISTS {db}.{distributed_table}
+            AS {db}.{table}
+            ENGINE = Distributed({cluster}, {db}, {table}, rand())
+        '''.format(
+            db=self.db_name,
+            table=table_name,
+            distributed_table=self.distributed_table_name(table_name),
+            cluster=self._cluster_name
+        )
+        self._query_ddl(q)
+
+    def migrate_scheme(self, table_re: str,
+                       fields: List[Tuple[str, str]]) -> int:
+        migrated = super().migrate_scheme(table_re, fields)
+        if self._cluster_name and table_re.startswith('^'):
+            distributed_re = '^{}{}'.format(self.DISTRIBUTED_PREFIX,
+                                            table_re[1:])
+            migrated += super().migrate_scheme(distributed_re, fields)
+        return migrated
+
+    def shard_for_key(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self.shards_count
+
+    def _insert_query(self, tsv_content: str, shard: Optional[int],
+                      **params):
+        if shard is None:
+            shard = self.shard_for_key(params['query'])
+        return self._query_shard(self._shards[shard], tsv_content, **params)
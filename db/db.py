@@ -12,12 +12,15 @@
 """
 import logging
 from abc import abstractmethod
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 logger = logging.getLogger(__name__)
 
 
 class Database(object):
+    SHARDING_APP_ID = 'app_id'
+    SHARDING_SAMPLING = 'sampling'
+
     def __init__(self, db_name):
         self._db_name = db_name
 
@@ -25,6 +28,14 @@ class Database(object):
     def db_name(self):
         return self._db_name
 
+    @property
+    def shards_count(self) -> int:
+        return 1
+
+    @property
+    def sharding_key(self) -> Optional[str]:
+        return None
+
     @abstractmethod
     def database_exists(self):
         pass
@@ -64,11 +75,14 @@ class Database(object):
         pass
 
     @abstractmethod
-    def query(self, query_text: str):
+    def migrate_scheme(self, table_re: str,
+                       fields: List[Tuple[str, str]]) -> int:
         pass
 
     @abstractmethod
-    def insert(self, table_name: str, tsv_content: str):
+    def insert(self, table_name: str, tsv_content: str,
+               shard: Optional[int] = None,
+               dedup_token: Optional[str] = None):
         pass
 
     @abstractmethod
@@ -77,5 +91,6 @@ class Database(object):
 
     @abstractmethod
     def insert_distinct(self, table_name: str, tsv_content: str,
-                        unique_fields: List[str], temp_table_name: str):
+                        unique_fields: List[str], temp_table_name: str,
+                        shard: Optional[int] = None):
         pass
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+  parquet.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+from typing import Tuple, List, Optional, Dict, Any
+
+import pandas as pd
+from pandas import DataFrame
+
+from .db import Database
+from .tsv import read_tsv, is_int_type, is_float_type, to_datetime, \
+    parse_map
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetDatabase(Database):
+    FORMAT_PARQUET = 'parquet'
+    FORMAT_ARROW = 'arrow'
+    SCHEME_FILE = '_scheme.json'
+    MAP_TYPE = 'Map(String, String)'
+
+    def __init__(self, path: str, db_name: str,
+                 file_format: str = FORMAT_PARQUET):
+        if pa is None:
+            raise ImportError('pyarrow is required for the files database')
+        if file_format not in (self.FORMAT_PARQUET, self.FORMAT_ARROW):
+            raise ValueError('Unknown file format: {}'.format(file_format))
+        super().__init__(db_name)
+        self.path = path
+        self.file_format = file_format
+
+    @property
+    def _db_path(self) -> str:
+        return os.path.join(self.path, self.db_name)
+
+    def _table_path(self, table_name: str) -> str:
+        return os.path.join(self._db_path, table_name)
+
+    def _scheme_path(self, table_name: str) -> str:
+        return os.path.join(self._table_path(table_name), self.SCHEME_FILE)
+
+    def _data_files(self, table_name: str) -> List[str]:
+        table_path = self._table_path(table_name)
+        suffix = '.{}'.format(self.file_format)
+        return sorted(os.path.join(table_path, f)
+                      for f in os.listdir(table_path) if f.endswith(suffix))
+
+    def _new_data_file(self, table_name: str,
+                       dedup_token: Optional[str] = None) -> str:
+        file_name = uuid.uuid4().hex
+        if dedup_token:
+            file_name = re.sub(r'[^\w.-]', '_', dedup_token)
+        return os.path.join(self._table_path(table_name), '{}.{}'.format(
+            file_name, self.file_format
+        ))
+
+    @staticmethod
+    def _write_atomic(file_name: str, write):
+        tmp_file_name = '{}.tmp'.format(file_name)
+        write(tmp_file_name)
+        os.replace(tmp_file_name, file_name)
+
+    def _load_scheme(self, table_name: str) -> Dict[str, Any]:
+        with open(self._scheme_path(table_name), 'r') as f:
+            return json.load(f)
+
+    def _save_scheme(self, table_name: str, scheme: Dict[str, Any]):
+        def write(file_name):
+            with open(file_name, 'w') as f:
+                json.dump(scheme, f, indent=4, sort_keys=True)
+
+        self._write_atomic(self._scheme_path(table_name), write)
+
+    def database_exists(self):
+        return os.path.isdir(self._db_path)
+
+    def drop_database(self):
+        shutil.rmtree(self._db_path, ignore_errors=True)
+
+    def create_database(self):
+        os.makedirs(self._db_path, exist_ok=True)
+
+    def table_exists(self, table_name: str):
+        return os.path.isfile(self._scheme_path(table_name))
+
+    def drop_table(self, table_name: str):
+        shutil.rmtree(self._table_path(table_name), ignore_errors=True)
+
+    def create_table(self, table_name: str, fields: List[Tuple[str, str]],
+                     date_field: str, sampling_field: str,
+                     primary_key_fields: List[str]):
+        os.makedirs(self._table_path(table_name), exist_ok=True)
+        self._save_scheme(table_name, {
+            'fields': list(fields),
+            'date_field': date_field,
+            'sampling_field': sampling_field,
+            'primary_key_fields': primary_key_fields,
+        })
+
+    def create_merge_table(self, table_name: str,
+                           fields: List[Tuple[str, str]],
+                           merge_re: str):
+        os.makedirs(self._table_path(table_name), exist_ok=True)
+        self._save_scheme(table_name, {
+            'fields': list(fields),
+            'merge_re': merge_re,
+        })
+
+    def merged_tables(self, table_name: str) -> List[str]:
+        merge_re = re.compile(self._load_scheme(table_name)['merge_re'])
+        return sorted(t for t in os.listdir(self._db_path)
+                      if t != table_name and merge_re.match(t)
+                      and self.table_exists(t)
+                      and 'merge_re' not in self._load_scheme(t))
+
+    def migrate_scheme(self, table_re: str,
+                       fields: List[Tuple[str, str]]) -> int:
+        fields = [list(f) for f in fields]
+        tables_re = re.compile(table_re)
+        migrated = 0
+        for table_name in os.listdir(self._db_path):
+            if not tables_re.search(table_name) \
+                    or not self.table_exists(table_name):
+                continue
+            scheme = self._load_scheme(table_name)
+            if scheme['fields'] != fields:
+                for file_name in self._data_files(table_name):
+                    self._migrate_data_file(file_name, fields)
+                scheme['fields'] = fields
+                self._save_scheme(table_name, scheme)
+                migrated += 1
+        return migrated
+
+    def _migrate_data_file(self, file_name: str,
+                           fields: List[Tuple[str, str]]):
+        table = self._read_table(file_name, None)
+        arrays = []
+        for f, f_type in fields:
+            arrow_type = self._arrow_type(f_type)
+            if f in table.column_names:
+                column = table.column(f)
+                if column.type != arrow_type:
+                    column = column.cast(arrow_type)
+                arrays.append(column)
+            else:
+                arrays.append(pa.array([None] * table.num_rows,
+                                       type=arrow_type))
+        table = pa.Table.from_arrays(arrays, names=[f for f, _ in fields])
+        self._write_atomic(file_name,
+                           lambda f: self._write_file(table, f))
+
+    def is_valid_scheme(self, table_name: str, fields: List[Tuple[str, str]],
+                        date_field: str, sampling_field: str,
+                        primary_key_fields: List[str]) -> bool:
+        if not self.table_exists(table_name):
+            return False
+        scheme = self._load_scheme(table_name)
+        return scheme['fields'] == [list(f) for f in fields] \
+            and scheme.get('date_field') == date_field \
+            and scheme.get('sampling_field') == sampling_field \
+            and scheme.get('primary_key_fields') == primary_key_fields
+
+    @staticmethod
+    def _arrow_type(db_type: str):
+        if db_type == 'String':
+            return pa.string()
+        elif db_type == ParquetDatabase.MAP_TYPE:
+            return pa.map_(pa.string(), pa.string())
+        elif db_type == 'Date':
+            return pa.date32()
+        elif db_type == 'DateTime':
+            return pa.timestamp('s')
+        elif is_int_type(db_type) or is_float_type(db_type):
+            return pa.from_numpy_dtype(db_type.lower())
+        raise ValueError('Unknown type: {}'.format(db_type))
+
+    def _to_arrow(self, df: DataFrame, fields: List[Tuple[str, str]]):
+        arrays = []
+        for f, f_type in fields:
+            col = df[f]
+            if f_type == 'Date':
+                col = pd.to_datetime(col, format='%Y-%m-%d').dt.date
+            elif f_type == 'DateTime':
+                col = to_datetime(col)
+            elif f_type == self.MAP_TYPE:
+                col = [parse_map(v) for v in col]
+            arrays.append(pa.array(col, type=self._arrow_type(f_type)))
+        return pa.Table.from_arrays(arrays, names=[f for f, _ in fields])
+
+    def _write_file(self, table, file_name: str):
+        if self.file_format == self.FORMAT_PARQUET:
+            pq.write_table(table, file_name)
+        else:
+            feather.write_feather(table, file_name, compression='lz4')
+
+    def _write_table(self, table_name: str, table,
+                     dedup_token: Optional[str] = None):
+        self._write_atomic(self._new_data_file(table_name, dedup_token),
+                           lambda f: self._write_file(table, f))
+
+    def _read_table(self, file_name: str, columns: Optional[List[str]]):
+        if self.file_format == self.FORMAT_PARQUET:
+            return pq.read_table(file_name, columns=columns)
+        return feather.read_table(file_name, columns=columns)
+
+    def _insert_df(self, table_name: str, df: DataFrame,
+                   fields: List[Tuple[str, str]],
+                   dedup_token: Optional[str] = None):
+        if len(df) == 0:
+            return
+        logger.debug('Writing {} rows into {}'.format(len(df), table_name))
+        self._write_table(table_name, self._to_arrow(df, fields),
+                          dedup_token)
+
+    def insert(self, table_name: str, tsv_content: str,
+               shard: Optional[int] = None,
+               dedup_token: Optional[str] = None):
+        fields = self._load_scheme(table_name)['fields']
+        self._insert_df(table_name, read_tsv(tsv_content, fields), fields,
+                        dedup_token)
+
+    def copy_data(self, source_table: str, target_table: str):
+        for file_name in self._data_files(source_table):
+            target_file_name = self._new_data_file(target_table)
+            try:
+                os.link(file_name, target_file_name)
+            except OSError:
+                self._write_atomic(target_file_name,
+                                   lambda f: shutil.copyfile(file_name, f))
+
+    def _existing_keys(self, table_name: str, unique_fields: List[str]):
+        keys = set()
+        for file_name in self._data_files(table_name):
+            table = self._read_table(file_name, unique_fields)
+            keys.update(zip(*(table.column(f).to_pylist()
+                              for f in unique_fields)))
+        return keys
+
+    def insert_distinct(self, table_name: str, tsv_content: str,
+                        unique_fields: List[str], temp_table_name: str,
+                        shard: Optional[int] = None):
+        fields = self._load_scheme(table_name)['fields']
+        df = read_tsv(tsv_content, fields)
+        df.drop_duplicates(unique_fields, inplace=True)
+        existing_keys = self._existing_keys(table_name, unique_fields)
+        if existing_keys:
+            keys = pd.Series(list(zip(*(df[f] for f in unique_fields))),
+                             index=df.index)
+            df = df[~keys.isin(existing_keys)]
+        self._insert_df(table_name, df, fields)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+  sqlite.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Tuple, List, Optional
+
+from pandas import DataFrame
+
+from .db import Database
+from .tsv import read_tsv, is_int_type, is_float_type, to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteDatabase(Database):
+    MERGE_TABLES = '_merge_tables'
+    MERGE_PART_PREFIX = '_merge_part_'
+    COMPOUND_SELECT_LIMIT = 500
+    MERGE_BUCKETS = 64
+
+    def __init__(self, path: str, db_name: str):
+        super().__init__(db_name)
+        self.path = path
+        self._connection = None  # type: Optional[sqlite3.Connection]
+        self._lock = threading.RLock()
+
+    @property
+    def file_name(self) -> str:
+        return os.path.join(self.path, '{}.sqlite3'.format(self.db_name))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._connection = sqlite3.connect(self.file_name,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'name TEXT PRIMARY KEY, merge_re TEXT, fields TEXT)'.format(
+                    self.MERGE_TABLES
+                )
+            )
+        return self._connection
+
+    def _execute(self, query_text: str, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(query_text, parameters).fetchall()
+
+    @staticmethod
+    def _column_type(db_type: str) -> str:
+        # The original type is kept in the declaration to be read back, it
+        # is quoted unless it is a single word like String or UInt64
+        if not re.match(r'^\w+$', db_type):
+            db_type = '"{}"'.format(db_type)
+        if is_int_type(db_type):
+            return 'INTEGER {}'.format(db_type)
+        elif is_float_type(db_type.strip('"')):
+            return 'REAL {}'.format(db_type)
+        return 'TEXT {}'.format(db_type)
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"{}"'.format(name)
+
+    def database_exists(self):
+        return os.path.isfile(self.file_name)
+
+    def drop_database(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.isfile(self.file_name + suffix):
+                    os.remove(self.file_name + suffix)
+
+    def create_database(self):
+        self._connect()
+
+    def _table_type(self, table_name: str) -> Optional[str]:
+        rows = self._execute(
+            'SELECT type FROM sqlite_master WHERE name = ?', (table_name,)
+        )
+        return rows[0][0] if rows else None
+
+    def table_exists(self, table_name: str):
+        return self._table_type(table_name) is not None
+
+    def _columns(self, table_name: str) -> List[Tuple[str, str]]:
+        rows = self._execute('PRAGMA table_info({})'.format(
+            self._quote(table_name)
+        ))
+        return [(row[1], row[2]) for row in rows]
+
+    def _part_name(self, name: str, suffix: str) -> str:
+        if not name.startswith(self.MERGE_PART_PREFIX):
+            name = '{}{}'.format(self.MERGE_PART_PREFIX, name)
+        return '{}#{}'.format(name, suffix)
+
+    def _bucket(self, table_name: str) -> int:
+        return zlib.crc32(table_name.encode('utf-8')) % self.MERGE_BUCKETS
+
+    def _create_union_view(self, connection: sqlite3.Connection, name: str,
+                           columns: str, selects: List[str]):
+        # SQLite limits terms of a compound SELECT, so long unions are split
+        # into nested part views
+        level = 0
+        while len(selects) > self.COMPOUND_SELECT_LIMIT:
+            parts = []
+            for i in range(0, len(selects), self.COMPOUND_SELECT_LIMIT):
+                part_name = self._part_name(name, '{}_{}'.format(
+                    level, len(parts)
+                ))
+                connection.execute('CREATE VIEW {} AS {}'.format(
+                    self._quote(part_name), ' UNION ALL '.join(
+                        selects[i:i + self.COMPOUND_SELECT_LIMIT]
+                    )
+                ))
+                parts.append('SELECT {} FROM {}'.format(
+                    columns, self._quote(part_name)
+                ))
+            selects = parts
+            level += 1
+        connection.execute('CREATE VIEW {} AS {}'.format(
+            self._quote(name), ' UNION ALL '.join(selects)
+        ))
+
+    def _drop_union_view(self, connection: sqlite3.Connection, name: str):
+        connection.execute('DROP VIEW IF EXISTS {}'.format(self._quote(name)))
+        prefix = self._part_name(name, '')
+        parts = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'view' "
+            "AND substr(name, 1, ?) = ?",
+            (len(prefix), prefix)
+        ).fetchall()
+        for (part_name,) in parts:
+            connection.execute('DROP VIEW {}'.format(self._quote(part_name)))
+
+    def _view_exists(self, connection: sqlite3.Connection,
+                     name: str) -> bool:
+        return connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?",
+            (name,)
+        ).fetchone() is not None
+
+    def _refresh_merge_views(self, table_name: Optional[str] = None):
+        # Tables are spread over bucket views, so a created or dropped table
+        # rebuilds its bucket only, and the merge view over the buckets is
+        # rebuilt when a bucket appears or disappears
+        merge_tables = self._execute(
+            'SELECT name, merge_re, fields FROM {}'.format(self.MERGE_TABLES)
+        )
+        tables = [row[0] for row in self._execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )]
+        for name, merge_re, fields in merge_tables:
+            merge_re = re.compile(merge_re)
+            if table_name is not None and not merge_re.match(table_name):
+                continue
+            columns = ', '.join(map(self._quote, fields.split(',')))
+            buckets = dict()
+            for t in sorted(tables):
+                if merge_re.match(t):
+                    buckets.setdefault(self._bucket(t), []).append(t)
+            refreshed = range(self.MERGE_BUCKETS)
+            if table_name is not None:
+                refreshed = [self._bucket(table_name)]
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    changed = table_name is None \
+                        or not self._view_exists(connection, name)
+                    if table_name is None:
+                        self._drop_union_view(connection, name)
+                    for bucket in refreshed:
+                        bucket_name = self._part_name(name, 'b{}'.format(
+                            bucket
+                        ))
+                        if self._view_exists(connection, bucket_name) \
+                                != (bucket in buckets):
+                            changed = True
+                        self._drop_union_view(connection, bucket_name)
+                        if bucket in buckets:
+                            self._create_union_view(
+                                connection, bucket_name, columns,
+                                ['SELECT {} FROM {}'.format(
+                                    columns, self._quote(t)
+                                ) for t in buckets[bucket]]
+                            )
+                    if changed:
+                        self._create_merge_view(connection, name, fields,
+                                                sorted(buckets))
+
+    def _create_merge_view(self, connection: sqlite3.Connection, name: str,
+                           fields: str, buckets: List[int]):
+        columns = ', '.join(map(self._quote, fields.split(',')))
+        selects = ['SELECT {} FROM {}'.format(
+            columns, self._quote(self._part_name(name, 'b{}'.format(bucket)))
+        ) for bucket in buckets]
+        if not selects:
+            selects = ['SELECT {} WHERE 0'.format(', '.join(
+                'NULL AS {}'.format(self._quote(f))
+                for f in fields.split(',')
+            ))]
+        connection.execute('DROP VIEW IF EXISTS {}'.format(self._quote(name)))
+        self._create_union_view(connection, name, columns, selects)
+
+    def drop_table(self, table_name: str):
+        table_type = self._table_type(table_name)
+        if table_type == 'view':
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    self._drop_union_view(connection, table_name)
+            self._execute('DELETE FROM {} WHERE name = ?'.format(
+                self.MERGE_TABLES
+            ), (table_name,))
+        elif table_type == 'table':
+            self._execute('DROP TABLE {}'.format(self._quote(table_name)))
+            self._refresh_merge_views(table_name)
+
+    def create_table(self, table_name: str, fields: List[Tuple[str, str]],
+                     date_field: str, sampling_field: str,
+                     primary_key_fields: List[str]):
+        columns = ', '.join('{} {}'.format(self._quote(f),
+                                           self._column_type(f_type))
+                            for f, f_type in fields)
+        self._execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+            self._quote(table_name), columns
+        ))
+        index_fields = [date_field] + primary_key_fields
+        self._execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+            self._quote('{}_key'.format(table_name)),
+            self._quote(table_name),
+            ', '.join(map(self._quote, index_fields))
+        ))
+        try:
+            self._refresh_merge_views(table_name)
+        except sqlite3.Error:
+            self._execute('DROP TABLE {}'.format(self._quote(table_name)))
+            raise
+
+    def create_merge_table(self, table_name: str,
+                           fields: List[Tuple[str, str]],
+                           merge_re: str):
+        self._execute(
+            'INSERT OR REPLACE INTO {} (name, merge_re, fields) '
+            'VALUES (?, ?, ?)'.format(self.MERGE_TABLES),
+            (table_name, merge_re, ','.join(f for f, _ in fields))
+        )
+        self._refresh_merge_views()
+
+    def migrate_scheme(self, table_re: str,
+                       fields: List[Tuple[str, str]]) -> int:
+        fields = list(fields)
+        tables_re = re.compile(table_re)
+        tables = [row[0] for row in self._execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ) if tables_re.search(row[0])]
+        migrated = 0
+        for table_name in tables:
+            current = dict(self._columns(table_name))
+            missing = [(f, f_type) for f, f_type in fields
+                       if f not in current]
+            for f, f_type in missing:
+                self._execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    self._quote(table_name), self._quote(f),
+                    self._column_type(f_type)
+                ))
+            if missing:
+                migrated += 1
+        merge_tables = self._execute(
+            'SELECT name FROM {}'.format(self.MERGE_TABLES)
+        )
+        for (name,) in merge_tables:
+            if tables_re.search(name):
+                self._execute('UPDATE {} SET fields = ? WHERE name = ?'.format(
+                    self.MERGE_TABLES
+                ), (','.join(f for f, _ in fields), name))
+        self._refresh_merge_views()
+        return migrated
+
+    def is_valid_scheme(self, table_name: str, fields: List[Tuple[str, str]],
+                        date_field: str, sampling_field: str,
+                        primary_key_fields: List[str]) -> bool:
+        expected = [(f, self._column_type(f_type)) for f, f_type in fields]
+        return self._columns(table_name) == expected
+
+    def query(self, query_text: str):
+        return self._execute(query_text)
+
+    def _insert_df(self, table_name: str, df: DataFrame,
+                   fields: List[Tuple[str, str]]):
+        for f, f_type in fields:
+            if f_type == 'DateTime':
+                df[f] = to_datetime(df[f]).dt.strftime('%Y-%m-%d %H:%M:%S')
+        query = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self._quote(table_name),
+            ', '.join(self._quote(f) for f, _ in fields),
+            ', '.join('?' for _ in fields)
+        )
+        rows = df.astype(object).itertuples(index=False, name=None)
+        logger.debug('Inserting {} rows into {}'.format(len(df), table_name))
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(query, rows)
+
+    def _fields(self, table_name: str) -> List[Tuple[str, str]]:
+        return [(f, f_type.split(' ', 1)[-1].strip('"'))
+                for f, f_type in self._columns(table_name)]
+
+    def insert(self, table_name: str, tsv_content: str,
+               shard: Optional[int] = None,
+               dedup_token: Optional[str] = None):
+        field_types = dict(self._fields(table_name))
+        df = read_tsv(tsv_content, field_types.items())
+        self._insert_df(table_name, df,
+                        [(f, field_types[f]) for f in df.columns])
+
+    def copy_data(self, source_table: str, target_table: str):
+        columns = ', '.join(self._quote(f)
+                            for f, _ in self._columns(target_table))
+        self._execute('INSERT INTO {} ({}) SELECT {} FROM {}'.format(
+            self._quote(target_table), columns, columns,
+            self._quote(source_table)
+        ))
+
+    def insert_distinct(self, table_name: str, tsv_content: str,
+                        unique_fields: List[str], temp_table_name: str,
+                        shard: Optional[int] = None):
+        self.drop_table(temp_table_name)
+        self._execute('CREATE TABLE {} ({})'.format(
+            self._quote(temp_table_name),
+            ', '.join('{} {}'.format(self._quote(f), f_type)
+                      for f, f_type in self._columns(table_name))
+        ))
+        self.insert(temp_table_name, tsv_content)
+        columns = ', '.join(self._quote(f)
+                            for f, _ in self._columns(table_name))
+        condition = ' AND '.join('t.{f} IS ins.{f}'.format(f=self._quote(f))
+                                 for f in unique_fields)
+        self._execute('''
+            INSERT INTO {table} ({columns})
+                SELECT {columns}
+                FROM {temp_table} AS ins
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} AS t WHERE {condition}
+                )
+        '''.format(
+            table=self._quote(table_name),
+            temp_table=self._quote(temp_table_name),
+            columns=columns,
+            condition=condition
+        ))
+        self.drop_table(temp_table_name)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+  tsv.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import csv
+import io
+import re
+from typing import List, Tuple
+
+import pandas as pd
+from dateutil.tz import tzlocal
+from pandas import DataFrame, Series
+
+# TODO: Allow customizing
+escape_characters = str.maketrans({
+    '\b': '\\b',
+    '\r': '\\r',
+    '\f': '\\f',
+    '\n': '\\n',
+    '\t': '\\t',
+    '\0': '\\0',
+    '\'': '\\\'',
+    '\\': '\\\\',
+})
+
+_escape_re = re.compile(r'\\(.)')
+_unescape_characters = {
+    'b': '\b',
+    'r': '\r',
+    'f': '\f',
+    'n': '\n',
+    't': '\t',
+    '0': '\0',
+}
+
+
+_map_item_re = re.compile(r"'((?:[^'\\]|\\.)*)':'((?:[^'\\]|\\.)*)'")
+
+
+def _unescape(match) -> str:
+    char = match.group(1)
+    return _unescape_characters.get(char, char)
+
+
+def parse_map(value: str) -> List[Tuple[str, str]]:
+    return [(_escape_re.sub(_unescape, key), _escape_re.sub(_unescape, item))
+            for key, item in _map_item_re.findall(value)]
+
+
+def escape(value: str) -> str:
+    return value.translate(escape_characters)
+
+
+def is_int_type(db_type: str) -> bool:
+    return 'Int' in db_type
+
+
+def is_float_type(db_type: str) -> bool:
+    return db_type in ('Float32', 'Float64')
+
+
+def to_datetime(col: Series) -> Series:
+    if pd.api.types.is_numeric_dtype(col):
+        col = pd.to_datetime(col, unit='s', utc=True)
+        return col.dt.tz_convert(tzlocal()).dt.tz_localize(None)
+    return pd.to_datetime(col, format='%Y-%m-%d %H:%M:%S')
+
+
+def read_tsv(tsv_content: str, fields: List[Tuple[str, str]]) -> DataFrame:
+    # Columns are matched by the header, as tables may keep another order
+    field_types = dict(fields)
+    names = tsv_content.partition('\n')[0].split('\t')
+    unknown = [f for f in names if f not in field_types]
+    if unknown:
+        raise ValueError('Unknown columns: {}'.format(', '.join(unknown)))
+    dtypes = dict()
+    na_values = dict()
+    for f in names:
+        f_type = field_types[f]
+        if f_type == 'String':
+            dtypes[f] = str
+        elif is_int_type(f_type):
+            dtypes[f] = f_type.lower()
+        elif is_float_type(f_type):
+            dtypes[f] = f_type.lower()
+            na_values[f] = ['']
+    df = pd.read_csv(io.StringIO(tsv_content), sep='\t', header=0,
+                     dtype=dtypes, keep_default_na=False,
+                     na_values=na_values, quoting=csv.QUOTE_NONE)
+    for f in names:
+        if field_types[f] == 'String':
+            col = df[f]
+            escaped = col.str.contains('\\', regex=False)
+            if escaped.any():
+                df.loc[escaped, f] = \
+                    col[escaped].str.replace(_escape_re, _unescape,
+                                             regex=True)
+    return df
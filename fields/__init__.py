@@ -10,12 +10,17 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 from .collection import SourcesCollection, DbTableDefinition, \
-    ProcessingDefinition, LoadingDefinition, SchedulingDefinition
+    ProcessingDefinition, LoadingDefinition, SchedulingDefinition, SourcePlan
 from .field import Field, Converter
+from .converters_plan import ConvertersPlan
+from .event_parameters import EventParametersDefinition, \
+    EventParametersExtractor
 
 __all__ = (
     "SourcesCollection",
     "DbTableDefinition", "ProcessingDefinition", "LoadingDefinition",
-    "SchedulingDefinition",
+    "SchedulingDefinition", "SourcePlan",
     "Field", "Converter",
+    "ConvertersPlan",
+    "EventParametersDefinition", "EventParametersExtractor",
 )
@@ -10,9 +10,12 @@
   You may obtain a copy of the License at:
         https://yandex.com/legal/metrica_termsofuse/
 """
-from typing import List, Iterable
+from typing import List, Iterable, Dict, Optional
 
+from .converters_plan import ConvertersPlan
 from .declaration import sources
+from .event_parameters import EventParametersDefinition, \
+    EventParametersExtractor
 from .source import Source
 
 
@@ -45,40 +48,84 @@ class DbTableDefinition(object):
         self.column_types = dict()
         self.field_types = dict()
         self.export_fields = []
+        export_columns = []
         self.sampling_field = None
+        self.sampling_export_field = None
+        escape_fields = []
         for field in source.fields:
             field_name = field.load_name
             if field_name == source.date_field_name:
                 self.date_field = field.db_name
+                self.date_export_field = field_name
             if field_name == source.sampling_field_name:
                 self.sampling_field = field.db_name
+                self.sampling_export_field = field_name
             if field_name in source.key_field_names:
                 self.primary_keys.append(field.db_name)
             self.field_types[field.db_name] = field.db_type
             self.column_types[field_name] = field.db_type
             self.export_fields.append(field_name)
+            export_columns.append(field.db_name)
+            if field.db_type == 'String':
+                escape_fields.append(field_name)
+        self.escape_fields = tuple(escape_fields)
+        # Database columns let the backends match values by name
+        self.tsv_header = '\t'.join(export_columns) + '\n'
 
 
 class ProcessingDefinition(object):
-    def __init__(self, source: Source):
+    def __init__(self, source: Source,
+                 parameters_extractor: Optional[EventParametersExtractor]
+                 = None):
+        self.parameters_extractor = parameters_extractor
         self.field_converters = dict()
         self.field_types = dict()
+        self.int_types = dict()
+        self.fill_values = dict()
+        export_fields = []
         for field in source.fields:
             field_name = field.load_name
             if field.converter:
                 self.field_converters[field_name] = field.converter
             self.field_types[field_name] = field.db_type
+            if 'Int' in field.db_type:
+                self.int_types[field_name] = field.db_type.lower()
+                self.fill_values[field_name] = 0
+            export_fields.append(field_name)
+        self.converters_plan = ConvertersPlan(self.field_converters,
+                                              export_fields)
+
+
+class SourcePlan(object):
+    def __init__(self, source: Source,
+                 event_parameters: Optional[EventParametersDefinition] = None):
+        parameters_extractor = None
+        if source.parameters_field_name is not None \
+                and event_parameters is not None and event_parameters.enabled:
+            source = source.extended(event_parameters.fields())
+            parameters_extractor = \
+                event_parameters.extractor(source.parameters_field_name)
+        self.source_name = source.load_name
+        self.loading_definition = LoadingDefinition(source)
+        self.processing_definition = ProcessingDefinition(
+            source, parameters_extractor
+        )
+        self.db_table_definition = DbTableDefinition(source)
 
 
 class SourcesCollection(object):
-    def __init__(self, requested_sources: List[str]):
+    def __init__(self, requested_sources: List[str],
+                 event_parameters: Optional[EventParametersDefinition] = None):
         self._source_names = []
         self._sources = dict()
+        self._plans = dict()  # type: Dict[str, SourcePlan]
         for source in sources:
             source_name = source.load_name
             if len(requested_sources) == 0 or source_name in requested_sources:
                 self._source_names.append(source_name)
                 self._sources[source_name] = source
+                self._plans[source_name] = SourcePlan(source,
+                                                      event_parameters)
 
     def source_names(self):
         return self._source_names
@@ -86,11 +133,14 @@ class SourcesCollection(object):
     def scheduling_definition(self) -> SchedulingDefinition:
         return SchedulingDefinition(self._sources.values())
 
+    def source_plan(self, source_name) -> SourcePlan:
+        return self._plans[source_name]
+
     def loading_definition(self, source_name) -> LoadingDefinition:
-        return LoadingDefinition(self._sources[source_name])
+        return self._plans[source_name].loading_definition
 
     def processing_definition(self, source_name) -> ProcessingDefinition:
-        return ProcessingDefinition(self._sources[source_name])
+        return self._plans[source_name].processing_definition
 
     def db_table_definition(self, source_name) -> DbTableDefinition:
-        return DbTableDefinition(self._sources[source_name])
+        return self._plans[source_name].db_table_definition
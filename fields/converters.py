@@ -10,43 +10,91 @@
   You may obtain a copy of the License at:
         https://yandex.com/legal/metrica_termsofuse/
 """
-import datetime
+import time
+from typing import Tuple, Callable, Any
 
-import math
+import numpy as np
 from pandas import DataFrame, Series
 
 from .field import Converter
 
+# Every UTC offset change happens at a quarter of an hour boundary
+_OFFSET_BUCKET_SECONDS = 900
 
-def timestamp_to_date(field_name: str):
-    def converter(df: DataFrame) -> Series:
-        def to_date(ts):
-            if math.isnan(ts):
-                return '1970-01-01'
-            return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+_DATE_TIME_SEPARATOR_POSITION = len('1970-01-01')
+_EPOCH_DATE = '1970-01-01'
+_EPOCH_DATETIME = '1970-01-01 00:00:00'
 
-        col = df[field_name]  # type: Series
-        return col.apply(to_date)
 
-    return converter  # type: Converter
+def _local_seconds(col: Series) -> Tuple[np.ndarray, np.ndarray]:
+    values = col.values.astype('float64')
+    nan_mask = np.isnan(values)
+    seconds = np.floor(np.where(nan_mask, 0, values)).astype('int64')
+    buckets = seconds // _OFFSET_BUCKET_SECONDS
+    unique_buckets, inverse = np.unique(buckets, return_inverse=True)
+    offsets = np.array([
+        time.localtime(int(b) * _OFFSET_BUCKET_SECONDS).tm_gmtoff
+        for b in unique_buckets
+    ], dtype='int64')
+    return seconds + offsets[inverse.reshape(-1)], nan_mask
 
 
-def timestamp_to_datetime(field_name: str):
-    def converter(df: DataFrame) -> Series:
-        def to_datetime(ts):
-            if math.isnan(ts):
-                return '1970-01-01 00:00:00'
-            return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+def _format_local_seconds(local_seconds: np.ndarray, nan_mask: np.ndarray,
+                          unit: str, nan_value: str) -> np.ndarray:
+    formatted = np.datetime_as_string(local_seconds.astype('datetime64[s]'),
+                                      unit=unit)
+    if unit == 's' and len(formatted) > 0:
+        chars = formatted.view('uint32').reshape(len(formatted), -1)
+        chars[:, _DATE_TIME_SEPARATOR_POSITION] = ord(' ')
+    formatted = formatted.astype(object)
+    formatted[nan_mask] = nan_value
+    return formatted
 
-        col = df[field_name]  # type: Series
-        return col.apply(to_datetime)
 
-    return converter  # type: Converter
+def _to_date(local_seconds: Tuple[np.ndarray, np.ndarray],
+             col: Series) -> Series:
+    return Series(_format_local_seconds(local_seconds[0], local_seconds[1],
+                                        'D', _EPOCH_DATE),
+                  index=col.index)
 
 
-def str_to_bool(field_name: str):
-    def converter(df: DataFrame) -> Series:
-        col = df[field_name]  # type: Series
-        return col.apply(lambda x: int(x))
+def _to_datetime(local_seconds: Tuple[np.ndarray, np.ndarray],
+                 col: Series) -> Series:
+    return Series(_format_local_seconds(local_seconds[0], local_seconds[1],
+                                        's', _EPOCH_DATETIME),
+                  index=col.index)
+
+
+def _column(col: Series) -> Series:
+    return col
+
+
+def _to_int(col: Series, _: Series) -> Series:
+    return col.astype('int64')
+
+
+class SharedConverter(object):
+    def __init__(self, field_name: str,
+                 intermediate: Callable[[Series], Any],
+                 finalize: Callable[[Any, Series], Series]):
+        self.field_name = field_name
+        self.intermediate = intermediate
+        self.finalize = finalize
 
-    return converter  # type: Converter
+    def __call__(self, df: DataFrame) -> Series:
+        col = df[self.field_name]  # type: Series
+        return self.finalize(self.intermediate(col), col)
+
+
+def timestamp_to_date(field_name: str):
+    return SharedConverter(field_name, _local_seconds,
+                           _to_date)  # type: Converter
+
+
+def timestamp_to_datetime(field_name: str):
+    return SharedConverter(field_name, _local_seconds,
+                           _to_datetime)  # type: Converter
+
+
+def str_to_bool(field_name: str):
+    return SharedConverter(field_name, _column, _to_int)  # type: Converter
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+  converters_plan.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Callable
+
+from pandas import DataFrame
+
+from .converters import SharedConverter
+from .field import Converter
+
+
+class ConvertersGroup(object):
+    def __init__(self, source_field: str, intermediate: Callable):
+        self.source_field = source_field
+        self.intermediate = intermediate
+        self.targets = []  # type: List[Tuple[str, SharedConverter]]
+
+    def apply(self, df: DataFrame):
+        col = df[self.source_field]
+        shared = self.intermediate(col)
+        for name, converter in self.targets:
+            df[name] = converter.finalize(shared, col)
+
+
+class ConvertersPlan(object):
+    def __init__(self, converters: Dict[str, Converter],
+                 export_fields: List[str]):
+        groups = OrderedDict()
+        self.independent_converters = []  # type: List[Tuple[str, Converter]]
+        for name, converter in sorted(converters.items()):
+            if isinstance(converter, SharedConverter):
+                key = (converter.field_name, converter.intermediate)
+                if key not in groups:
+                    groups[key] = ConvertersGroup(*key)
+                groups[key].targets.append((name, converter))
+            else:
+                self.independent_converters.append((name, converter))
+        self.groups = self._sort_groups(list(groups.values()))
+        self.export_fields = frozenset(export_fields)
+
+    @staticmethod
+    def _sort_groups(groups: List[ConvertersGroup]) \
+            -> List[ConvertersGroup]:
+        producers = dict()
+        for group in groups:
+            for name, _ in group.targets:
+                producers[name] = group
+        ordered = []
+        visiting = set()
+        visited = set()
+
+        def visit(group: ConvertersGroup):
+            if id(group) in visited:
+                return
+            if id(group) in visiting:
+                raise ValueError('Cyclic converters for {}'.format(
+                    group.source_field
+                ))
+            visiting.add(id(group))
+            producer = producers.get(group.source_field)
+            if producer is not None and producer is not group:
+                visit(producer)
+            visiting.remove(id(group))
+            visited.add(id(group))
+            ordered.append(group)
+
+        for group in groups:
+            visit(group)
+        return ordered
+
+    def apply(self, df: DataFrame) -> DataFrame:
+        for group in self.groups:
+            group.apply(df)
+        for name, converter in self.independent_converters:
+            df[name] = converter(df)
+        unused = [col for col in df.columns if col not in self.export_fields]
+        if unused:
+            df.drop(unused, axis=1, inplace=True)
+        return df
@@ -138,7 +138,7 @@ _event_key = [
     "device_id_hash",
 ]
 _events_source = Source("events", "events", "event_date", "appmetrica_device_id",
-                        _event_key, False, _event_fields)
+                        _event_key, False, _event_fields, "event_json")
 
 
 _push_token_fields = _sdk_device_fields + _app_fields + [
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+  event_parameters.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import json
+import logging
+from typing import List, Dict, Tuple, Optional, Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from db.tsv import escape_characters, is_int_type
+from .field import Field
+from .helpers import optional
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+ALL_KEYS = '*'
+TYPED_FIELD_TYPES = (
+    'String',
+    'Int8', 'Int16', 'Int32', 'Int64',
+    'UInt8', 'UInt16', 'UInt32', 'UInt64',
+)
+
+
+def _parse(value) -> Optional[dict]:
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = _loads(value)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _to_string(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _format_map(params: Optional[dict], keys: Optional[frozenset]) -> str:
+    if not params:
+        return '{}'
+    items = []
+    for key, value in params.items():
+        if keys is not None and key not in keys:
+            continue
+        value = _to_string(value)
+        if value is None:
+            continue
+        items.append("'{}':'{}'".format(
+            key.translate(escape_characters),
+            value.translate(escape_characters)
+        ))
+    return '{' + ','.join(items) + '}'
+
+
+class EventParametersDefinition(object):
+    def __init__(self, typed_fields: List[Tuple[str, str, str]],
+                 map_field: Optional[str] = None,
+                 map_keys: Optional[Dict[str, Any]] = None):
+        self.typed_fields = [tuple(f) for f in typed_fields]
+        for key, _, db_type in self.typed_fields:
+            if db_type not in TYPED_FIELD_TYPES:
+                raise ValueError(
+                    'Unsupported type {} of event parameter "{}", '
+                    'expected one of: {}'.format(
+                        db_type, key, ', '.join(TYPED_FIELD_TYPES)
+                    )
+                )
+        self.map_field = map_field
+        self.map_keys = map_keys or dict()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.typed_fields) or self.map_field is not None
+
+    def fields(self) -> List[Field]:
+        fields = [optional(self._typed_load_name(key), (db_name, db_type),
+                           generated=True)
+                  for key, db_name, db_type in self.typed_fields]
+        if self.map_field is not None:
+            fields.append(optional(self._map_load_name(),
+                                   (self.map_field, 'Map(String, String)'),
+                                   generated=True))
+        return fields
+
+    @staticmethod
+    def _typed_load_name(key: str) -> str:
+        return 'event_json.{}'.format(key)
+
+    def _map_load_name(self) -> str:
+        return 'event_json.{}'.format(self.map_field)
+
+    def extractor(self, source_field: str) -> 'EventParametersExtractor':
+        typed_fields = [(self._typed_load_name(key), key, db_type)
+                        for key, _, db_type in self.typed_fields]
+        map_field = None
+        if self.map_field is not None:
+            map_field = self._map_load_name()
+        map_keys = dict()
+        for app_id, keys in self.map_keys.items():
+            map_keys[str(app_id)] = \
+                None if keys == ALL_KEYS else frozenset(keys)
+        return EventParametersExtractor(source_field, typed_fields,
+                                        map_field, map_keys)
+
+
+class EventParametersExtractor(object):
+    def __init__(self, source_field: str,
+                 typed_fields: List[Tuple[str, str, str]],
+                 map_field: Optional[str],
+                 map_keys: Dict[str, Optional[frozenset]]):
+        self.source_field = source_field
+        self.typed_fields = typed_fields
+        self.map_field = map_field
+        self.map_keys = map_keys
+
+    def _app_map_keys(self, app_id: str) -> Optional[frozenset]:
+        if app_id in self.map_keys:
+            return self.map_keys[app_id]
+        return self.map_keys.get(ALL_KEYS)
+
+    @staticmethod
+    def _typed_column(values: List[Any], db_type: str, index) -> Series:
+        if db_type == 'String':
+            return Series([_to_string(v) for v in values], index=index,
+                          dtype=object)
+        # Booleans are stored as numbers and invalid numbers as nulls
+        values = [float(v) if isinstance(v, bool) else v for v in values]
+        column = pd.to_numeric(Series(values, index=index, dtype=object),
+                               errors='coerce')
+        if not is_int_type(db_type):
+            return column
+        # Numbers out of the column type range are invalid as well
+        column = np.trunc(column.astype('float64'))
+        limits = np.iinfo(db_type.lower())
+        # The upper bound is exclusive, as 64-bit limits are rounded up
+        return column.where((column >= limits.min)
+                            & (column < float(limits.max) + 1))
+
+    def apply(self, df: DataFrame, app_id: str) -> DataFrame:
+        logger.debug('Extracting event parameters')
+        if self.source_field in df.columns:
+            parsed = [_parse(v) for v in df[self.source_field].values]
+        else:
+            parsed = [None] * len(df)
+        for name, key, db_type in self.typed_fields:
+            values = [p.get(key) if p is not None else None for p in parsed]
+            df[name] = self._typed_column(values, db_type, df.index)
+        if self.map_field is not None:
+            keys = self._app_map_keys(str(app_id))
+            df[self.map_field] = Series([_format_map(p, keys) for p in parsed],
+                                        index=df.index, dtype=object)
+        return df
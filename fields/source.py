@@ -20,7 +20,8 @@ class Source(object):
                  sampling_field_name: Optional[str],
                  key_field_names: List[str],
                  date_ignored: bool,
-                 fields: List[Field]):
+                 fields: List[Field],
+                 parameters_field_name: Optional[str] = None):
         self.load_name = load_name
         self.db_name = db_name
         self.date_field_name = date_field_name
@@ -28,3 +29,10 @@ class Source(object):
         self.key_field_names = key_field_names
         self.date_ignored = date_ignored
         self.fields = sorted(fields, key=lambda f: f.load_name)
+        self.parameters_field_name = parameters_field_name
+
+    def extended(self, fields: List[Field]) -> 'Source':
+        return Source(self.load_name, self.db_name, self.date_field_name,
+                      self.sampling_field_name, self.key_field_names,
+                      self.date_ignored, self.fields + fields,
+                      self.parameters_field_name)
@@ -11,8 +11,10 @@
 """
 from .client import LogsApiClient
 from .loader import Loader, LogsApiPartsCountError
+from .memory_governor import MemoryGovernor
 
 __all__ = (
     "LogsApiClient",
     "Loader", "LogsApiPartsCountError",
+    "MemoryGovernor",
 )
@@ -11,7 +11,6 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 import datetime
-import json
 import logging
 from typing import List, Dict, Any, Optional
 
@@ -40,7 +39,7 @@ class LogsApiClient(object):
             version=version.__version__,
         )
 
-    def app_creation_date(self, app_id: str) -> str:
+    def app_creation_date(self, app_id: str) -> Optional[datetime.date]:
         url = '{host}/management/v1/application/{app_id}'.format(
             host=self.host,
             app_id=app_id
@@ -58,13 +57,19 @@ class LogsApiClient(object):
         create_date = None
         try:
             if r.status_code == 200:
-                app_details = json.load(r.text)
+                app_details = r.json()
                 if ('application' in app_details) \
                         and ('create_date' in app_details['application']):
                     create_date = app_details['application']['create_date']
-        except json.JSONDecodeError:
+            else:
+                logger.warning('Failed to fetch details of "{}": [{}] '
+                               '{}'.format(app_id, r.status_code, r.text))
+        except ValueError:
             pass
-        return create_date
+        if not create_date:
+            return None
+        # Both date and date-time values start with a date
+        return datetime.datetime.strptime(create_date[:10], '%Y-%m-%d').date()
 
     def logs_api_export(self, app_id: str, table: str, fields: List[str],
                         date_since: Optional[datetime.datetime],
@@ -11,16 +11,19 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 import datetime
+import hashlib
 import logging
 import re
 import time
-from typing import List, Generator, Tuple, Optional
+from typing import List, Generator, Tuple, Optional, Callable, Iterable, \
+    BinaryIO
 
 import pandas as pd
 import requests
 from pandas import DataFrame
 
 from .client import LogsApiClient, LogsApiError
+from .memory_governor import MemoryGovernor
 
 logger = logging.getLogger(__name__)
 
@@ -31,19 +34,109 @@ class LogsApiPartsCountError(LogsApiError):
 
 class Loader(object):
     def __init__(self, client: LogsApiClient, chunk_size: int,
-                 allow_cached: bool = False):
+                 allow_cached: bool = False,
+                 memory_governor: Optional[MemoryGovernor] = None):
         self.client = client
         self._chunk_size = chunk_size
+        self._memory_governor = memory_governor
         self._allow_cached = allow_cached
         self._progress_re = re.compile(r'.*Progress is (?P<progress>\d+)%.*')
 
-    def _split_response(self, response: requests.Response):
+    def _split_response(self, response: requests.Response, table: str,
+                        adaptive_chunks: bool = True):
         compression = response.headers.get('Content-Encoding')
-        return pd.read_csv(response.raw,
-                           compression=compression,
-                           encoding=response.encoding,
-                           chunksize=self._chunk_size,
-                           iterator=True)
+        return self._split_csv(response.raw, compression, response.encoding,
+                               table, adaptive_chunks)
+
+    def _split_csv(self, stream, compression: Optional[str],
+                   encoding: Optional[str], table: str,
+                   adaptive_chunks: bool = True) \
+            -> Generator[DataFrame, None, None]:
+        reader = pd.read_csv(stream,
+                             compression=compression,
+                             encoding=encoding,
+                             chunksize=self._chunk_size,
+                             iterator=True)
+        if self._memory_governor is None or not adaptive_chunks:
+            yield from reader
+            return
+        # TextFileReader is not a context manager in older pandas
+        try:
+            while True:
+                # Time between chunk requests includes processing of the
+                # previous chunk by the consumer
+                started_at = time.monotonic()
+                try:
+                    df = reader.get_chunk(
+                        self._memory_governor.chunk_size(table)
+                    )
+                except StopIteration:
+                    return
+                # The consumer changes the frame in place
+                rows_count = len(df)
+                chunk_bytes = self._memory_governor.frame_bytes(df)
+                yield df
+                self._memory_governor.observe(
+                    table, rows_count, chunk_bytes,
+                    time.monotonic() - started_at
+                )
+        finally:
+            reader.close()
+
+    @staticmethod
+    def _record_end(buffer: bytearray, limit: int) -> int:
+        # Newlines inside quoted values do not end a CSV record
+        position = buffer.rfind(b'\n', 0, limit)
+        quotes = buffer.count(b'"', 0, position) if position >= 0 else 0
+        while position >= 0 and quotes % 2 != 0:
+            previous = buffer.rfind(b'\n', 0, position)
+            quotes -= buffer.count(b'"', max(previous, 0), position)
+            position = previous
+        return position + 1
+
+    def _split_response_raw(self, response: requests.Response,
+                            chunk_bytes: int) -> Generator[bytes, None, None]:
+        return self._split_raw(response.iter_content(chunk_size=1 << 20),
+                               chunk_bytes)
+
+    def _split_raw(self, contents: Iterable[bytes],
+                   chunk_bytes: int) -> Generator[bytes, None, None]:
+        header = None
+        buffer = bytearray()
+        for content in contents:
+            buffer.extend(content)
+            if header is None:
+                header_end = buffer.find(b'\n') + 1
+                if header_end == 0:
+                    continue
+                header = bytes(buffer[:header_end])
+                del buffer[:header_end]
+            while len(buffer) >= chunk_bytes:
+                record_end = self._record_end(buffer, len(buffer))
+                if record_end == 0:
+                    break
+                yield header + bytes(buffer[:record_end])
+                del buffer[:record_end]
+        if header is not None and buffer.strip():
+            yield header + bytes(buffer)
+
+    @staticmethod
+    def _response_body(response: requests.Response,
+                       skip_header: bool) -> Generator[bytes, None, None]:
+        contents = response.iter_content(chunk_size=1 << 20)
+        if not skip_header:
+            yield from contents
+            return
+        buffer = b''
+        for content in contents:
+            if buffer is None:
+                yield content
+                continue
+            buffer += content
+            header_end = buffer.find(b'\n') + 1
+            if header_end > 0:
+                yield buffer[header_end:]
+                buffer = None
 
     def _process_error(self, status_code: int, text: str, parts_count: int,
                        progress: int, first_request: bool) \
@@ -72,12 +165,12 @@ class Loader(object):
             raise ValueError('[{}] {}'.format(status_code, text))
         return progress, first_request
 
-    def load(self, app_id: str, table: str, fields: List[str],
-             date_since: Optional[datetime.datetime],
-             date_until: Optional[datetime.datetime],
-             date_dimension: Optional[str],
-             parts_count: int = 1) \
-            -> Generator[DataFrame, None, None]:
+    def _load(self, app_id: str, table: str, fields: List[str],
+              date_since: Optional[datetime.datetime],
+              date_until: Optional[datetime.datetime],
+              date_dimension: Optional[str],
+              parts_count: int,
+              split: Callable[[requests.Response], Iterable]):
         part_number = 0
         first_request = True
         progress = None
@@ -96,13 +189,75 @@ class Loader(object):
                     logger.info('Processing part {} from {}'.format(
                         part_number, parts_count
                     ))
-                lines_count = 0
-                for df in self._split_response(r):
-                    yield df
-                    lines_count += len(df)
-                    logger.info('Lines loaded: {}'.format(lines_count))
+                yield from split(r)
                 part_number += 1
             except LogsApiError as e:
                 progress, first_request = \
                     self._process_error(e.status_code, e.text, parts_count,
                                         progress, first_request)
+
+    def load(self, app_id: str, table: str, fields: List[str],
+             date_since: Optional[datetime.datetime],
+             date_until: Optional[datetime.datetime],
+             date_dimension: Optional[str],
+             parts_count: int = 1,
+             adaptive_chunks: bool = True) \
+            -> Generator[DataFrame, None, None]:
+        lines_count = 0
+        for df in self._load(app_id, table, fields, date_since, date_until,
+                             date_dimension, parts_count,
+                             lambda r: self._split_response(
+                                 r, table, adaptive_chunks
+                             )):
+            yield df
+            lines_count += len(df)
+            logger.info('Lines loaded: {}'.format(lines_count))
+
+    def load_raw(self, app_id: str, table: str, fields: List[str],
+                 date_since: Optional[datetime.datetime],
+                 date_until: Optional[datetime.datetime],
+                 date_dimension: Optional[str],
+                 parts_count: int = 1,
+                 chunk_bytes: int = 16 << 20) \
+            -> Generator[bytes, None, None]:
+        bytes_count = 0
+        for raw_chunk in self._load(
+                app_id, table, fields, date_since, date_until,
+                date_dimension, parts_count,
+                lambda r: self._split_response_raw(r, chunk_bytes)):
+            yield raw_chunk
+            bytes_count += len(raw_chunk)
+            logger.info('Bytes loaded: {}'.format(bytes_count))
+
+    def spool(self, app_id: str, table: str, fields: List[str],
+              date_since: Optional[datetime.datetime],
+              date_until: Optional[datetime.datetime],
+              date_dimension: Optional[str],
+              spool_file: BinaryIO,
+              parts_count: int = 1) -> str:
+        # Parts are written as a single CSV with the header of the first one
+        digest = hashlib.blake2b(digest_size=16)
+        lines_count = 0
+        for content in self._load(
+                app_id, table, fields, date_since, date_until,
+                date_dimension, parts_count,
+                lambda r: self._response_body(r, spool_file.tell() > 0)):
+            spool_file.write(content)
+            digest.update(content)
+            lines_count += content.count(b'\n')
+        logger.info('Lines loaded: {}'.format(lines_count))
+        return '{}:{}'.format(lines_count, digest.hexdigest())
+
+    def read_spooled(self, spool_file: BinaryIO, table: str) \
+            -> Generator[DataFrame, None, None]:
+        if spool_file.seek(0, 2) == 0:
+            return
+        spool_file.seek(0)
+        yield from self._split_csv(spool_file, None, 'utf-8', table)
+
+    def read_spooled_raw(self, spool_file: BinaryIO,
+                         chunk_bytes: int = 16 << 20) \
+            -> Generator[bytes, None, None]:
+        spool_file.seek(0)
+        yield from self._split_raw(iter(lambda: spool_file.read(1 << 20), b''),
+                                   chunk_bytes)
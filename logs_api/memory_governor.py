@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+  memory_governor.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from pandas import DataFrame
+
+logger = logging.getLogger(__name__)
+
+
+def process_rss() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class _SourceStats(object):
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.bytes_per_row = None  # type: Optional[float]
+        self.seconds_per_row = None  # type: Optional[float]
+
+
+class MemoryGovernor(object):
+    SMOOTHING = 0.3
+    MIN_CHUNK_SIZE = 1000
+
+    def __init__(self, initial_chunk_size: int, memory_budget: int,
+                 target_latency: float = 0, rss_limit: int = 0,
+                 max_chunk_size: Optional[int] = None):
+        self._initial_chunk_size = initial_chunk_size
+        self._memory_budget = memory_budget
+        self._target_latency = target_latency
+        self._rss_limit = rss_limit
+        self._max_chunk_size = max_chunk_size or initial_chunk_size * 10
+        self._stats = dict()  # type: Dict[str, _SourceStats]
+        self._lock = threading.Lock()
+
+    def _source_stats(self, source: str) -> _SourceStats:
+        if source not in self._stats:
+            self._stats[source] = _SourceStats(self._initial_chunk_size)
+        return self._stats[source]
+
+    def chunk_size(self, source: str) -> int:
+        with self._lock:
+            return self._source_stats(source).chunk_size
+
+    def _smooth(self, previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return previous + self.SMOOTHING * (value - previous)
+
+    def _desired_chunk_size(self, stats: _SourceStats) -> int:
+        chunk_size = self._memory_budget / stats.bytes_per_row
+        if self._target_latency > 0 and stats.seconds_per_row:
+            chunk_size = min(chunk_size,
+                             self._target_latency / stats.seconds_per_row)
+        rss = process_rss() if self._rss_limit > 0 else None
+        if rss is not None and rss > self._rss_limit:
+            chunk_size = min(chunk_size, stats.chunk_size / 2)
+        return int(max(self.MIN_CHUNK_SIZE,
+                       min(self._max_chunk_size, chunk_size)))
+
+    @staticmethod
+    def frame_bytes(df: DataFrame) -> int:
+        return int(df.memory_usage(index=False, deep=True).sum())
+
+    def observe(self, source: str, rows_count: int, chunk_bytes: int,
+                seconds: float):
+        if rows_count == 0:
+            return
+        with self._lock:
+            stats = self._source_stats(source)
+            stats.bytes_per_row = self._smooth(stats.bytes_per_row,
+                                               chunk_bytes / rows_count)
+            stats.seconds_per_row = self._smooth(stats.seconds_per_row,
+                                                 seconds / rows_count)
+            chunk_size = self._desired_chunk_size(stats)
+            # Small corrections are not worth a log line or a resize
+            if abs(chunk_size - stats.chunk_size) * 10 < stats.chunk_size:
+                return
+            logger.info('Chunk size of "{}" changed from {} to {} rows '
+                        '({:.0f} bytes per row)'.format(
+                            source, stats.chunk_size, chunk_size,
+                            stats.bytes_per_row
+                        ))
+            stats.chunk_size = chunk_size
@@ -13,11 +13,15 @@
 import logging
 
 import settings
-from db import ClickhouseDatabase
-from fields import SourcesCollection
-from logs_api import LogsApiClient, Loader
-from state import FileStateStorage
-from updater import Updater, Scheduler, UpdatesController
+from db import Database, ClickhouseDatabase, ClickhouseClusterDatabase, \
+    ParquetDatabase, SqliteDatabase
+from fields import SourcesCollection, EventParametersDefinition
+from logs_api import LogsApiClient, Loader, MemoryGovernor
+from state import StateStorage, FileStateStorage, JournalStateStorage, \
+    SqliteStateStorage, ClickhouseStateStorage
+from updater import Updater, Scheduler, UpdatesController, InsertExecutor, \
+    ChunkProcessingPool, UpdatesExecutor, LeaseManager, FileLeaseStore, \
+    StaticSharding, WakeUp
 from updater.db_controllers_collection import DbControllersCollection
 
 logger = logging.getLogger(__name__)
@@ -31,56 +35,188 @@ def setup_logging(debug: bool = False) -> None:
     logging.basicConfig(format=logging_format, level=level)
 
 
+def create_database() -> Database:
+    if settings.DATABASE_BACKEND == 'files':
+        return ParquetDatabase(
+            path=settings.FILES_PATH,
+            db_name=settings.CH_DATABASE,
+            file_format=settings.FILES_FORMAT
+        )
+    if settings.DATABASE_BACKEND == 'sqlite':
+        return SqliteDatabase(
+            path=settings.SQLITE_PATH,
+            db_name=settings.CH_DATABASE
+        )
+    if settings.CH_SHARDS:
+        shards = [[s] if isinstance(s, str) else s for s in settings.CH_SHARDS]
+        return ClickhouseClusterDatabase(
+            shards=shards,
+            login=settings.CH_USER,
+            password=settings.CH_PASSWORD,
+            db_name=settings.CH_DATABASE,
+            cluster_name=settings.CH_CLUSTER,
+            sharding_key=settings.CH_SHARDING_KEY,
+            replicated=settings.CH_REPLICATED,
+            health_check_interval=settings.CH_HEALTH_CHECK_INTERVAL,
+            timeout=settings.CH_TIMEOUT,
+            insert_retries=settings.CH_INSERT_RETRIES,
+            retry_backoff=settings.CH_RETRY_BACKOFF,
+            dedup_window=settings.CH_DEDUP_WINDOW
+        )
+    return ClickhouseDatabase(
+        url=settings.CH_HOST,
+        login=settings.CH_USER,
+        password=settings.CH_PASSWORD,
+        db_name=settings.CH_DATABASE,
+        timeout=settings.CH_TIMEOUT,
+        insert_retries=settings.CH_INSERT_RETRIES,
+        retry_backoff=settings.CH_RETRY_BACKOFF,
+        dedup_window=settings.CH_DEDUP_WINDOW
+    )
+
+
+def create_state_storage(database: Database) -> StateStorage:
+    if settings.STATE_STORAGE == 'journal':
+        return JournalStateStorage(
+            file_name=settings.STATE_FILE_PATH,
+            compact_records=settings.STATE_COMPACT_RECORDS
+        )
+    if settings.STATE_STORAGE == 'clickhouse':
+        return ClickhouseStateStorage(
+            db=database,
+            table_name=settings.STATE_TABLE
+        )
+    if settings.STATE_STORAGE == 'sqlite':
+        return SqliteStateStorage(
+            file_name=settings.STATE_SQLITE_PATH
+        )
+    return FileStateStorage(
+        file_name=settings.STATE_FILE_PATH
+    )
+
+
+def check_settings() -> None:
+    if settings.STATE_STORAGE == 'clickhouse' \
+            and settings.DATABASE_BACKEND != 'clickhouse':
+        raise ValueError('STATE_STORAGE "clickhouse" requires '
+                         'DATABASE_BACKEND "clickhouse", got "{}"'.format(
+                             settings.DATABASE_BACKEND
+                         ))
+
+
 def main():
     setup_logging(debug=settings.DEBUG)
+    check_settings()
 
+    event_parameters = EventParametersDefinition(
+        typed_fields=settings.EVENT_JSON_FIELDS,
+        map_field=settings.EVENT_JSON_MAP,
+        map_keys=settings.EVENT_JSON_MAP_KEYS
+    )
     sources_collection = SourcesCollection(
-        requested_sources=settings.SOURCES
+        requested_sources=settings.SOURCES,
+        event_parameters=event_parameters
     )
     logs_api_client = LogsApiClient(
         token=settings.TOKEN,
         host=settings.LOGS_API_HOST
     )
+    memory_governor = None
+    if settings.CHUNK_MEMORY_BUDGET > 0:
+        memory_governor = MemoryGovernor(
+            initial_chunk_size=settings.REQUEST_CHUNK_ROWS,
+            memory_budget=settings.CHUNK_MEMORY_BUDGET,
+            target_latency=settings.CHUNK_TARGET_SECONDS,
+            rss_limit=settings.MEMORY_LIMIT
+        )
     logs_api_loader = Loader(
         client=logs_api_client,
         chunk_size=settings.REQUEST_CHUNK_ROWS,
-        allow_cached=settings.ALLOW_CACHED
-    )
-    database = ClickhouseDatabase(
-        url=settings.CH_HOST,
-        login=settings.CH_USER,
-        password=settings.CH_PASSWORD,
-        db_name=settings.CH_DATABASE
+        allow_cached=settings.ALLOW_CACHED,
+        memory_governor=memory_governor
     )
+    database = create_database()
     db_controllers_collection = DbControllersCollection(
         db=database,
         sources_collection=sources_collection
     )
-    state_storage = FileStateStorage(
-        file_name=settings.STATE_FILE_PATH
+    state_storage = create_state_storage(database)
+    insert_executor = InsertExecutor(
+        workers_count=settings.INSERT_WORKERS,
+        queue_size=settings.INSERT_QUEUE_SIZE
     )
+    processing_pool = None
+    if settings.PROCESS_WORKERS > 0:
+        processing_pool = ChunkProcessingPool(
+            workers_count=settings.PROCESS_WORKERS,
+            queue_size=settings.PROCESS_WORKERS
+        )
     updater = Updater(
-        loader=logs_api_loader
+        loader=logs_api_loader,
+        insert_executor=insert_executor,
+        processing_pool=processing_pool,
+        chunk_bytes=settings.PROCESS_CHUNK_BYTES,
+        skip_unchanged=settings.SKIP_UNCHANGED,
+        spool_path=settings.SPOOL_PATH
     )
+    sharding = StaticSharding(settings.SHARD_INDEX, settings.SHARDS_COUNT)
+    app_ids = [app_id for app_id in settings.APP_IDS if sharding.owns(app_id)]
+    logger.info('Updating {} of {} applications'.format(
+        len(app_ids), len(settings.APP_IDS)
+    ))
     scheduler = Scheduler(
         state_storage=state_storage,
-        app_ids=settings.APP_IDS,
+        app_ids=app_ids,
         update_interval=settings.UPDATE_INTERVAL,
         update_limit=settings.UPDATE_LIMIT,
         fresh_limit=settings.FRESH_LIMIT,
+        incremental_sources=settings.INCREMENTAL_SOURCES,
+        incremental_lag=settings.INCREMENTAL_LAG,
+        backfill_days=settings.BACKFILL_DAYS,
+        backfill_rows=settings.BACKFILL_ROWS,
+        creation_date_provider=logs_api_client.app_creation_date,
+        app_info_ttl=settings.APP_INFO_TTL,
+        empty_recheck_interval=settings.EMPTY_RECHECK_INTERVAL,
+        source_intervals=settings.SOURCE_UPDATE_INTERVALS,
+        app_intervals=settings.APP_UPDATE_INTERVALS,
         scheduling_definition=sources_collection.scheduling_definition()
     )
+    updates_executor = UpdatesExecutor(
+        workers_count=settings.UPDATE_WORKERS,
+        logs_api_limit=settings.UPDATE_LOGS_API_LIMIT,
+        app_limit=settings.UPDATE_APP_LIMIT,
+        db_limit=settings.UPDATE_DB_LIMIT,
+        cycle_deadline=settings.CYCLE_DEADLINE
+    )
+    lease_manager = None
+    if settings.LEASE_PATH:
+        lease_manager = LeaseManager(
+            store=FileLeaseStore(settings.LEASE_PATH),
+            ttl=settings.LEASE_TTL
+        )
+    wake_up = WakeUp()
+    wake_up.install_signal_handler()
+    if settings.WAKE_UP_SOCKET:
+        wake_up.listen(settings.WAKE_UP_SOCKET)
     updates_controller = UpdatesController(
         scheduler=scheduler,
         updater=updater,
         sources_collection=sources_collection,
-        db_controllers_collection=db_controllers_collection
+        db_controllers_collection=db_controllers_collection,
+        updates_executor=updates_executor,
+        lease_manager=lease_manager,
+        wake_up=wake_up
     )
     try:
         updates_controller.run()
     except KeyboardInterrupt:
         logger.info('Interrupted')
         return
+    finally:
+        wake_up.close()
+        insert_executor.shutdown()
+        if processing_pool is not None:
+            processing_pool.shutdown()
 
 
 if __name__ == '__main__':
@@ -21,6 +21,9 @@ load_dotenv(dotenv_path)
 
 DEFAULT_STATE_FILE_PATH = join(dirname(__file__), 'data', 'state.json')
 DEFAULT_LOGS_API_HOST = 'https://api.appmetrica.yandex.ru'
+DEFAULT_FILES_PATH = join(dirname(__file__), 'data', 'files')
+DEFAULT_SQLITE_PATH = join(dirname(__file__), 'data')
+DEFAULT_STATE_SQLITE_PATH = join(dirname(__file__), 'data', 'state.sqlite3')
 
 DEBUG = environ.get('DEBUG', '0') == '1'
 
@@ -31,14 +34,76 @@ SOURCES = json.loads(environ.get('SOURCES', '[]'))  # empty == all
 UPDATE_LIMIT = timedelta(days=int(environ.get('UPDATE_LIMIT', '30')))
 FRESH_LIMIT = timedelta(days=int(environ.get('FRESH_LIMIT', '7')))
 UPDATE_INTERVAL = timedelta(hours=int(environ.get('UPDATE_INTERVAL', '12')))
+EMPTY_RECHECK_INTERVAL = timedelta(hours=int(
+    environ.get('EMPTY_RECHECK_INTERVAL', '48')
+))
+APP_INFO_TTL = timedelta(hours=int(environ.get('APP_INFO_TTL', '168')))
+SOURCE_UPDATE_INTERVALS = {
+    source: timedelta(hours=hours) for source, hours
+    in json.loads(environ.get('SOURCE_UPDATE_INTERVALS', '{}')).items()
+}
+APP_UPDATE_INTERVALS = {
+    str(app_id): timedelta(hours=hours) for app_id, hours
+    in json.loads(environ.get('APP_UPDATE_INTERVALS', '{}')).items()
+}
+WAKE_UP_SOCKET = environ.get('WAKE_UP_SOCKET')  # empty == SIGUSR1 only
+UPDATE_WORKERS = int(environ.get('UPDATE_WORKERS', '1'))
+UPDATE_LOGS_API_LIMIT = int(environ.get('UPDATE_LOGS_API_LIMIT', '0'))
+UPDATE_APP_LIMIT = int(environ.get('UPDATE_APP_LIMIT', '0'))
+UPDATE_DB_LIMIT = int(environ.get('UPDATE_DB_LIMIT', '0'))
+CYCLE_DEADLINE = timedelta(minutes=int(environ.get('CYCLE_DEADLINE', '0')))
+BACKFILL_DAYS = int(environ.get('BACKFILL_DAYS', '1'))  # 1 == by days
+BACKFILL_ROWS = int(environ.get('BACKFILL_ROWS', '10000000'))
+INCREMENTAL_SOURCES = json.loads(environ.get('INCREMENTAL_SOURCES', '[]'))
+INCREMENTAL_LAG = timedelta(seconds=int(environ.get('INCREMENTAL_LAG', '300')))
+LEASE_PATH = environ.get('LEASE_PATH')  # empty == no leasing
+LEASE_TTL = timedelta(seconds=int(environ.get('LEASE_TTL', '300')))
+SHARD_INDEX = int(environ.get('SHARD_INDEX', '0'))
+SHARDS_COUNT = int(environ.get('SHARDS_COUNT', '1'))
 REQUEST_CHUNK_ROWS = int(environ.get('REQUEST_CHUNK_ROWS', '25000'))
+CHUNK_MEMORY_BUDGET = int(environ.get('CHUNK_MEMORY_BUDGET', '0'))  # 0 == off
+CHUNK_TARGET_SECONDS = float(environ.get('CHUNK_TARGET_SECONDS', '0'))
+MEMORY_LIMIT = int(environ.get('MEMORY_LIMIT', '0'))  # 0 == unlimited
+INSERT_WORKERS = int(environ.get('INSERT_WORKERS', '1'))
+INSERT_QUEUE_SIZE = int(environ.get('INSERT_QUEUE_SIZE', '1'))
+PROCESS_WORKERS = int(environ.get('PROCESS_WORKERS', '0'))  # 0 == inline
+PROCESS_CHUNK_BYTES = int(environ.get('PROCESS_CHUNK_BYTES',
+                                      str(16 * 1024 * 1024)))
+SKIP_UNCHANGED = environ.get('SKIP_UNCHANGED', '0') == '1'
+SPOOL_PATH = environ.get('SPOOL_PATH')  # empty == system temp directory
 
+EVENT_JSON_FIELDS = json.loads(environ.get('EVENT_JSON_FIELDS', '[]'))
+EVENT_JSON_MAP = environ.get('EVENT_JSON_MAP')  # empty == no map column
+EVENT_JSON_MAP_KEYS = json.loads(environ.get('EVENT_JSON_MAP_KEYS', '{}'))
+
+STATE_STORAGE = environ.get('STATE_STORAGE', 'file')
 STATE_FILE_PATH = environ.get('STATE_FILE_PATH', DEFAULT_STATE_FILE_PATH)
+STATE_SQLITE_PATH = environ.get('STATE_SQLITE_PATH',
+                               DEFAULT_STATE_SQLITE_PATH)
+STATE_TABLE = environ.get('STATE_TABLE', 'loader_state')
+STATE_COMPACT_RECORDS = int(environ.get('STATE_COMPACT_RECORDS', '1000'))
 
 LOGS_API_HOST = environ.get('LOGS_API_HOST', DEFAULT_LOGS_API_HOST)
 ALLOW_CACHED = environ.get('ALLOW_CACHED', '0') == '1'
 
+DATABASE_BACKEND = environ.get('DATABASE_BACKEND', 'clickhouse')
+
 CH_HOST = environ.get('CH_HOST', 'http://localhost:8123')
 CH_USER = environ.get('CH_USER')
 CH_PASSWORD = environ.get('CH_PASSWORD')
 CH_DATABASE = environ.get('CH_DATABASE', 'mobile')
+CH_TIMEOUT = float(environ.get('CH_TIMEOUT', '300'))
+CH_INSERT_RETRIES = int(environ.get('CH_INSERT_RETRIES', '3'))
+CH_RETRY_BACKOFF = float(environ.get('CH_RETRY_BACKOFF', '1'))
+CH_DEDUP_WINDOW = int(environ.get('CH_DEDUP_WINDOW', '100'))
+CH_SHARDS = json.loads(environ.get('CH_SHARDS', '[]'))  # empty == CH_HOST
+CH_CLUSTER = environ.get('CH_CLUSTER')
+CH_SHARDING_KEY = environ.get('CH_SHARDING_KEY', 'app_id')
+CH_REPLICATED = environ.get('CH_REPLICATED', '0') == '1'
+CH_HEALTH_CHECK_INTERVAL = timedelta(
+    seconds=int(environ.get('CH_HEALTH_CHECK_INTERVAL', '30')))
+
+FILES_PATH = environ.get('FILES_PATH', DEFAULT_FILES_PATH)
+FILES_FORMAT = environ.get('FILES_FORMAT', 'parquet')
+
+SQLITE_PATH = environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
@@ -12,9 +12,15 @@
 from .state import State, AppIdState
 from .storage import StateStorage
 from .file_storage import FileStateStorage
+from .journal_storage import JournalStateStorage
+from .sqlite_storage import SqliteStateStorage
+from .clickhouse_storage import ClickhouseStateStorage
 
 __all__ = (
     "State", "AppIdState",
     "StateStorage",
     "FileStateStorage",
+    "JournalStateStorage",
+    "SqliteStateStorage",
+    "ClickhouseStateStorage",
 )
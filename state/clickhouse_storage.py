@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+  clickhouse_storage.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional, List, Tuple
+
+from db import ClickhouseDatabase
+from db.tsv import escape
+from .json_serialization import DATE_FORMAT, _to_unix_time, _from_unix_time
+from .state import State, AppIdState
+from .storage import StateStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ClickhouseStateStorage(StateStorage):
+    KIND_DATE_UPDATE = 'date_update'
+    KIND_LAST_UPDATE_TIME = 'last_update_time'
+    KIND_PROPERTY_PREFIX = 'property:'
+    NO_DATE = date(1970, 1, 1)
+    # Queries are sent to the first shard of a cluster, so the state is
+    # written there as well
+    SHARD = 0
+
+    FIELDS = [
+        ('Kind', 'String'),
+        ('AppID', 'String'),
+        ('Date', 'Date'),
+        ('Value', 'String'),
+        ('Version', 'UInt64'),
+    ]
+    KEY_FIELDS = ['Kind', 'AppID', 'Date']
+
+    def __init__(self, db: ClickhouseDatabase, table_name: str):
+        self._db = db
+        self.table_name = table_name
+        self._prepared = False
+        self._lock = threading.RLock()
+
+    def _prepare(self):
+        if self._prepared:
+            return
+        if not self._db.database_exists():
+            self._db.create_database()
+        self._db.create_versioned_table(self.table_name, self.FIELDS,
+                                        self.KEY_FIELDS, 'Version')
+        self._prepared = True
+
+    @staticmethod
+    def _quote(value: str) -> str:
+        return "'{}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+
+    def _write(self, rows: List[Tuple[str, str, date, str]]):
+        if not rows:
+            return
+        self._prepare()
+        # Microseconds keep the latest write on top after merges
+        version = int(time.time() * 1000000)
+        lines = ['\t'.join(f for f, _ in self.FIELDS)]
+        lines.extend('\t'.join((
+            escape(kind), escape(app_id), p_date.strftime(DATE_FORMAT),
+            escape(value), str(version)
+        )) for kind, app_id, p_date, value in rows)
+        self._db.insert(self.table_name, '\n'.join(lines) + '\n',
+                        shard=self.SHARD)
+
+    def _read(self, condition: str = '1') -> State:
+        self._prepare()
+        content = self._db.query('''
+            SELECT Kind, AppID, Date, argMax(Value, Version) AS LastValue
+            FROM {db}.{table}
+            GROUP BY Kind, AppID, Date
+            HAVING {condition}
+            FORMAT TabSeparated
+        '''.format(db=self._db.db_name, table=self.table_name,
+                   condition=condition))
+        state = State()
+        app_id_states = dict()
+        for line in content.splitlines():
+            if not line:
+                continue
+            kind, app_id, p_date, value = line.split('\t')
+            if kind == self.KIND_LAST_UPDATE_TIME:
+                state.last_update_time = _from_unix_time(int(value))
+                continue
+            if app_id not in app_id_states:
+                app_id_states[app_id] = AppIdState(app_id)
+                state.app_id_states.append(app_id_states[app_id])
+            if kind.startswith(self.KIND_PROPERTY_PREFIX):
+                # Empty value marks a removed property
+                if value:
+                    key = kind[len(self.KIND_PROPERTY_PREFIX):]
+                    app_id_states[app_id].properties[key] = value
+            elif kind == self.KIND_DATE_UPDATE:
+                p_date = datetime.strptime(p_date, DATE_FORMAT).date()
+                app_id_states[app_id].date_updates[p_date] = \
+                    _from_unix_time(int(value))
+        return state
+
+    def load(self) -> State:
+        with self._lock:
+            return self._read()
+
+    def load_pending(self, since: date, archived_at: datetime) -> State:
+        # Nothing is cached, as other loaders update the state concurrently
+        condition = "Kind != {kind} OR Date >= {since} " \
+                    "OR LastValue != {archived}".format(
+                        kind=self._quote(self.KIND_DATE_UPDATE),
+                        since=self._quote(since.strftime(DATE_FORMAT)),
+                        archived=self._quote(
+                            str(_to_unix_time(archived_at))
+                        ))
+        with self._lock:
+            return self._read(condition)
+
+    def save(self, state: State):
+        rows = [(self.KIND_DATE_UPDATE, s.app_id, p_date,
+                 str(_to_unix_time(updated_at)))
+                for s in state.app_id_states
+                for p_date, updated_at in s.date_updates.items()]
+        rows.extend((self.KIND_PROPERTY_PREFIX + key, s.app_id, self.NO_DATE,
+                     value)
+                    for s in state.app_id_states
+                    for key, value in s.properties.items())
+        if state.last_update_time is not None:
+            rows.append((self.KIND_LAST_UPDATE_TIME, '', self.NO_DATE,
+                         str(_to_unix_time(state.last_update_time))))
+        with self._lock:
+            self._write(rows)
+
+    def save_date_update(self, state: State, app_id: str, p_date: date,
+                         updated_at: datetime):
+        with self._lock:
+            self._write([(self.KIND_DATE_UPDATE, app_id, p_date,
+                          str(_to_unix_time(updated_at)))])
+
+    def save_last_update_time(self, state: State):
+        with self._lock:
+            self._write([(self.KIND_LAST_UPDATE_TIME, '', self.NO_DATE,
+                          str(_to_unix_time(state.last_update_time)))])
+
+    def save_property(self, state: State, app_id: str, key: str,
+                      value: Optional[str]):
+        with self._lock:
+            self._write([(self.KIND_PROPERTY_PREFIX + key, app_id,
+                          self.NO_DATE, value or '')])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+  journal_storage.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import Dict, Any, Tuple, Optional
+
+from .json_serialization import StateJSONEncoder, StateJSONDecoder, \
+    DATE_FORMAT, _to_unix_time, _from_unix_time
+from .state import State, AppIdState
+from .storage import StateStorage
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStateStorage(StateStorage):
+    JOURNAL_SUFFIX = '.journal'
+
+    def __init__(self, file_name: str, compact_records: int = 1000,
+                 fsync: bool = True):
+        self.file_name = file_name
+        self.journal_file_name = file_name + self.JOURNAL_SUFFIX
+        self._compact_records = compact_records
+        self._fsync = fsync
+        self._journal = None
+        self._journal_records = 0
+        self._lock = threading.RLock()
+
+    def _sync(self, f):
+        f.flush()
+        if self._fsync:
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, state: State):
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        tmp_file_name = self.file_name + '.tmp'
+        with open(tmp_file_name, 'w') as f:
+            json.dump(state, f, sort_keys=True, cls=StateJSONEncoder)
+            self._sync(f)
+        os.replace(tmp_file_name, self.file_name)
+
+    def _load_snapshot(self) -> State:
+        try:
+            with open(self.file_name, 'r') as f:
+                return json.load(f, cls=StateJSONDecoder)
+        except FileNotFoundError:
+            return State()
+        except json.JSONDecodeError:
+            logger.warning('State snapshot is broken, starting from scratch')
+            return State()
+
+    @staticmethod
+    def _app_id_state(state: State, app_id: str) -> AppIdState:
+        for app_id_state in state.app_id_states:
+            if app_id_state.app_id == app_id:
+                return app_id_state
+        app_id_state = AppIdState(app_id)
+        state.app_id_states.append(app_id_state)
+        return app_id_state
+
+    def _replay(self, state: State, record: Dict[str, Any]):
+        if 'last_update_time' in record:
+            state.last_update_time = \
+                _from_unix_time(record['last_update_time'])
+            return
+        app_id_state = self._app_id_state(state, record['app_id'])
+        if 'property' in record:
+            if record['value'] is None:
+                app_id_state.properties.pop(record['property'], None)
+            else:
+                app_id_state.properties[record['property']] = record['value']
+            return
+        p_date = datetime.strptime(record['date'], DATE_FORMAT).date()
+        app_id_state.date_updates[p_date] = \
+            _from_unix_time(record['updated_at'])
+
+    def _replay_journal(self, state: State) -> Tuple[int, bool]:
+        records_count = 0
+        broken = False
+        try:
+            f = open(self.journal_file_name, 'r')
+        except FileNotFoundError:
+            return records_count, broken
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last record can be torn by a crash
+                    logger.warning('Skipping broken state journal record')
+                    broken = True
+                    continue
+                self._replay(state, record)
+                records_count += 1
+        return records_count, broken
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _compact(self, state: State):
+        self._close_journal()
+        self._write_snapshot(state)
+        # Records replayed over the new snapshot change nothing, so a crash
+        # before truncating the journal is harmless
+        open(self.journal_file_name, 'w').close()
+        self._journal_records = 0
+
+    def load(self) -> State:
+        with self._lock:
+            self._close_journal()
+            state = self._load_snapshot()
+            self._journal_records, broken = self._replay_journal(state)
+            if broken or self._journal_records >= self._compact_records:
+                self._compact(state)
+            return state
+
+    def save(self, state: State):
+        with self._lock:
+            self._compact(state)
+
+    def _append(self, state: State, record: Dict[str, Any]):
+        with self._lock:
+            if self._journal is None:
+                os.makedirs(os.path.dirname(self.journal_file_name),
+                            exist_ok=True)
+                self._journal = open(self.journal_file_name, 'a')
+            self._journal.write(json.dumps(record, sort_keys=True) + '\n')
+            self._sync(self._journal)
+            self._journal_records += 1
+            if self._journal_records >= self._compact_records:
+                self._compact(state)
+
+    def save_date_update(self, state: State, app_id: str, p_date: date,
+                         updated_at: datetime):
+        self._append(state, {
+            'app_id': app_id,
+            'date': p_date.strftime(DATE_FORMAT),
+            'updated_at': _to_unix_time(updated_at),
+        })
+
+    def save_last_update_time(self, state: State):
+        self._append(state, {
+            'last_update_time': _to_unix_time(state.last_update_time),
+        })
+
+    def save_property(self, state: State, app_id: str, key: str,
+                      value: Optional[str]):
+        self._append(state, {
+            'app_id': app_id,
+            'property': key,
+            'value': value,
+        })
@@ -42,6 +42,7 @@ class StateJSONEncoder(JSONEncoder):
             return {
                 "app_id": o.app_id,
                 "date_updates": date_updates,
+                "properties": o.properties,
             }
         elif isinstance(o, State):
             return {
@@ -62,7 +63,8 @@ def _parse_date_updates(json_object: Dict[str, Any]):
 
 def _parse_app_id_state(json_object: Dict[str, Any]):
     date_updates = _parse_date_updates(json_object["date_updates"])
-    return AppIdState(json_object["app_id"], date_updates)
+    return AppIdState(json_object["app_id"], date_updates,
+                      json_object.get("properties"))
 
 
 def _parse_state(json_object: Dict[str, Any]):
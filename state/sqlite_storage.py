@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+  sqlite_storage.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Optional, List, Tuple
+
+from .json_serialization import DATE_FORMAT, _to_unix_time, _from_unix_time
+from .state import State, AppIdState
+from .storage import StateStorage
+
+
+class SqliteStateStorage(StateStorage):
+    LAST_UPDATE_TIME = 'last_update_time'
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._connection = None  # type: Optional[sqlite3.Connection]
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            self._connection = sqlite3.connect(self.file_name,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS date_updates ('
+                    'app_id TEXT NOT NULL, '
+                    'date TEXT NOT NULL, '
+                    'updated_at INTEGER NOT NULL, '
+                    'PRIMARY KEY (app_id, date))'
+                )
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS date_updates_updated_at '
+                    'ON date_updates (updated_at)'
+                )
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS date_updates_date '
+                    'ON date_updates (date)'
+                )
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS app_properties ('
+                    'app_id TEXT NOT NULL, '
+                    'key TEXT NOT NULL, '
+                    'value TEXT NOT NULL, '
+                    'PRIMARY KEY (app_id, key))'
+                )
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS meta ('
+                    'key TEXT PRIMARY KEY, value)'
+                )
+        return self._connection
+
+    def _execute(self, query_text: str, parameters=()) -> List[Tuple]:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(query_text, parameters).fetchall()
+
+    def _executemany(self, query_text: str, rows):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(query_text, rows)
+
+    def _state(self, rows: List[Tuple[str, str, int]]) -> State:
+        app_id_states = dict()
+        for app_id, p_date, updated_at in rows:
+            if app_id not in app_id_states:
+                app_id_states[app_id] = AppIdState(app_id)
+            p_date = datetime.strptime(p_date, DATE_FORMAT).date()
+            app_id_states[app_id].date_updates[p_date] = \
+                _from_unix_time(updated_at)
+        properties = self._execute(
+            'SELECT app_id, key, value FROM app_properties'
+        )
+        for app_id, key, value in properties:
+            if app_id not in app_id_states:
+                app_id_states[app_id] = AppIdState(app_id)
+            app_id_states[app_id].properties[key] = value
+        last_update_time = self._execute(
+            'SELECT value FROM meta WHERE key = ?', (self.LAST_UPDATE_TIME,)
+        )
+        state = State(app_id_states=list(app_id_states.values()))
+        if last_update_time and last_update_time[0][0] is not None:
+            state.last_update_time = _from_unix_time(last_update_time[0][0])
+        return state
+
+    def load(self) -> State:
+        return self._state(self._execute(
+            'SELECT app_id, date, updated_at FROM date_updates'
+        ))
+
+    def load_pending(self, since: date, archived_at: datetime) -> State:
+        # Every branch of the union is a range over an index, while a single
+        # condition with OR and <> scans the whole table
+        archived_at = _to_unix_time(archived_at)
+        return self._state(self._execute(
+            'SELECT app_id, date, updated_at FROM date_updates '
+            'WHERE date >= ? '
+            'UNION SELECT app_id, date, updated_at FROM date_updates '
+            'WHERE updated_at < ? '
+            'UNION SELECT app_id, date, updated_at FROM date_updates '
+            'WHERE updated_at > ?',
+            (since.strftime(DATE_FORMAT), archived_at, archived_at)
+        ))
+
+    def save(self, state: State):
+        # Rows missing in the state are kept, as it may be loaded partially
+        rows = [(s.app_id, p_date.strftime(DATE_FORMAT),
+                 _to_unix_time(updated_at))
+                for s in state.app_id_states
+                for p_date, updated_at in s.date_updates.items()]
+        self._executemany(
+            'INSERT OR REPLACE INTO date_updates (app_id, date, updated_at) '
+            'VALUES (?, ?, ?)', rows
+        )
+        properties = [(s.app_id, key, value)
+                      for s in state.app_id_states
+                      for key, value in s.properties.items()]
+        self._executemany(
+            'INSERT OR REPLACE INTO app_properties (app_id, key, value) '
+            'VALUES (?, ?, ?)', properties
+        )
+        if state.last_update_time is not None:
+            self.save_last_update_time(state)
+
+    def save_date_update(self, state: State, app_id: str, p_date: date,
+                         updated_at: datetime):
+        self._execute(
+            'INSERT OR REPLACE INTO date_updates (app_id, date, updated_at) '
+            'VALUES (?, ?, ?)',
+            (app_id, p_date.strftime(DATE_FORMAT), _to_unix_time(updated_at))
+        )
+
+    def save_last_update_time(self, state: State):
+        self._execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            (self.LAST_UPDATE_TIME, _to_unix_time(state.last_update_time))
+        )
+
+    def save_property(self, state: State, app_id: str, key: str,
+                      value: Optional[str]):
+        if value is None:
+            self._execute(
+                'DELETE FROM app_properties WHERE app_id = ? AND key = ?',
+                (app_id, key)
+            )
+            return
+        self._execute(
+            'INSERT OR REPLACE INTO app_properties (app_id, key, value) '
+            'VALUES (?, ?, ?)', (app_id, key, value)
+        )
@@ -18,12 +18,15 @@ class AppIdState(object):
     __slots__ = [
         "app_id",
         "date_updates",
+        "properties",
     ]
 
     def __init__(self, app_id: str,
-                 date_updates: Optional[Dict[date, datetime]] = None):
+                 date_updates: Optional[Dict[date, datetime]] = None,
+                 properties: Optional[Dict[str, str]] = None):
         self.app_id = app_id
         self.date_updates = date_updates or dict()
+        self.properties = properties or dict()
 
 
 class State(object):
@@ -11,6 +11,8 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 from abc import abstractmethod
+from datetime import date, datetime
+from typing import Optional
 
 from .state import State
 
@@ -23,3 +25,19 @@ class StateStorage(object):
     @abstractmethod
     def save(self, state: State):
         pass
+
+    def load_pending(self, since: date, archived_at: datetime) -> State:
+        # At least dates since the given one and the not archived ones
+        return self.load()
+
+    def save_date_update(self, state: State, app_id: str, p_date: date,
+                         updated_at: datetime):
+        self.save(state)
+
+    def save_last_update_time(self, state: State):
+        self.save(state)
+
+    def save_property(self, state: State, app_id: str, key: str,
+                      value: Optional[str]):
+        # None value removes the property
+        self.save(state)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+  test_clickhouse_cluster.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import datetime
+
+from db import ClickhouseClusterDatabase
+from state import ClickhouseStateStorage, State
+
+SHARDS = [['http://shard0'], ['http://shard1'], ['http://shard2']]
+
+
+def _database(queries) -> ClickhouseClusterDatabase:
+    db = ClickhouseClusterDatabase(SHARDS, '', '', 'db', None, 'app_id',
+                                   False, datetime.timedelta(seconds=60))
+
+    def query_url(url, query_text, **params):
+        queries.append((url, params.get('query', query_text)))
+        if query_text == 'SHOW DATABASES':
+            return 'db\n'
+        return ''
+
+    db._query_url = query_url
+    return db
+
+
+def test_state_reads_and_writes_go_to_one_shard():
+    queries = []
+    db = _database(queries)
+    insert_query = 'INSERT INTO db.state FORMAT TabSeparatedWithNames'
+    assert db.shard_for_key(insert_query) != ClickhouseStateStorage.SHARD
+
+    storage = ClickhouseStateStorage(db, 'state')
+    storage.save_property(State(), '1', 'key', 'value')
+    storage.load()
+
+    data_urls = {url for url, query_text in queries
+                 if query_text.startswith('INSERT')
+                 or query_text.lstrip().startswith('SELECT Kind')}
+    assert data_urls == {SHARDS[ClickhouseStateStorage.SHARD][0]}
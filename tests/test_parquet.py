@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+  test_parquet.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import pytest
+
+from db import ParquetDatabase
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+FIELDS = [
+    ('EventDate', 'Date'),
+    ('AppID', 'UInt64'),
+    ('EventName', 'String'),
+]
+
+
+def test_migrate_existing_files(tmpdir):
+    db = ParquetDatabase(str(tmpdir), 'test')
+    db.create_database()
+    db.create_table('events_1', FIELDS, 'EventDate', None, ['AppID'])
+    db.insert('events_1', 'EventDate\tAppID\tEventName\n'
+                          '2017-01-01\t1\tname\n')
+    fields = FIELDS + [('Duration', 'Float64')]
+    assert db.migrate_scheme('^events.*', fields) == 1
+    db.insert('events_1', 'EventDate\tAppID\tEventName\tDuration\n'
+                          '2017-01-02\t2\tname\t1.5\n'
+                          '2017-01-02\t3\tname\t\n')
+
+    rows = []
+    for file_name in db._data_files('events_1'):
+        table = pq.read_table(file_name)
+        assert table.column_names == [f for f, _ in fields]
+        rows.extend(zip(table.column('AppID').to_pylist(),
+                        table.column('Duration').to_pylist()))
+    assert sorted(rows) == [(1, None), (2, 1.5), (3, None)]
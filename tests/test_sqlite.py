@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+  test_sqlite.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+from db import SqliteDatabase
+
+FIELDS = [
+    ('EventDate', 'Date'),
+    ('AppID', 'UInt64'),
+    ('EventName', 'String'),
+]
+
+
+def _database(tmpdir) -> SqliteDatabase:
+    db = SqliteDatabase(str(tmpdir), 'test')
+    db.create_database()
+    db.create_merge_table('events_all', FIELDS, '^events.*')
+    return db
+
+
+def test_merge_view_over_many_tables(tmpdir):
+    db = _database(tmpdir)
+    tables_count = SqliteDatabase.COMPOUND_SELECT_LIMIT + 10
+    for i in range(tables_count):
+        table_name = 'events_{}'.format(i)
+        db.create_table(table_name, FIELDS, 'EventDate', None, ['AppID'])
+        db.insert(table_name, 'EventDate\tAppID\tEventName\n'
+                              '2017-01-01\t{}\tname\n'.format(i))
+    assert db.query('SELECT count(*) FROM events_all') == [(tables_count,)]
+
+    db.drop_table('events_0')
+    assert db.query('SELECT count(*) FROM events_all') == \
+        [(tables_count - 1,)]
+
+
+def test_insert_into_migrated_table(tmpdir):
+    db = _database(tmpdir)
+    db.create_table('events_1', FIELDS, 'EventDate', None, ['AppID'])
+    fields = [('AppVersion', 'String')] + FIELDS
+    db.migrate_scheme('^events.*', fields)
+    db.insert('events_1', 'AppVersion\tEventDate\tAppID\tEventName\n'
+                          '1.0\t2017-01-01\t1\tname\n')
+    assert db.query('SELECT AppVersion, AppID, EventName FROM events_1') == \
+        [('1.0', 1, 'name')]
+    assert db.query('SELECT AppVersion FROM events_all') == [('1.0',)]
+
+
+def test_map_field(tmpdir):
+    db = _database(tmpdir)
+    fields = FIELDS + [('Parameters', 'Map(String, String)'),
+                       ('Duration', 'Float64')]
+    db.create_table('events_1', fields, 'EventDate', None, ['AppID'])
+    db.insert('events_1', 'EventDate\tAppID\tEventName\tParameters\tDuration\n'
+                          "2017-01-01\t1\tname\t{'a':'b'}\t1.5\n")
+    assert db.query('SELECT Parameters, Duration FROM events_1') == \
+        [("{'a':'b'}", 1.5)]
+    assert db.is_valid_scheme('events_1', fields, 'EventDate', None,
+                              ['AppID'])
+
+
+def test_create_table_refreshes_own_bucket(tmpdir):
+    db = _database(tmpdir)
+    for i in range(10):
+        db.create_table('events_{}'.format(i), FIELDS, 'EventDate', None,
+                        ['AppID'])
+    views_query = "SELECT name, sql FROM sqlite_master WHERE type = 'view'"
+    views = dict(db.query(views_query))
+
+    db.create_table('events_10', FIELDS, 'EventDate', None, ['AppID'])
+    changed = {name for name, sql in db.query(views_query)
+               if views.get(name) != sql}
+    bucket_name = db._part_name('events_all', 'b{}'.format(
+        db._bucket('events_10')
+    ))
+    assert bucket_name in changed
+    assert changed <= {bucket_name, 'events_all'}
+    assert db.query('SELECT count(*) FROM events_all') == [(0,)]
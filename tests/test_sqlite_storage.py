@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+  test_sqlite_storage.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import os
+from datetime import date, datetime
+
+from state import SqliteStateStorage, State
+
+ARCHIVED_AT = datetime(3000, 1, 1)
+
+
+def test_load_pending(tmpdir):
+    storage = SqliteStateStorage(os.path.join(str(tmpdir), 'state.db'))
+    state = State()
+    updated_at = datetime(2017, 1, 10, 12)
+    storage.save_date_update(state, '1', date(2017, 1, 1), ARCHIVED_AT)
+    storage.save_date_update(state, '1', date(2017, 1, 2), updated_at)
+    storage.save_date_update(state, '1', date(2017, 1, 9), ARCHIVED_AT)
+    storage.save_date_update(state, '2', date(2017, 1, 10), updated_at)
+
+    pending = storage.load_pending(date(2017, 1, 5), ARCHIVED_AT)
+    date_updates = {(s.app_id, d): u
+                    for s in pending.app_id_states
+                    for d, u in s.date_updates.items()}
+    assert date_updates == {
+        ('1', date(2017, 1, 2)): updated_at,
+        ('1', date(2017, 1, 9)): ARCHIVED_AT,
+        ('2', date(2017, 1, 10)): updated_at,
+    }
+
+
+def test_load_pending_uses_indexes(tmpdir):
+    storage = SqliteStateStorage(os.path.join(str(tmpdir), 'state.db'))
+    original_execute = storage._execute
+    queries = []
+
+    def execute(query_text, parameters=()):
+        if query_text.startswith('SELECT app_id, date'):
+            queries.append((query_text, parameters))
+        return original_execute(query_text, parameters)
+
+    storage._execute = execute
+    storage.load_pending(date(2017, 1, 5), ARCHIVED_AT)
+    query_text, parameters = queries[0]
+    plan = storage._execute('EXPLAIN QUERY PLAN ' + query_text, parameters)
+    details = [row[-1] for row in plan]
+    assert not any(d.startswith('SCAN') for d in details)
+    assert any('date_updates_date' in d for d in details)
+    assert any('date_updates_updated_at' in d for d in details)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+  test_updates_controller.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import os
+from datetime import timedelta
+
+from db import SqliteDatabase
+from fields import SourcesCollection
+from state import SqliteStateStorage
+from updater import Scheduler, UpdatesController, UpdatesExecutor, \
+    LeaseManager, FileLeaseStore, Updater
+from updater.db_controllers_collection import DbControllersCollection
+from updater.updater import UpdateResult
+
+
+class RecordingUpdater(Updater):
+    def __init__(self, loads):
+        super().__init__(None)
+        self.loads = loads
+
+    def update(self, app_id, date, table_suffix, db_controller,
+               processing_definition, loading_definition,
+               fingerprint=None, check=None):
+        self.loads.append((app_id, date))
+        return UpdateResult(1)
+
+
+def _controller(tmpdir, owner, loads):
+    sources_collection = SourcesCollection(['installations'])
+    scheduler = Scheduler(
+        SqliteStateStorage(os.path.join(str(tmpdir), 'state.db')),
+        sources_collection.scheduling_definition(), ['1'],
+        update_limit=timedelta(days=0), update_interval=timedelta(hours=1),
+        fresh_limit=timedelta(days=7)
+    )
+    db = SqliteDatabase(os.path.join(str(tmpdir), owner), 'test')
+    controller = UpdatesController(
+        scheduler, RecordingUpdater(loads), sources_collection,
+        DbControllersCollection(db, sources_collection),
+        lease_manager=LeaseManager(
+            FileLeaseStore(os.path.join(str(tmpdir), 'leases')),
+            timedelta(minutes=1), owner
+        )
+    )
+    return scheduler, controller
+
+
+def test_update_done_by_another_loader_is_skipped(tmpdir):
+    loads = []
+    scheduler_a, controller_a = _controller(tmpdir, 'a', loads)
+    scheduler_b, controller_b = _controller(tmpdir, 'b', loads)
+    # Both loaders plan the same date before any of them loads it
+    requests_a = list(scheduler_a.update_requests())
+    requests_b = list(scheduler_b.update_requests())
+    assert len(requests_a) == len(requests_b) == 1
+
+    executor = UpdatesExecutor(1)
+    assert executor.run(requests_a, controller_a._timed_update)
+    assert executor.run(requests_b, controller_b._timed_update)
+    assert loads == [('1', requests_a[0].date)]
+    assert list(scheduler_a.update_requests()) == []
+    assert list(scheduler_b.update_requests()) == []
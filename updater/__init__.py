@@ -13,10 +13,23 @@ from .updater import Updater
 from .db_controller import DbController
 from .scheduler import Scheduler
 from .updates_controller import UpdatesController
+from .updates_executor import UpdatesExecutor
+from .insert_executor import InsertExecutor
+from .processing_pool import ChunkProcessingPool
+from .leasing import LeaseStore, FileLeaseStore, LeaseManager, StaticSharding
+from .wake_up import WakeUp
 
 __all__ = (
     "Updater",
     "DbController",
     "Scheduler",
     "UpdatesController",
+    "UpdatesExecutor",
+    "InsertExecutor",
+    "ChunkProcessingPool",
+    "LeaseStore",
+    "FileLeaseStore",
+    "LeaseManager",
+    "StaticSharding",
+    "WakeUp",
 )
@@ -11,26 +11,16 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 import logging
+from typing import List, Dict, Any
 
 from pandas import DataFrame
 
 from db import Database
 from fields import DbTableDefinition
+from .serializer import TsvSerializer, InsertBlock
 
 logger = logging.getLogger(__name__)
 
-# TODO: Allow customizing
-_escape_characters = {
-    '\b': '\\\\b',
-    '\r': '\\\\r',
-    '\f': '\\\\f',
-    '\n': '\\\\n',
-    '\t': '\\\\t',
-    '\0': '\\\\0',
-    '\'': '\\\\\'',
-    '\\\\': '\\\\\\\\',
-}
-
 
 class DbController(object):
     ARCHIVE_SUFFIX = 'old'
@@ -40,6 +30,8 @@ class DbController(object):
     def __init__(self, db: Database, definition: DbTableDefinition):
         self._db = db
         self._definition = definition
+        self._serializer = TsvSerializer(definition, db.shards_count,
+                                         db.sharding_key)
 
     def table_name(self, suffix: str):
         return '{}_{}'.format(self._definition.table_name, suffix)
@@ -52,6 +44,10 @@ class DbController(object):
     def date_field(self):
         return self._definition.date_field
 
+    @property
+    def date_export_field(self):
+        return self._definition.date_export_field
+
     @property
     def sampling_field(self):
         return self._definition.sampling_field
@@ -73,28 +69,20 @@ class DbController(object):
                                         self._definition.field_types.items(),
                                         self.merge_re)
 
+    def _migrate_tables(self):
+        migrated = self._db.migrate_scheme(
+            self.merge_re,
+            self._definition.field_types.items()
+        )
+        if migrated:
+            logger.info('Migrated {} tables of "{}"'.format(
+                migrated, self._definition.table_name
+            ))
+
     def prepare(self):
         self._prepare_db()
         self._prepare_table()
-
-    def _fetch_export_fields(self, df: DataFrame) -> DataFrame:
-        logger.debug("Fetching exporting fields")
-        return df[self._definition.export_fields]
-
-    def _escape_data(self, df: DataFrame) -> DataFrame:
-        logger.debug("Escaping symbols")
-        escape_chars = dict()
-        string_cols = list(df.select_dtypes(include=['object']).columns)
-        for col, type in self._definition.column_types.items():
-            if type == 'String' and col in string_cols:
-                escape_chars[col] = _escape_characters
-        df.replace(escape_chars, regex=True, inplace=True)
-        return df
-
-    @staticmethod
-    def _export_data_to_tsv(df: DataFrame) -> str:
-        logger.debug("Exporting data to csv")
-        return df.to_csv(index=False, sep='\t')
+        self._migrate_tables()
 
     def _create_table(self, table_name):
         self._db.create_table(
@@ -112,7 +100,8 @@ class DbController(object):
     def archive_table(self, table_suffix: str):
         source_table_name = self.table_name(table_suffix)
         if not self._db.table_exists(source_table_name):
-            logger.warning('Table to archive is not exist: {}'.format(
+            # Tables of days without data are not created
+            logger.debug('Table to archive is not exist: {}'.format(
                 source_table_name
             ))
             return
@@ -121,19 +110,42 @@ class DbController(object):
         self._db.copy_data(source_table_name, archive_table_name)
         self._db.drop_table(source_table_name)
 
+    def drop_table(self, table_suffix: str):
+        self._db.drop_table(self.table_name(table_suffix))
+
+    def create_table(self, table_suffix: str):
+        self._create_table(self.table_name(table_suffix))
+
     def recreate_table(self, table_suffix: str):
         table_name = self.table_name(table_suffix)
         self._db.drop_table(table_name)
         self._create_table(table_name)
 
+    def table_exists(self, table_suffix: str) -> bool:
+        return self._db.table_exists(self.table_name(table_suffix))
+
     def ensure_table_created(self, table_suffix: str):
         table_name = self.table_name(table_suffix)
         self._ensure_table_created(table_name)
 
-    def insert_data(self, df: DataFrame, table_suffix: str):
-        df = self._fetch_export_fields(df)
-        df = self._escape_data(df)  # TODO: Works too slow
-        logger.debug("Inserting {} rows".format(len(df)))
-        tsv = self._export_data_to_tsv(df)
-        table_name = self.table_name(table_suffix)
-        self._db.insert(table_name, tsv)
+    @property
+    def serializer(self) -> TsvSerializer:
+        return self._serializer
+
+    def serialize_data(self, df: DataFrame, table_suffix: str, app_id: str,
+                       chunk_id: str, constants: Dict[str, Any]) \
+            -> List[InsertBlock]:
+        return self._serializer.serialize(df, self.table_name(table_suffix),
+                                          app_id, chunk_id, constants)
+
+    def insert_block(self, block: InsertBlock):
+        logger.debug("Inserting {} rows".format(block.rows_count))
+        self._db.insert(block.table_name, block.tsv_content, block.shard,
+                        block.dedup_token)
+
+    def insert_data(self, df: DataFrame, table_suffix: str, app_id: str,
+                    chunk_id: str, constants: Dict[str, Any]):
+        blocks = self.serialize_data(df, table_suffix, app_id, chunk_id,
+                                     constants)
+        for block in blocks:
+            self.insert_block(block)
@@ -11,6 +11,7 @@
         https://yandex.com/legal/metrica_termsofuse/
 """
 import logging
+import threading
 from typing import Dict
 
 from db import Database
@@ -25,14 +26,16 @@ class DbControllersCollection(object):
         self._db = db
         self._sources_collection = sources_collection
         self._db_controllers = dict()  # type: Dict[str, DbController]
+        self._lock = threading.Lock()
 
     def db_controller(self, source: str) -> DbController:
-        if source in self._db_controllers.keys():
-            db_controller = self._db_controllers[source]
-        else:
-            db_table_definition = \
-                self._sources_collection.db_table_definition(source)
-            db_controller = DbController(self._db, db_table_definition)
-            db_controller.prepare()
-            self._db_controllers[source] = db_controller
+        with self._lock:
+            if source in self._db_controllers.keys():
+                db_controller = self._db_controllers[source]
+            else:
+                db_table_definition = \
+                    self._sources_collection.db_table_definition(source)
+                db_controller = DbController(self._db, db_table_definition)
+                db_controller.prepare()
+                self._db_controllers[source] = db_controller
         return db_controller
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+  insert_executor.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InsertBatch(object):
+    def __init__(self, executor: Optional[ThreadPoolExecutor],
+                 slots: Optional[threading.Semaphore]):
+        self._executor = executor
+        self._slots = slots
+        self._futures = []  # type: List[Future]
+
+    def _raise_failed(self):
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def submit(self, fn: Callable, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+        self._raise_failed()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def wait(self):
+        futures, self._futures = self._futures, []
+        error = None
+        for future in futures:
+            exception = future.exception()
+            if exception is not None and error is None:
+                error = exception
+        if error is not None:
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.wait()
+            return
+        try:
+            self.wait()
+        except Exception as e:
+            logger.debug('Insert failed after load error: {}'.format(e))
+
+
+class InsertExecutor(object):
+    def __init__(self, workers_count: int, queue_size: int = 0):
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._slots = None  # type: Optional[threading.Semaphore]
+        if workers_count > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers_count)
+            self._slots = threading.Semaphore(workers_count + queue_size)
+
+    def batch(self) -> InsertBatch:
+        return InsertBatch(self._executor, self._slots)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+  leasing.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import zlib
+from abc import abstractmethod
+from datetime import timedelta
+from typing import Optional, List
+
+from .update_request import UpdateRequest, UpdateCancelledError
+
+logger = logging.getLogger(__name__)
+
+
+def default_owner() -> str:
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeaseStore(object):
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: timedelta) -> bool:
+        pass
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl: timedelta) -> bool:
+        pass
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        pass
+
+
+class FileLeaseStore(LeaseStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._key_re = re.compile(r'[^0-9A-Za-z_.-]')
+
+    def _file_name(self, key: str) -> str:
+        return os.path.join(self.path,
+                            '{}.lease'.format(self._key_re.sub('_', key)))
+
+    def _update(self, key: str, owner: str, ttl: Optional[timedelta],
+                allow_new: bool) -> bool:
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file_name(key), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    lease = json.loads(f.read() or '{}')
+                except ValueError:
+                    lease = dict()
+                now = time.time()
+                is_own = lease.get('owner') == owner
+                is_free = lease.get('expires_at', 0) <= now
+                if not is_own and not (allow_new and is_free):
+                    return False
+                f.seek(0)
+                f.truncate()
+                if ttl is not None:
+                    json.dump({
+                        'owner': owner,
+                        'expires_at': now + ttl.total_seconds(),
+                    }, f)
+                f.flush()
+                return True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, key: str, owner: str, ttl: timedelta) -> bool:
+        return self._update(key, owner, ttl, allow_new=True)
+
+    def renew(self, key: str, owner: str, ttl: timedelta) -> bool:
+        return self._update(key, owner, ttl, allow_new=False)
+
+    def release(self, key: str, owner: str):
+        self._update(key, owner, None, allow_new=False)
+
+
+class Lease(object):
+    def __init__(self, store: LeaseStore, key: str, owner: str,
+                 ttl: timedelta):
+        self._store = store
+        self.key = key
+        self._owner = owner
+        self._ttl = ttl
+        self._stopped = threading.Event()
+        self._renewer = None  # type: Optional[threading.Thread]
+        self.lost = False
+
+    def _renew_periodically(self):
+        interval = self._ttl.total_seconds() / 3
+        while not self._stopped.wait(interval):
+            if not self._store.renew(self.key, self._owner, self._ttl):
+                logger.warning('Lease of {} is lost'.format(self.key))
+                self.lost = True
+                return
+
+    def acquire(self) -> bool:
+        if not self._store.acquire(self.key, self._owner, self._ttl):
+            return False
+        self._renewer = threading.Thread(target=self._renew_periodically,
+                                         daemon=True)
+        self._renewer.start()
+        return True
+
+    def check(self):
+        if self.lost:
+            raise UpdateCancelledError('Lease of "{}" is lost'.format(
+                self.key
+            ))
+
+    def release(self):
+        self._stopped.set()
+        if self._renewer is not None:
+            self._renewer.join()
+        if not self.lost:
+            self._store.release(self.key, self._owner)
+
+
+class LeaseGroup(object):
+    def __init__(self, leases: List[Lease]):
+        self._leases = leases
+        self._acquired = []  # type: List[Lease]
+        self.key = ', '.join(lease.key for lease in leases)
+
+    def acquire(self) -> bool:
+        for lease in self._leases:
+            if not lease.acquire():
+                self.release()
+                return False
+            self._acquired.append(lease)
+        return True
+
+    def check(self):
+        for lease in self._acquired:
+            lease.check()
+
+    def release(self):
+        for lease in self._acquired:
+            lease.release()
+        self._acquired = []
+
+
+class LeaseManager(object):
+    def __init__(self, store: LeaseStore, ttl: timedelta,
+                 owner: Optional[str] = None):
+        self._store = store
+        self._ttl = ttl
+        self._owner = owner or default_owner()
+
+    @staticmethod
+    def lease_keys(update_request: UpdateRequest) -> List[str]:
+        source = update_request.source
+        app_id = update_request.app_id
+        if update_request.update_type == UpdateRequest.LOAD_INCREMENTAL:
+            return ['{}_{}_incremental'.format(source, app_id)]
+        # Date range loads take the same keys as loads of its dates
+        if update_request.update_type == UpdateRequest.LOAD_DATE_RANGE:
+            return ['{}_{}_{}'.format(source, app_id, p_date)
+                    for p_date in update_request.dates]
+        return ['{}_{}_{}'.format(source, app_id,
+                                  update_request.date or 'latest')]
+
+    def lease(self, update_request: UpdateRequest) -> 'LeaseGroup':
+        return LeaseGroup([Lease(self._store, key, self._owner, self._ttl)
+                           for key in self.lease_keys(update_request)])
+
+
+class StaticSharding(object):
+    def __init__(self, worker_index: int, workers_count: int):
+        self.worker_index = worker_index
+        self.workers_count = workers_count
+
+    def owns(self, app_id: str) -> bool:
+        if self.workers_count <= 1:
+            return True
+        shard = zlib.crc32(str(app_id).encode('utf-8')) % self.workers_count
+        return shard == self.worker_index
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+  priority.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, List
+
+from .update_request import UpdateRequest
+
+
+class PriorityScorer(object):
+    FRESHNESS_WEIGHT = 10.0
+    STALENESS_WEIGHT = 1.0
+    MAX_STALENESS = 10.0
+    ARCHIVE_WEIGHT = 0.1
+    COST_SMOOTHING = 0.3
+    DEFAULT_COST = 1.0
+
+    def __init__(self, update_interval: timedelta):
+        self._update_interval = update_interval
+        self._costs = dict()  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def cost(self, source: str) -> float:
+        with self._lock:
+            return max(self._costs.get(source, self.DEFAULT_COST),
+                       self.DEFAULT_COST)
+
+    def observe(self, source: str, seconds: float):
+        with self._lock:
+            previous = self._costs.get(source)
+            if previous is None:
+                self._costs[source] = seconds
+            else:
+                self._costs[source] = \
+                    previous + self.COST_SMOOTHING * (seconds - previous)
+
+    def _staleness(self, updated_at: Optional[datetime],
+                   now: datetime) -> float:
+        if updated_at is None or not self._update_interval:
+            return self.MAX_STALENESS
+        staleness = (now - updated_at) / self._update_interval
+        return min(max(staleness, 0.0), self.MAX_STALENESS)
+
+    def score(self, update_request: UpdateRequest, today: date,
+              updated_at: Optional[datetime], now: datetime) -> float:
+        age_days = 0
+        if update_request.date is not None:
+            age_days = max((today - update_request.date).days, 0)
+        freshness = self.FRESHNESS_WEIGHT / (1 + age_days)
+        if update_request.update_type == UpdateRequest.ARCHIVE:
+            return self.ARCHIVE_WEIGHT * freshness
+        value = freshness + \
+            self.STALENESS_WEIGHT * self._staleness(updated_at, now)
+        return value / self.cost(update_request.source)
+
+
+def prioritize(update_requests: List[UpdateRequest]) -> List[UpdateRequest]:
+    ordered = sorted(update_requests, key=lambda r: r.score, reverse=True)
+    placed = set()
+    waiting = defaultdict(list)
+    result = []
+
+    def is_ready(update_request: UpdateRequest) -> bool:
+        after = update_request.after
+        return after is None or \
+            all(id(r) in placed for r in after.requests)
+
+    def place(update_request: UpdateRequest):
+        result.append(update_request)
+        placed.add(id(update_request))
+        for group in update_request.groups:
+            if id(group) not in waiting:
+                continue
+            if all(id(r) in placed for r in group.requests):
+                for r in waiting.pop(id(group)):
+                    place(r)
+
+    # Requests waiting for a group are placed right after its last request
+    for update_request in ordered:
+        if is_ready(update_request):
+            place(update_request)
+        else:
+            waiting[id(update_request.after)].append(update_request)
+    for requests in waiting.values():
+        result.extend(requests)
+    return result
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+  processing.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import io
+import logging
+from typing import Dict, List, Tuple, Any, Iterator
+
+import pandas as pd
+from pandas import DataFrame, Series
+
+from fields import ConvertersPlan, ProcessingDefinition
+from .serializer import TsvSerializer, InsertBlock
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_types(df: DataFrame, int_types: Dict[str, str],
+                 fill_values: Dict[str, Any]) -> DataFrame:
+    logger.debug('Ensuring types')
+    for col, dtype in int_types.items():
+        if col not in df.columns:
+            continue
+        series = df[col]  # type: Series
+        changed = False
+        if series.hasnans:
+            series = series.fillna(fill_values[col])
+            changed = True
+        if series.dtype != dtype:
+            series = series.astype(dtype)
+            changed = True
+        if changed:
+            df[col] = series
+    return df
+
+
+def apply_converters(df: DataFrame,
+                     converters_plan: ConvertersPlan) -> DataFrame:
+    logger.debug('Applying converters')
+    return converters_plan.apply(df)
+
+
+def process_data(df: DataFrame, processing_definition: ProcessingDefinition,
+                 app_id: str) -> DataFrame:
+    parameters_extractor = processing_definition.parameters_extractor
+    if parameters_extractor is not None:
+        df = parameters_extractor.apply(df, app_id)
+    df = ensure_types(df, processing_definition.int_types,
+                      processing_definition.fill_values)
+    df = apply_converters(df, processing_definition.converters_plan)
+    return df
+
+
+def process_raw_chunk(chunk: Tuple[str, bytes],
+                      processing_definition: ProcessingDefinition,
+                      serializer: TsvSerializer, table_name: str,
+                      app_id: str,
+                      constants: Dict[str, Any]) -> List[InsertBlock]:
+    chunk_id, raw_chunk = chunk
+    df = pd.read_csv(io.BytesIO(raw_chunk))
+    df = process_data(df, processing_definition, app_id)
+    return serializer.serialize(df, table_name, app_id, chunk_id, constants)
+
+
+def split_by_date(df: DataFrame, date_field: str) \
+        -> Iterator[Tuple[str, DataFrame]]:
+    for date_str, date_df in df.groupby(date_field, sort=False):
+        yield date_str, date_df.copy()
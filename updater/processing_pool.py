@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+  processing_pool.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Iterable, Generator, Any, Deque
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkProcessingPool(object):
+    def __init__(self, workers_count: int, queue_size: int = 0):
+        self.workers_count = workers_count
+        self._queue_size = queue_size
+        self._executor = ProcessPoolExecutor(max_workers=workers_count)
+
+    def map(self, fn: Callable, chunks: Iterable, *args) \
+            -> Generator[Any, None, None]:
+        max_in_flight = self.workers_count + self._queue_size
+        futures = deque()  # type: Deque[Future]
+        try:
+            for chunk in chunks:
+                futures.append(self._executor.submit(fn, chunk, *args))
+                while len(futures) >= max_in_flight:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        self._executor.shutdown()
@@ -12,59 +12,105 @@
 """
 from datetime import datetime, date, time, timedelta
 import logging
-from time import sleep
-from typing import List, Optional, Generator
+import threading
+from typing import List, Optional, Generator, Callable, Dict
 
 import pandas as pd
 
 from state import StateStorage, AppIdState
 from fields import SchedulingDefinition
+from .priority import PriorityScorer, prioritize
+from .update_request import UpdateRequest, UpdateGroup
 
 logger = logging.getLogger(__name__)
 
 
-class UpdateRequest(object):
-    ARCHIVE = 'archive'
-    LOAD_ONE_DATE = 'load_one_date'
-    LOAD_DATE_IGNORED = 'load_date_ignored'
-
-    def __init__(self, source: str, app_id: str, p_date: Optional[date],
-                 update_type: str):
-        self.source = source
-        self.app_id = app_id
-        self.date = p_date
-        self.update_type = update_type
-
-
 class Scheduler(object):
     ARCHIVED_DATE = datetime(3000, 1, 1)
+    DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    INCREMENTAL_SINCE_PROPERTY = 'incremental_since.{}'
+    WATERMARK_PROPERTY = 'watermark.{}'
+    WINDOW_UNTIL_PROPERTY = 'window_until.{}'
+    FINGERPRINT_PROPERTY = 'fingerprint.{}.{}'
+    EMPTY_PROPERTY = 'empty.{}.{}'
+    SOURCE_UPDATED_PROPERTY = 'updated.{}.{}'
+    DAILY_ROWS_PROPERTY = 'daily_rows.{}'
+    NO_DATE_RANGES_PROPERTY = 'no_date_ranges.{}'
+    CREATION_DATE_PROPERTY = 'creation_date'
+    CREATION_DATE_FETCHED_AT_PROPERTY = 'creation_date_fetched_at'
 
     def __init__(self, state_storage: StateStorage,
                  scheduling_definition: SchedulingDefinition,
                  app_ids: List[str], update_limit: timedelta,
-                 update_interval: timedelta, fresh_limit: timedelta):
+                 update_interval: timedelta, fresh_limit: timedelta,
+                 incremental_sources: Optional[List[str]] = None,
+                 incremental_lag: timedelta = timedelta(0),
+                 backfill_days: int = 1, backfill_rows: int = 10000000,
+                 creation_date_provider:
+                 Optional[Callable[[str], Optional[date]]] = None,
+                 app_info_ttl: timedelta = timedelta(days=7),
+                 empty_recheck_interval: timedelta = timedelta(0),
+                 source_intervals: Optional[Dict[str, timedelta]] = None,
+                 app_intervals: Optional[Dict[str, timedelta]] = None):
         self._state_storage = state_storage
         self._definition = scheduling_definition
         self._app_ids = app_ids
         self._update_limit = update_limit
         self._update_interval = update_interval
         self._fresh_limit = fresh_limit
+        self._incremental_sources = [
+            source for source in incremental_sources or []
+            if source in scheduling_definition.date_required_sources
+        ]
+        self._incremental_lag = incremental_lag
+        self._backfill_days = backfill_days
+        self._backfill_rows = backfill_rows
+        self._creation_date_provider = creation_date_provider
+        self._app_info_ttl = app_info_ttl
+        self._empty_recheck_interval = empty_recheck_interval
+        self._source_intervals = source_intervals or dict()
+        self._app_intervals = app_intervals or dict()
+        self._force = False
+        self._started_at = None  # type: Optional[datetime]
+        self._next_update_time = None  # type: Optional[datetime]
         self._state = None
+        self._app_id_states = dict()  # type: Dict[str, AppIdState]
+        self._state_lock = threading.RLock()
+        self._scorer = PriorityScorer(update_interval)
 
     def _load_state(self):
-        self._state = self._state_storage.load()
+        since = datetime.now().date() - self._update_limit
+        with self._state_lock:
+            self._state = self._state_storage.load_pending(
+                since, self.ARCHIVED_DATE
+            )
+            self._app_id_states = {s.app_id: s
+                                   for s in self._state.app_id_states}
 
-    def _save_state(self):
-        self._state_storage.save(self._state)
+    def _save_date_update(self, app_id_state: AppIdState, p_date: date,
+                          updated_at: datetime):
+        with self._state_lock:
+            app_id_state.date_updates[p_date] = updated_at
+            self._state_storage.save_date_update(self._state,
+                                                 app_id_state.app_id,
+                                                 p_date, updated_at)
+
+    def _save_property(self, app_id_state: AppIdState, key: str,
+                       value: Optional[str]):
+        with self._state_lock:
+            if value is None:
+                app_id_state.properties.pop(key, None)
+            else:
+                app_id_state.properties[key] = value
+            self._state_storage.save_property(self._state,
+                                              app_id_state.app_id, key, value)
 
     def _get_or_create_app_id_state(self, app_id: str) -> AppIdState:
-        app_id_states = [s for s in self._state.app_id_states
-                         if s.app_id == app_id]
-        if len(app_id_states) == 0:
+        app_id_state = self._app_id_states.get(app_id)
+        if app_id_state is None:
             app_id_state = AppIdState(app_id)
             self._state.app_id_states.append(app_id_state)
-        else:
-            app_id_state = app_id_states[0]
+            self._app_id_states[app_id] = app_id_state
         return app_id_state
 
     def _mark_date_updated(self, app_id_state: AppIdState, p_date: date,
@@ -72,103 +118,576 @@ class Scheduler(object):
         logger.debug('Data for {} of {} is updated'.format(
             p_date, app_id_state.app_id
         ))
-        app_id_state.date_updates[p_date] = now or datetime.now()
-        self._save_state()
+        self._save_date_update(app_id_state, p_date, now or datetime.now())
 
     def _mark_date_archived(self, app_id_state: AppIdState, p_date: date):
         logger.debug('Data for {} of {} is archived'.format(
             p_date, app_id_state.app_id
         ))
-        app_id_state.date_updates[p_date] = self.ARCHIVED_DATE
-        self._save_state()
+        self._save_date_update(app_id_state, p_date, self.ARCHIVED_DATE)
+        for source in self._definition.date_required_sources:
+            for key in (self._fingerprint_property(source, p_date),
+                        self._empty_property(source, p_date),
+                        self._source_updated_property(source, p_date)):
+                if key in app_id_state.properties:
+                    self._save_property(app_id_state, key, None)
 
     def _is_date_archived(self, app_id_state: AppIdState, p_date: date):
         updated_at = app_id_state.date_updates.get(p_date)
         return updated_at is not None and updated_at == self.ARCHIVED_DATE
 
-    def _finish_updates(self, now: datetime = None):
+    def finish_updates(self, now: datetime = None):
         logger.debug('Updates are finished')
-        self._state.last_update_time = now or datetime.now()
-        self._save_state()
+        with self._state_lock:
+            self._state.last_update_time = now or datetime.now()
+            self._state_storage.save_last_update_time(self._state)
 
-    def _wait_time(self, update_interval: timedelta,
-                   now: datetime = None) \
-            -> Optional[timedelta]:
-        if not self._state.last_update_time:
-            return None
-        now = now or datetime.now()
-        delta = self._state.last_update_time - now + update_interval
-        if delta.total_seconds() < 0:
-            return None
-        return delta
+    @staticmethod
+    def _group(requests: List[UpdateRequest],
+               on_complete: Callable[[], None]) -> UpdateGroup:
+        group = UpdateGroup(requests, on_complete)
+        for request in requests:
+            request.groups.append(group)
+        if not requests:
+            on_complete()
+            group.completed = True
+        return group
+
+    def _interval(self, app_id: str, source: Optional[str] = None) \
+            -> timedelta:
+        if source in self._source_intervals:
+            return self._source_intervals[source]
+        return self._app_intervals.get(app_id, self._update_interval)
+
+    def _is_due(self, updated_at: Optional[datetime], interval: timedelta,
+                started_at: datetime) -> bool:
+        if self._force or updated_at is None:
+            return True
+        due_at = updated_at + interval
+        if started_at >= due_at:
+            return True
+        if self._next_update_time is None or due_at < self._next_update_time:
+            self._next_update_time = due_at
+        return False
+
+    def next_update_time(self) -> datetime:
+        return self._next_update_time
 
-    def _wait_if_needed(self):
-        wait_time = self._wait_time(self._update_interval)
-        if wait_time:
-            logger.info('Sleep for {}'.format(wait_time))
-            sleep(wait_time.total_seconds())
+    def _source_updated_property(self, source: str,
+                                 p_date: Optional[date]) -> str:
+        date_key = p_date.strftime('%Y-%m-%d') if p_date else 'latest'
+        return self.SOURCE_UPDATED_PROPERTY.format(source, date_key)
 
-    def _archive_old_dates(self, app_id_state: AppIdState):
+    def _source_updated_at(self, app_id_state: AppIdState, source: str,
+                           p_date: Optional[date]) -> Optional[datetime]:
+        value = app_id_state.properties.get(
+            self._source_updated_property(source, p_date)
+        )
+        if value is None:
+            return app_id_state.date_updates.get(p_date) if p_date else None
+        return datetime.strptime(value, self.DATETIME_FORMAT)
+
+    def _mark_source_updated(self, app_id_state: AppIdState, source: str,
+                             p_date: Optional[date]):
+        self._save_property(app_id_state,
+                            self._source_updated_property(source, p_date),
+                            datetime.now().strftime(self.DATETIME_FORMAT))
+
+    def _archive_requests(self, app_id_state: AppIdState, p_date: date,
+                          after: Optional[UpdateGroup] = None) \
+            -> List[UpdateRequest]:
+        requests = [UpdateRequest(source, app_id_state.app_id, p_date,
+                                  UpdateRequest.ARCHIVE, after)
+                    for source in self._definition.date_required_sources]
+        self._group(requests,
+                    lambda: self._mark_date_archived(app_id_state, p_date))
+        return requests
+
+    def _old_dates(self, app_id_state: AppIdState) -> List[date]:
+        old_dates = []
         for p_date, updated_at in app_id_state.date_updates.items():
             if self._is_date_archived(app_id_state, p_date):
                 continue
             last_event_date = datetime.combine(p_date, time.max)
             fresh = updated_at - last_event_date < self._fresh_limit
             if not fresh:
-                for source in self._definition.date_required_sources:
-                    yield UpdateRequest(source, app_id_state.app_id, p_date,
-                                        UpdateRequest.ARCHIVE)
-                self._mark_date_archived(app_id_state, p_date)
+                old_dates.append(p_date)
+        return old_dates
+
+    def _is_fresh(self, app_id_state: AppIdState, p_date: date,
+                  started_at: datetime) -> bool:
+        updated_at = app_id_state.date_updates.get(p_date)
+        last_event_date = datetime.combine(p_date, time.max)
+        last_event_delta = (updated_at or started_at) - last_event_date
+        return last_event_delta < self._fresh_limit
+
+    def _incremental_since(self, app_id_state: AppIdState,
+                           source: str) -> Optional[date]:
+        value = app_id_state.properties.get(
+            self.INCREMENTAL_SINCE_PROPERTY.format(source)
+        )
+        if value is None:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    def _is_loaded_incrementally(self, app_id_state: AppIdState, source: str,
+                                 p_date: date) -> bool:
+        if source not in self._incremental_sources:
+            return False
+        since_date = self._incremental_since(app_id_state, source)
+        return since_date is not None and p_date >= since_date
+
+    def _date_sources(self, app_id_state: AppIdState,
+                      p_date: date) -> List[str]:
+        return [source for source in self._definition.date_required_sources
+                if not self._is_loaded_incrementally(app_id_state, source,
+                                                     p_date)]
+
+    def _is_known_empty(self, app_id_state: AppIdState, source: str,
+                        p_date: date, started_at: datetime) -> bool:
+        checked_at = app_id_state.properties.get(
+            self._empty_property(source, p_date)
+        )
+        if checked_at is None:
+            return False
+        checked_at = datetime.strptime(checked_at, self.DATETIME_FORMAT)
+        return started_at - checked_at < self._empty_recheck_interval
 
     def _update_date(self, app_id_state: AppIdState, p_date: date,
                      started_at: datetime) \
             -> Generator[UpdateRequest, None, None]:
-        sources = self._definition.date_required_sources
+        app_id = app_id_state.app_id
+        sources = self._date_sources(app_id_state, p_date)
+        fresh = self._is_fresh(app_id_state, p_date, started_at)
+        # Empty past days are still loaded before archiving
+        if p_date < started_at.date() and fresh and not self._force:
+            sources = [source for source in sources
+                       if not self._is_known_empty(app_id_state, source,
+                                                   p_date, started_at)]
+        # Sources with own intervals are marked separately, as the date
+        # mark is updated by the other sources
+        own_sources = [s for s in sources if s in self._source_intervals]
+        date_sources = [s for s in sources if s not in self._source_intervals]
         updated_at = app_id_state.date_updates.get(p_date)
-        last_event_date = datetime.combine(p_date, time.max)
-        if updated_at:
-            updated = started_at - updated_at < self._update_interval
-            if updated:
-                return
-        last_event_delta = (updated_at or started_at) - last_event_date
-        for source in sources:
-            yield UpdateRequest(source, app_id_state.app_id, p_date,
-                                UpdateRequest.LOAD_ONE_DATE)
-        self._mark_date_updated(app_id_state, p_date)
+        date_due = self._is_due(updated_at, self._interval(app_id),
+                                started_at)
+        archive = date_due and not fresh
+
+        load_requests = []
+        if date_due:
+            date_requests = [UpdateRequest(source, app_id, p_date,
+                                           UpdateRequest.LOAD_ONE_DATE)
+                             for source in date_sources]
+            self._group(date_requests,
+                        lambda: self._mark_date_updated(app_id_state, p_date))
+            load_requests.extend(date_requests)
+        for source in own_sources:
+            source_updated_at = self._source_updated_at(app_id_state, source,
+                                                        p_date)
+            if not archive and not self._is_due(
+                    source_updated_at, self._interval(app_id, source),
+                    started_at):
+                continue
+            # The source is marked as updated by mark_done
+            load_requests.append(UpdateRequest(source, app_id, p_date,
+                                               UpdateRequest.LOAD_ONE_DATE))
+        if not date_due and not load_requests:
+            return
+        load_group = self._group(load_requests, lambda: None)
+        yield from load_requests
+
+        if archive:
+            yield from self._archive_requests(app_id_state, p_date,
+                                              load_group)
+
+    def _mark_dates_updated(self, app_id_state: AppIdState,
+                            dates: List[date]):
+        now = datetime.now()
+        for p_date in dates:
+            self._mark_date_updated(app_id_state, p_date, now)
 
-        fresh = last_event_delta < self._fresh_limit
-        if not fresh:
+    def _range_days(self, app_id_state: AppIdState,
+                    sources: List[str]) -> int:
+        properties = app_id_state.properties
+        if any(self.NO_DATE_RANGES_PROPERTY.format(s) in properties
+               for s in sources):
+            return 1
+        daily_rows = [
+            int(properties[self.DAILY_ROWS_PROPERTY.format(s)])
+            for s in sources
+            if self.DAILY_ROWS_PROPERTY.format(s) in properties
+        ]
+        if not daily_rows:
+            return self._backfill_days
+        days = self._backfill_rows // max(max(daily_rows), 1)
+        return min(max(days, 1), self._backfill_days)
+
+    def _backfill_requests(self, app_id_state: AppIdState,
+                           new_dates: List[date], started_at: datetime) \
+            -> Generator[UpdateRequest, None, None]:
+        ranges = []
+        for p_date in new_dates:
+            sources = self._date_sources(app_id_state, p_date)
+            if ranges:
+                range_sources, dates = ranges[-1]
+                if range_sources == sources \
+                        and p_date - dates[-1] == timedelta(days=1) \
+                        and len(dates) < self._range_days(app_id_state,
+                                                          sources):
+                    dates.append(p_date)
+                    continue
+            ranges.append((sources, [p_date]))
+
+        for sources, dates in ranges:
+            if len(dates) == 1:
+                yield from self._update_date(app_id_state, dates[0],
+                                             started_at)
+                continue
+            load_requests = []
             for source in sources:
-                yield UpdateRequest(source, app_id_state.app_id, p_date,
-                                    UpdateRequest.ARCHIVE)
-            self._mark_date_archived(app_id_state, p_date)
+                update_request = UpdateRequest(source, app_id_state.app_id,
+                                               dates[0],
+                                               UpdateRequest.LOAD_DATE_RANGE)
+                update_request.dates = dates
+                load_requests.append(update_request)
+            load_group = self._group(
+                load_requests,
+                lambda dates=dates: self._mark_dates_updated(app_id_state,
+                                                             dates)
+            )
+            yield from load_requests
+            for p_date in dates:
+                if not self._is_fresh(app_id_state, p_date, started_at):
+                    yield from self._archive_requests(app_id_state, p_date,
+                                                      load_group)
+
+    def _start_incremental(self, app_id_state: AppIdState, source: str,
+                           started_at: datetime) -> date:
+        # Dates till tomorrow are still loaded by days, so no received
+        # rows are loaded twice
+        since_date = started_at.date() + timedelta(days=1)
+        since = datetime.combine(since_date, time.min)
+        logger.info('Loading of "{}" for "{}" becomes incremental since '
+                    '{}'.format(source, app_id_state.app_id, since_date))
+        self._save_property(app_id_state,
+                            self.WATERMARK_PROPERTY.format(source),
+                            since.strftime(self.DATETIME_FORMAT))
+        self._save_property(app_id_state,
+                            self.INCREMENTAL_SINCE_PROPERTY.format(source),
+                            since_date.strftime('%Y-%m-%d'))
+        return since_date
+
+    def _incremental_requests(self, app_id_state: AppIdState,
+                              fresh_dates: List[date],
+                              started_at: datetime) \
+            -> Generator[UpdateRequest, None, None]:
+        until = (started_at - self._incremental_lag).replace(microsecond=0)
+        for source in self._incremental_sources:
+            since_date = self._incremental_since(app_id_state, source)
+            if since_date is None:
+                since_date = self._start_incremental(app_id_state, source,
+                                                     started_at)
+            watermark_property = self.WATERMARK_PROPERTY.format(source)
+            since = datetime.strptime(
+                app_id_state.properties[watermark_property],
+                self.DATETIME_FORMAT
+            )
+            # A window which is not finished is loaded again as is, so its
+            # chunks get the same dedup tokens
+            window_until_property = self.WINDOW_UNTIL_PROPERTY.format(source)
+            window_until = app_id_state.properties.get(window_until_property)
+            if window_until is not None:
+                window_until = datetime.strptime(window_until,
+                                                 self.DATETIME_FORMAT)
+            else:
+                window_until = until
+            # Rows are received continuously, so the window is loaded
+            # when its interval passes
+            if window_until < since or not self._is_due(
+                    since + self._incremental_lag,
+                    self._interval(app_id_state.app_id, source), started_at):
+                continue
+            if window_until_property not in app_id_state.properties:
+                self._save_property(
+                    app_id_state, window_until_property,
+                    window_until.strftime(self.DATETIME_FORMAT)
+                )
+            update_request = UpdateRequest(source, app_id_state.app_id, None,
+                                           UpdateRequest.LOAD_INCREMENTAL)
+            update_request.since = since
+            update_request.until = window_until
+            update_request.dates = [p_date for p_date in fresh_dates
+                                    if p_date >= since_date]
+            yield update_request
 
-    def _update_date_ignored_fields(self, app_id: str):
+    def _finish_window(self, app_id_state: AppIdState, source: str,
+                       until: datetime):
+        watermark = (until + timedelta(seconds=1)) \
+            .strftime(self.DATETIME_FORMAT)
+        self._save_property(app_id_state,
+                            self.WATERMARK_PROPERTY.format(source), watermark)
+        self._save_property(app_id_state,
+                            self.WINDOW_UNTIL_PROPERTY.format(source), None)
+
+    def _update_date_ignored_fields(self, app_id_state: AppIdState,
+                                    started_at: datetime):
+        app_id = app_id_state.app_id
         for source in self._definition.date_ignored_sources:
+            updated_at = self._source_updated_at(app_id_state, source, None)
+            if not self._is_due(updated_at, self._interval(app_id, source),
+                                started_at):
+                continue
             yield UpdateRequest(source, app_id, None,
                                 UpdateRequest.LOAD_DATE_IGNORED)
 
-    def update_requests(self) \
+    def _fetch_creation_date(self, app_id_state: AppIdState,
+                             started_at: datetime):
+        app_id = app_id_state.app_id
+        try:
+            creation_date = self._creation_date_provider(app_id)
+        except Exception as e:
+            logger.warning('Failed to fetch creation date of "{}": '
+                           '{}'.format(app_id, e))
+            return
+        logger.debug('Creation date of "{}" is {}'.format(app_id,
+                                                          creation_date))
+        # Empty value keeps unknown date from being fetched till TTL passes
+        self._save_property(app_id_state, self.CREATION_DATE_PROPERTY,
+                            creation_date.strftime('%Y-%m-%d')
+                            if creation_date else '')
+        self._save_property(app_id_state,
+                            self.CREATION_DATE_FETCHED_AT_PROPERTY,
+                            started_at.strftime(self.DATETIME_FORMAT))
+
+    def _creation_date(self, app_id_state: AppIdState,
+                       started_at: datetime) -> Optional[date]:
+        if self._creation_date_provider is None:
+            return None
+        properties = app_id_state.properties
+        fetched_at = properties.get(self.CREATION_DATE_FETCHED_AT_PROPERTY)
+        if fetched_at is None or started_at - datetime.strptime(
+                fetched_at, self.DATETIME_FORMAT) >= self._app_info_ttl:
+            self._fetch_creation_date(app_id_state, started_at)
+        value = properties.get(self.CREATION_DATE_PROPERTY)
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    def _app_update_requests(self, app_id_state: AppIdState,
+                             started_at: datetime) \
             -> Generator[UpdateRequest, None, None]:
-        self._load_state()
-        self._wait_if_needed()
-        started_at = datetime.now()
-        for app_id in self._app_ids:
-            app_id_state = self._get_or_create_app_id_state(app_id)
-            date_to = started_at.date()
-            date_from = date_to - self._update_limit
+        date_to = started_at.date()
+        date_from = date_to - self._update_limit
+        creation_date = self._creation_date(app_id_state, started_at)
+        if creation_date is not None and creation_date > date_from:
+            date_from = min(creation_date, date_to)
+
+        # Dates are marked as archived only when archiving finishes,
+        # so they are skipped explicitly until then
+        old_dates = self._old_dates(app_id_state)
+        for p_date in old_dates:
+            yield from self._archive_requests(app_id_state, p_date)
 
-            updates = self._archive_old_dates(app_id_state)
+        fresh_dates = []
+        new_dates = []
+        for pd_date in pd.date_range(date_from, date_to):
+            p_date = pd_date.to_pydatetime().date()  # type: date
+            if p_date in old_dates:
+                continue
+            if self._is_fresh(app_id_state, p_date, started_at):
+                fresh_dates.append(p_date)
+            if self._backfill_days > 1 \
+                    and p_date not in app_id_state.date_updates:
+                new_dates.append(p_date)
+                continue
+            updates = self._update_date(app_id_state, p_date, started_at)
             for update_request in updates:
                 yield update_request
+        yield from self._backfill_requests(app_id_state, new_dates,
+                                           started_at)
+
+        # Received rows are kept only for dates not archived in this cycle
+        yield from self._incremental_requests(app_id_state, fresh_dates,
+                                              started_at)
+
+        updates = self._update_date_ignored_fields(app_id_state, started_at)
+        for update_request in updates:
+            yield update_request
+
+    def _empty_property(self, source: str, p_date: date) -> str:
+        return self.EMPTY_PROPERTY.format(source, p_date.strftime('%Y-%m-%d'))
+
+    def observe_date_rows(self, update_request: UpdateRequest, p_date: date,
+                          rows_count: int):
+        with self._state_lock:
+            app_id_state = self._get_or_create_app_id_state(
+                update_request.app_id
+            )
+            key = self._empty_property(update_request.source, p_date)
+            if rows_count == 0:
+                self._save_property(
+                    app_id_state, key,
+                    datetime.now().strftime(self.DATETIME_FORMAT)
+                )
+            elif key in app_id_state.properties:
+                self._save_property(app_id_state, key, None)
 
-            for pd_date in pd.date_range(date_from, date_to):
-                p_date = pd_date.to_pydatetime().date()  # type: date
-                updates = self._update_date(app_id_state, p_date, started_at)
-                for update_request in updates:
-                    yield update_request
+    def _fingerprint_property(self, source: str,
+                              p_date: Optional[date]) -> str:
+        date_key = p_date.strftime('%Y-%m-%d') if p_date else 'latest'
+        return self.FINGERPRINT_PROPERTY.format(source, date_key)
 
-            updates = self._update_date_ignored_fields(app_id_state.app_id)
+    def fingerprint(self, update_request: UpdateRequest) -> Optional[str]:
+        with self._state_lock:
+            app_id_state = self._app_id_states.get(update_request.app_id)
+            if app_id_state is None:
+                return None
+            key = self._fingerprint_property(update_request.source,
+                                             update_request.date)
+            return app_id_state.properties.get(key)
+
+    def save_fingerprint(self, update_request: UpdateRequest,
+                         fingerprint: str):
+        with self._state_lock:
+            app_id_state = self._get_or_create_app_id_state(
+                update_request.app_id
+            )
+            key = self._fingerprint_property(update_request.source,
+                                             update_request.date)
+            self._save_property(app_id_state, key, fingerprint)
+
+    def observe_rows(self, update_request: UpdateRequest, rows_count: int):
+        if not update_request.dates:
+            return
+        with self._state_lock:
+            app_id_state = self._get_or_create_app_id_state(
+                update_request.app_id
+            )
+            daily_rows = rows_count // len(update_request.dates)
+            self._save_property(
+                app_id_state,
+                self.DAILY_ROWS_PROPERTY.format(update_request.source),
+                str(daily_rows)
+            )
+
+    def disable_date_ranges(self, update_request: UpdateRequest):
+        logger.warning('Dates of "{}" for "{}" differ from the dates of its '
+                       'export, so it is loaded by days from now'.format(
+                           update_request.source, update_request.app_id
+                       ))
+        with self._state_lock:
+            app_id_state = self._get_or_create_app_id_state(
+                update_request.app_id
+            )
+            self._save_property(
+                app_id_state,
+                self.NO_DATE_RANGES_PROPERTY.format(update_request.source),
+                datetime.now().strftime(self.DATETIME_FORMAT)
+            )
+
+    def _reload_app_id_state(self, app_id: str) -> AppIdState:
+        since = datetime.now().date() - self._update_limit
+        with self._state_lock:
+            state = self._state_storage.load_pending(since,
+                                                     self.ARCHIVED_DATE)
+            app_id_state = self._get_or_create_app_id_state(app_id)
+            for loaded in state.app_id_states:
+                if loaded.app_id == app_id:
+                    app_id_state.date_updates.update(loaded.date_updates)
+                    app_id_state.properties.clear()
+                    app_id_state.properties.update(loaded.properties)
+            return app_id_state
+
+    def _source_marked_at(self, app_id_state: AppIdState, source: str,
+                          p_date: Optional[date]) -> Optional[datetime]:
+        # The date mark is not used here, as it is updated by every source
+        # of the date
+        value = app_id_state.properties.get(
+            self._source_updated_property(source, p_date)
+        )
+        if value is None:
+            return None
+        return datetime.strptime(value, self.DATETIME_FORMAT)
+
+    def is_pending(self, update_request: UpdateRequest) -> bool:
+        # State is read again, as another loader may have finished the
+        # update after this cycle started
+        with self._state_lock:
+            app_id_state = self._reload_app_id_state(update_request.app_id)
+            source = update_request.source
+            if update_request.update_type == UpdateRequest.LOAD_INCREMENTAL:
+                watermark = app_id_state.properties.get(
+                    self.WATERMARK_PROPERTY.format(source)
+                )
+                return watermark is None or datetime.strptime(
+                    watermark, self.DATETIME_FORMAT
+                ) <= update_request.since
+            is_archive = update_request.update_type == UpdateRequest.ARCHIVE
+            started_at = self._started_at.replace(microsecond=0)
+            for p_date in update_request.dates or [update_request.date]:
+                if p_date is not None \
+                        and self._is_date_archived(app_id_state, p_date):
+                    return False
+                marked_at = self._source_marked_at(app_id_state, source,
+                                                   p_date)
+                if marked_at is None:
+                    continue
+                if marked_at == self.ARCHIVED_DATE:
+                    return False
+                if not is_archive and marked_at >= started_at:
+                    return False
+            return True
+
+    def mark_done(self, update_request: UpdateRequest):
+        with self._state_lock:
+            app_id_state = self._get_or_create_app_id_state(
+                update_request.app_id
+            )
+            source = update_request.source
+            update_type = update_request.update_type
+            if update_type == UpdateRequest.LOAD_INCREMENTAL:
+                self._finish_window(app_id_state, source,
+                                    update_request.until)
+            elif update_type == UpdateRequest.ARCHIVE:
+                # Dates are marked as archived when every source is archived
+                self._save_property(
+                    app_id_state,
+                    self._source_updated_property(source,
+                                                  update_request.date),
+                    self.ARCHIVED_DATE.strftime(self.DATETIME_FORMAT)
+                )
+            else:
+                for p_date in update_request.dates or [update_request.date]:
+                    self._mark_source_updated(app_id_state, source, p_date)
+
+    def observe_duration(self, update_request: UpdateRequest,
+                         seconds: float):
+        if update_request.update_type != UpdateRequest.ARCHIVE:
+            self._scorer.observe(update_request.source, seconds)
+
+    def update_requests(self, force: bool = False) \
+            -> Generator[UpdateRequest, None, None]:
+        self._load_state()
+        started_at = datetime.now()
+        self._started_at = started_at
+        self._force = force
+        # New date starts at midnight
+        self._next_update_time = datetime.combine(
+            started_at.date() + timedelta(days=1), time.min
+        )
+        update_requests = []
+        for app_id in self._app_ids:
+            app_id_state = self._get_or_create_app_id_state(app_id)
+            updates = self._app_update_requests(app_id_state, started_at)
             for update_request in updates:
-                yield update_request
-        self._finish_updates()
+                if update_request.date is not None:
+                    updated_at = app_id_state.date_updates.get(
+                        update_request.date
+                    )
+                else:
+                    updated_at = self._state.last_update_time
+                update_request.score = self._scorer.score(
+                    update_request, started_at.date(), updated_at, started_at
+                )
+                update_requests.append(update_request)
+        yield from prioritize(update_requests)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+  serializer.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import csv
+import logging
+import zlib
+from typing import Iterator, Tuple, Optional, List, Dict, Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_string_dtype, is_float_dtype
+
+from db import Database
+from db.tsv import escape_characters
+from fields import DbTableDefinition
+
+logger = logging.getLogger(__name__)
+
+
+class InsertBlock(object):
+    __slots__ = [
+        "table_name",
+        "tsv_content",
+        "shard",
+        "dedup_token",
+        "rows_count",
+    ]
+
+    def __init__(self, table_name: str, tsv_content: str,
+                 shard: Optional[int], dedup_token: str, rows_count: int):
+        self.table_name = table_name
+        self.tsv_content = tsv_content
+        self.shard = shard
+        self.dedup_token = dedup_token
+        self.rows_count = rows_count
+
+
+class TsvSerializer(object):
+    def __init__(self, definition: DbTableDefinition, shards_count: int,
+                 sharding_key: Optional[str]):
+        self._definition = definition
+        self._shards_count = shards_count
+        self._sharding_key = sharding_key
+
+    def _append_constants(self, df: DataFrame, constants: Dict[str, Any]) \
+            -> DataFrame:
+        logger.debug("Appending constant fields")
+        codes = np.zeros(len(df), dtype='int8')
+        for col, value in constants.items():
+            if col in self._definition.column_types:
+                df[col] = pd.Categorical.from_codes(codes, [value])
+        return df
+
+    def _escape_data(self, df: DataFrame) -> DataFrame:
+        logger.debug("Escaping symbols")
+        for col in self._definition.escape_fields:
+            if col in df.columns and is_string_dtype(df[col].dtype):
+                df[col] = df[col].str.translate(escape_characters)
+        return df
+
+    def _export_data_to_tsv(self, df: DataFrame) -> str:
+        logger.debug("Exporting data to csv")
+        return self._definition.tsv_header + df.to_csv(
+            index=False, header=False, sep='\t', quoting=csv.QUOTE_NONE,
+            columns=self._definition.export_fields
+        )
+
+    def _split_by_shards(self, df: DataFrame, app_id: str) \
+            -> Iterator[Tuple[Optional[int], DataFrame]]:
+        shards_count = self._shards_count
+        if shards_count == 1:
+            yield None, df
+            return
+        sampling_field = self._definition.sampling_export_field
+        if self._sharding_key == Database.SHARDING_SAMPLING \
+                and sampling_field is not None:
+            keys = self._shard_keys(df[sampling_field])
+            hashes = pd.util.hash_pandas_object(keys, index=False)
+            for shard, shard_df in df.groupby(hashes.values % shards_count):
+                yield int(shard), shard_df
+        else:
+            yield zlib.crc32(str(app_id).encode('utf-8')) % shards_count, df
+
+    @staticmethod
+    def _shard_keys(column: pd.Series) -> pd.Series:
+        keys = column.astype(str).astype(object)
+        if is_float_dtype(column):
+            integral = column.notnull() & (column % 1 == 0)
+            keys[integral] = column[integral].astype(np.int64).astype(str)
+        keys[column.isnull()] = ''
+        return keys
+
+    @staticmethod
+    def _dedup_token(table_name: str, chunk_id: str,
+                     shard: Optional[int]) -> str:
+        token = '{}_{}'.format(table_name, chunk_id)
+        if shard is not None:
+            token = '{}_{}'.format(token, shard)
+        return token
+
+    def serialize(self, df: DataFrame, table_name: str, app_id: str,
+                  chunk_id: str, constants: Dict[str, Any]) \
+            -> List[InsertBlock]:
+        df = self._escape_data(df)
+        df = self._append_constants(df, constants)
+        blocks = []
+        for shard, shard_df in self._split_by_shards(df, app_id):
+            tsv = self._export_data_to_tsv(shard_df)
+            blocks.append(InsertBlock(
+                table_name, tsv, shard,
+                self._dedup_token(table_name, chunk_id, shard), len(shard_df)
+            ))
+        return blocks
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+  update_request.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import threading
+from datetime import date, datetime
+from typing import List, Optional, Callable, Tuple
+
+
+class UpdateSkippedError(Exception):
+    pass
+
+
+class UpdateCancelledError(Exception):
+    pass
+
+
+class UpdateGroup(object):
+    def __init__(self, requests: List['UpdateRequest'],
+                 on_complete: Callable[[], None]):
+        self.requests = requests
+        self._pending = len(requests)
+        self._on_complete = on_complete
+        self._lock = threading.Lock()
+        self.completed = False
+        self.failed = False
+
+    def request_finished(self, success: bool):
+        with self._lock:
+            if not success:
+                self.failed = True
+            self._pending -= 1
+            if self._pending > 0 or self.failed:
+                return
+        self._on_complete()
+        self.completed = True
+
+
+class UpdateRequest(object):
+    ARCHIVE = 'archive'
+    LOAD_ONE_DATE = 'load_one_date'
+    LOAD_DATE_IGNORED = 'load_date_ignored'
+    LOAD_INCREMENTAL = 'load_incremental'
+    LOAD_DATE_RANGE = 'load_date_range'
+
+    def __init__(self, source: str, app_id: str, p_date: Optional[date],
+                 update_type: str, after: Optional[UpdateGroup] = None):
+        self.source = source
+        self.app_id = app_id
+        self.date = p_date
+        self.update_type = update_type
+        self.after = after
+        self.groups = []  # type: List[UpdateGroup]
+        self.score = 0.0
+        # Received rows window of incremental loads
+        self.since = None  # type: Optional[datetime]
+        self.until = None  # type: Optional[datetime]
+        # Dates kept of incremental loads and loaded by date range loads
+        self.dates = []  # type: List[date]
+
+    @property
+    def table_keys(self) -> List[Tuple[str, str, Optional[date]]]:
+        # Date range loads recreate tables of every date
+        if self.update_type == self.LOAD_DATE_RANGE:
+            return [(self.source, self.app_id, p_date)
+                    for p_date in self.dates]
+        return [(self.source, self.app_id, self.date)]
+
+    def finish(self, success: bool):
+        for group in self.groups:
+            group.request_finished(success)
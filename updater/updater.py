@@ -12,99 +12,376 @@
 """
 import datetime
 import logging
-from typing import Dict, Optional
+import tempfile
+from typing import Dict, Optional, Any, Iterable, List, Callable
 
-from pandas import DataFrame, Series
+from pandas import DataFrame
 
-from fields import Converter, ProcessingDefinition, LoadingDefinition
+from fields import ProcessingDefinition, LoadingDefinition
 from logs_api import Loader, LogsApiClient, LogsApiPartsCountError
 from .db_controller import DbController
+from .insert_executor import InsertExecutor
+from .processing import process_data, process_raw_chunk, split_by_date
+from .processing_pool import ChunkProcessingPool
 
 logger = logging.getLogger(__name__)
 
 
+def _not_cancelled():
+    pass
+
+
+class UpdateResult(object):
+    __slots__ = [
+        "rows_count",
+        "fingerprint",
+    ]
+
+    def __init__(self, rows_count: Optional[int],
+                 fingerprint: Optional[str] = None):
+        # Rows count is unknown when unchanged data is not loaded again
+        self.rows_count = rows_count
+        self.fingerprint = fingerprint
+
+
+class DateRangeMismatchError(ValueError):
+    def __init__(self, rows_count: int):
+        super().__init__('{} rows are out of the loaded dates'.format(
+            rows_count
+        ))
+        self.rows_count = rows_count
+
+
 class Updater(object):
-    def __init__(self, loader: Loader):
+    def __init__(self, loader: Loader,
+                 insert_executor: Optional[InsertExecutor] = None,
+                 processing_pool: Optional[ChunkProcessingPool] = None,
+                 chunk_bytes: int = 16 << 20,
+                 skip_unchanged: bool = False,
+                 spool_path: Optional[str] = None):
         self._loader = loader
+        self._insert_executor = insert_executor or InsertExecutor(0)
+        self._processing_pool = processing_pool
+        self._chunk_bytes = chunk_bytes
+        self._skip_unchanged = skip_unchanged
+        self._spool_path = spool_path
 
     @staticmethod
-    def _ensure_types(df: DataFrame, types: Dict[str, str]) -> DataFrame:
-        logger.debug('Ensuring types')
-        for col, db_type in types.items():
-            if col not in df.columns:
-                continue
-            series = df[col]  # type: Series
-            if 'Int' in db_type:
-                series.fillna(0, inplace=True)
-                df[col] = series.astype(db_type.lower())
-        return df
-
-    @staticmethod
-    def _append_system_fields(df: DataFrame, app_id: str) -> DataFrame:
-        logger.debug('Appending system fields')
-        df['app_id'] = app_id
-        df['load_datetime'] = int(datetime.datetime.now().timestamp())
-        return df
+    def _system_fields(app_id: str) -> Dict[str, Any]:
+        return {
+            'app_id': app_id,
+            'load_datetime': int(datetime.datetime.now().timestamp()),
+        }
 
     @staticmethod
-    def _apply_converters(df: DataFrame,
-                          converters: Dict[str, Converter]) \
-            -> DataFrame:
-        logger.debug('Applying converters')
-        for name, converter in converters.items():
-            df[name] = converter(df)
-        return df
-
-    def _process_data(self, app_id: str, df: DataFrame,
-                      processing_definition: ProcessingDefinition):
-        df = df.copy()  # type: DataFrame
-        df = self._ensure_types(df, processing_definition.field_types)
-        df = self._append_system_fields(df, app_id)
-        df = self._apply_converters(df, processing_definition.field_converters)
-        return df
+    def _process_data(df: DataFrame,
+                      processing_definition: ProcessingDefinition,
+                      app_id: str):
+        return process_data(df, processing_definition, app_id)
 
     def _load(self, app_id: str, loading_definition: LoadingDefinition,
               date_from: Optional[datetime.datetime],
               date_to: Optional[datetime.datetime],
               date_dimension: Optional[str],
-              parts_count: int):
+              parts_count: int, adaptive_chunks: bool = True):
         df_it = self._loader.load(app_id, loading_definition.source_name,
                                   loading_definition.fields,
                                   date_from, date_to, date_dimension,
-                                  parts_count)
+                                  parts_count, adaptive_chunks)
         return df_it
 
+    def _insert_frames(self, df_it: Iterable[DataFrame], app_id: str,
+                       table_suffix: str, parts_count: int,
+                       db_controller: DbController,
+                       processing_definition: ProcessingDefinition,
+                       system_fields: Dict[str, Any],
+                       check: Callable[[], None]) -> int:
+        rows_count = 0
+        with self._insert_executor.batch() as batch:
+            for chunk_number, df in enumerate(df_it):
+                check()
+                if len(df) == 0:
+                    continue
+                logger.debug("Start processing data chunk")
+                upload_df = self._process_data(df, processing_definition,
+                                               app_id)
+                if rows_count == 0:
+                    db_controller.create_table(table_suffix)
+                rows_count += len(upload_df)
+                chunk_id = '{}_{}'.format(parts_count, chunk_number)
+                blocks = db_controller.serialize_data(upload_df, table_suffix,
+                                                      app_id, chunk_id,
+                                                      system_fields)
+                for block in blocks:
+                    batch.submit(db_controller.insert_block, block)
+        return rows_count
+
+    def _insert_raw_chunks(self, raw_it: Iterable[bytes], app_id: str,
+                           table_suffix: str, parts_count: int,
+                           db_controller: DbController,
+                           processing_definition: ProcessingDefinition,
+                           system_fields: Dict[str, Any],
+                           check: Callable[[], None]) -> int:
+        table_name = db_controller.table_name(table_suffix)
+        chunks = (('{}_{}'.format(parts_count, chunk_number), raw_chunk)
+                  for chunk_number, raw_chunk in enumerate(raw_it))
+        blocks_it = self._processing_pool.map(
+            process_raw_chunk, chunks,
+            processing_definition, db_controller.serializer, table_name,
+            app_id, system_fields
+        )
+        rows_count = 0
+        with self._insert_executor.batch() as batch:
+            for blocks in blocks_it:
+                check()
+                for block in blocks:
+                    if block.rows_count == 0:
+                        continue
+                    if rows_count == 0:
+                        db_controller.create_table(table_suffix)
+                    rows_count += block.rows_count
+                    batch.submit(db_controller.insert_block, block)
+        return rows_count
+
+    def _try_update_spooled(self, app_id: str, since: datetime,
+                            until: datetime, table_suffix: str,
+                            parts_count: int, db_controller: DbController,
+                            processing_definition: ProcessingDefinition,
+                            loading_definition: LoadingDefinition,
+                            fingerprint: Optional[str],
+                            check: Callable[[], None]) -> UpdateResult:
+        with tempfile.TemporaryFile(dir=self._spool_path) as spool_file:
+            new_fingerprint = self._loader.spool(
+                app_id, loading_definition.source_name,
+                loading_definition.fields, since, until,
+                LogsApiClient.DATE_DIMENSION_CREATE, spool_file, parts_count
+            )
+            # Tables are not created for empty exports
+            if new_fingerprint == fingerprint \
+                    and (self._is_empty_fingerprint(new_fingerprint)
+                         or db_controller.table_exists(table_suffix)):
+                logger.info('Data of "{}" is not changed'.format(
+                    db_controller.table_name(table_suffix)
+                ))
+                return UpdateResult(None, new_fingerprint)
+
+            check()
+            db_controller.drop_table(table_suffix)
+            system_fields = self._system_fields(app_id)
+            if self._processing_pool is not None:
+                raw_it = self._loader.read_spooled_raw(spool_file,
+                                                       self._chunk_bytes)
+                rows_count = self._insert_raw_chunks(
+                    raw_it, app_id, table_suffix, parts_count, db_controller,
+                    processing_definition, system_fields, check
+                )
+            else:
+                df_it = self._loader.read_spooled(
+                    spool_file, loading_definition.source_name
+                )
+                rows_count = self._insert_frames(
+                    df_it, app_id, table_suffix, parts_count, db_controller,
+                    processing_definition, system_fields, check
+                )
+        return UpdateResult(rows_count, new_fingerprint)
+
+    @staticmethod
+    def _is_empty_fingerprint(fingerprint: str) -> bool:
+        # Empty export has the header line at most
+        return int(fingerprint.split(':')[0]) <= 1
+
     def _try_update(self, app_id: str, since: datetime, until: datetime,
                     table_suffix: str, parts_count: int,
                     db_controller: DbController,
                     processing_definition: ProcessingDefinition,
-                    loading_definition: LoadingDefinition):
-        db_controller.recreate_table(table_suffix)
+                    loading_definition: LoadingDefinition,
+                    fingerprint: Optional[str],
+                    check: Callable[[], None]) -> UpdateResult:
+        if self._skip_unchanged:
+            return self._try_update_spooled(app_id, since, until,
+                                            table_suffix, parts_count,
+                                            db_controller,
+                                            processing_definition,
+                                            loading_definition, fingerprint,
+                                            check)
 
-        df_it = self._load(app_id, loading_definition, since, until,
-                           LogsApiClient.DATE_DIMENSION_CREATE, parts_count)
-        for df in df_it:
-            logger.debug("Start processing data chunk")
-            upload_df = self._process_data(app_id, df,
-                                           processing_definition)
-            db_controller.insert_data(upload_df, table_suffix)
+        # The table is created with the first rows, so empty days have none
+        db_controller.drop_table(table_suffix)
+
+        system_fields = self._system_fields(app_id)
+        if self._processing_pool is not None:
+            raw_it = self._loader.load_raw(
+                app_id, loading_definition.source_name,
+                loading_definition.fields, since, until,
+                LogsApiClient.DATE_DIMENSION_CREATE, parts_count,
+                self._chunk_bytes
+            )
+            rows_count = self._insert_raw_chunks(
+                raw_it, app_id, table_suffix, parts_count, db_controller,
+                processing_definition, system_fields, check
+            )
+        else:
+            df_it = self._load(app_id, loading_definition, since, until,
+                               LogsApiClient.DATE_DIMENSION_CREATE,
+                               parts_count)
+            rows_count = self._insert_frames(
+                df_it, app_id, table_suffix, parts_count, db_controller,
+                processing_definition, system_fields, check
+            )
+        return UpdateResult(rows_count)
 
     def update(self, app_id: str, date: Optional[datetime.date],
                table_suffix: str, db_controller: DbController,
                processing_definition: ProcessingDefinition,
-               loading_definition: LoadingDefinition):
+               loading_definition: LoadingDefinition,
+               fingerprint: Optional[str] = None,
+               check: Callable[[], None] = _not_cancelled) -> UpdateResult:
         since, until = None, None
         if date:
             since = datetime.datetime.combine(date, datetime.time.min)
             until = datetime.datetime.combine(date, datetime.time.max)
 
         parts_count = 1
+        while True:
+            try:
+                result = self._try_update(app_id, since, until,
+                                          table_suffix, parts_count,
+                                          db_controller,
+                                          processing_definition,
+                                          loading_definition, fingerprint,
+                                          check)
+                check()
+                return result
+            except LogsApiPartsCountError:
+                parts_count *= 2
+
+    def _try_update_incremental(self, app_id: str, since: datetime.datetime,
+                                until: datetime.datetime,
+                                table_suffixes: Dict[str, str],
+                                parts_count: int, db_controller: DbController,
+                                processing_definition: ProcessingDefinition,
+                                loading_definition: LoadingDefinition,
+                                check: Callable[[], None]):
+        system_fields = self._system_fields(app_id)
+        date_field = db_controller.date_export_field
+        window_id = '{}_{}'.format(since.strftime('%Y%m%d%H%M%S'),
+                                   until.strftime('%Y%m%d%H%M%S'))
+        created_tables = set()
+        skipped_rows = 0
+        # A failed window is retried as is, and fixed chunks of it get the
+        # same numbers, so dedup tokens of inserted blocks are repeated
+        df_it = self._load(app_id, loading_definition, since, until,
+                           LogsApiClient.DATE_DIMENSION_RECEIVE, parts_count,
+                           adaptive_chunks=False)
+        with self._insert_executor.batch() as batch:
+            for chunk_number, df in enumerate(df_it):
+                check()
+                upload_df = self._process_data(df, processing_definition,
+                                               app_id)
+                for date_str, date_df in split_by_date(upload_df, date_field):
+                    table_suffix = table_suffixes.get(date_str)
+                    if table_suffix is None:
+                        skipped_rows += len(date_df)
+                        continue
+                    if table_suffix not in created_tables:
+                        db_controller.ensure_table_created(table_suffix)
+                        created_tables.add(table_suffix)
+                    chunk_id = 'r{}_{}_{}'.format(window_id, parts_count,
+                                                  chunk_number)
+                    blocks = db_controller.serialize_data(
+                        date_df, table_suffix, app_id, chunk_id,
+                        system_fields
+                    )
+                    for block in blocks:
+                        batch.submit(db_controller.insert_block, block)
+        if skipped_rows:
+            logger.debug('Skipped {} received rows of not updated '
+                         'dates'.format(skipped_rows))
+
+    def update_incremental(self, app_id: str, since: datetime.datetime,
+                           until: datetime.datetime,
+                           table_suffixes: Dict[str, str],
+                           db_controller: DbController,
+                           processing_definition: ProcessingDefinition,
+                           loading_definition: LoadingDefinition,
+                           check: Callable[[], None] = _not_cancelled):
+        parts_count = 1
         is_loading_completed = False
         while not is_loading_completed:
             try:
-                self._try_update(app_id, since, until, table_suffix,
-                                 parts_count, db_controller,
-                                 processing_definition, loading_definition)
+                self._try_update_incremental(app_id, since, until,
+                                             table_suffixes, parts_count,
+                                             db_controller,
+                                             processing_definition,
+                                             loading_definition, check)
+                check()
                 is_loading_completed = True
             except LogsApiPartsCountError:
                 parts_count *= 2
+
+    def _try_update_range(self, app_id: str, since: datetime.datetime,
+                          until: datetime.datetime,
+                          table_suffixes: Dict[str, str], parts_count: int,
+                          db_controller: DbController,
+                          processing_definition: ProcessingDefinition,
+                          loading_definition: LoadingDefinition,
+                          check: Callable[[], None]) -> Dict[str, int]:
+        for table_suffix in table_suffixes.values():
+            db_controller.drop_table(table_suffix)
+
+        system_fields = self._system_fields(app_id)
+        date_field = db_controller.date_export_field
+        rows_counts = {date_str: 0 for date_str in table_suffixes}
+        skipped_rows = 0
+        df_it = self._load(app_id, loading_definition, since, until,
+                           LogsApiClient.DATE_DIMENSION_CREATE, parts_count)
+        with self._insert_executor.batch() as batch:
+            for chunk_number, df in enumerate(df_it):
+                check()
+                upload_df = self._process_data(df, processing_definition,
+                                               app_id)
+                chunk_id = '{}_{}'.format(parts_count, chunk_number)
+                for date_str, date_df in split_by_date(upload_df, date_field):
+                    table_suffix = table_suffixes.get(date_str)
+                    if table_suffix is None:
+                        skipped_rows += len(date_df)
+                        continue
+                    if rows_counts[date_str] == 0:
+                        db_controller.create_table(table_suffix)
+                    rows_counts[date_str] += len(date_df)
+                    blocks = db_controller.serialize_data(
+                        date_df, table_suffix, app_id, chunk_id,
+                        system_fields
+                    )
+                    for block in blocks:
+                        batch.submit(db_controller.insert_block, block)
+        # Dates of rows are local ones, while the export is split by the
+        # days of the application. If they differ, rows near midnight get
+        # other tables than by loading of single dates.
+        if skipped_rows:
+            raise DateRangeMismatchError(skipped_rows)
+        return rows_counts
+
+    def update_range(self, app_id: str, dates: List[datetime.date],
+                     table_suffixes: Dict[str, str],
+                     db_controller: DbController,
+                     processing_definition: ProcessingDefinition,
+                     loading_definition: LoadingDefinition,
+                     check: Callable[[], None] = _not_cancelled) \
+            -> Dict[str, int]:
+        since = datetime.datetime.combine(min(dates), datetime.time.min)
+        until = datetime.datetime.combine(max(dates), datetime.time.max)
+        parts_count = 1
+        while True:
+            try:
+                rows_counts = self._try_update_range(app_id, since, until,
+                                                     table_suffixes,
+                                                     parts_count,
+                                                     db_controller,
+                                                     processing_definition,
+                                                     loading_definition,
+                                                     check)
+                check()
+                return rows_counts
+            except LogsApiPartsCountError:
+                parts_count *= 2
@@ -13,31 +13,45 @@
 import datetime
 import logging
 import time
-from typing import Optional
+from typing import Optional, List, Dict, Callable
 
 from fields import SourcesCollection, ProcessingDefinition, LoadingDefinition
 from .scheduler import Scheduler, UpdateRequest
+from .update_request import UpdateSkippedError
+from .leasing import LeaseManager
 from .db_controller import DbController
-from .updater import Updater
+from .updater import Updater, UpdateResult, DateRangeMismatchError
+from .updates_executor import UpdatesExecutor
 from .db_controllers_collection import DbControllersCollection
+from .wake_up import WakeUp
 
 logger = logging.getLogger(__name__)
 
 
 class UpdatesController(object):
+    RETRY_DELAY = datetime.timedelta(seconds=10)
+
     def __init__(self, scheduler: Scheduler, updater: Updater,
                  sources_collection: SourcesCollection,
-                 db_controllers_collection: DbControllersCollection):
+                 db_controllers_collection: DbControllersCollection,
+                 updates_executor: Optional[UpdatesExecutor] = None,
+                 lease_manager: Optional[LeaseManager] = None,
+                 wake_up: Optional[WakeUp] = None):
         self._scheduler = scheduler
         self._updater = updater
         self._sources_collection = sources_collection
         self._db_controllers_collection = db_controllers_collection
+        self._updates_executor = updates_executor or UpdatesExecutor(1)
+        self._lease_manager = lease_manager
+        self._wake_up = wake_up or WakeUp()
 
     def _load_into_table(self, app_id: str, date: Optional[datetime.date],
                          table_suffix: str,
                          processing_definition: ProcessingDefinition,
                          loading_definition: LoadingDefinition,
-                         db_controller: DbController):
+                         db_controller: DbController,
+                         fingerprint: Optional[str],
+                         check: Callable[[], None]) -> UpdateResult:
         logger.info('Loading "{date}" into "{suffix}" of "{source}" '
                     'for "{app_id}"'.format(
             date=date or 'latest',
@@ -45,8 +59,9 @@ class UpdatesController(object):
             app_id=app_id,
             suffix=table_suffix
         ))
-        self._updater.update(app_id, date, table_suffix, db_controller,
-                             processing_definition, loading_definition)
+        return self._updater.update(app_id, date, table_suffix, db_controller,
+                                    processing_definition, loading_definition,
+                                    fingerprint, check)
 
     def _archive(self, source: str, app_id: str, date: datetime.date,
                  table_suffix: str, db_controller: DbController):
@@ -57,7 +72,66 @@ class UpdatesController(object):
         ))
         db_controller.archive_table(table_suffix)
 
-    def _update(self, update_request: UpdateRequest):
+    def _load_incremental(self, update_request: UpdateRequest,
+                          processing_definition: ProcessingDefinition,
+                          loading_definition: LoadingDefinition,
+                          db_controller: DbController,
+                          check: Callable[[], None]):
+        app_id = update_request.app_id
+        logger.info('Loading rows of "{source}" received since "{since}" '
+                    'for "{app_id}"'.format(
+            source=update_request.source,
+            since=update_request.since,
+            app_id=app_id
+        ))
+        self._updater.update_incremental(
+            app_id, update_request.since, update_request.until,
+            self._table_suffixes(app_id, update_request.dates),
+            db_controller, processing_definition, loading_definition, check
+        )
+
+    @staticmethod
+    def _table_suffixes(app_id: str,
+                        dates: List[datetime.date]) -> Dict[str, str]:
+        return {
+            date.strftime('%Y-%m-%d'):
+                '{}_{}'.format(app_id, date.strftime('%Y%m%d'))
+            for date in dates
+        }
+
+    def _load_date_range(self, update_request: UpdateRequest,
+                         processing_definition: ProcessingDefinition,
+                         loading_definition: LoadingDefinition,
+                         db_controller: DbController,
+                         check: Callable[[], None]):
+        app_id = update_request.app_id
+        dates = update_request.dates
+        logger.info('Loading "{date_from}" - "{date_to}" of "{source}" '
+                    'for "{app_id}"'.format(
+            date_from=dates[0],
+            date_to=dates[-1],
+            source=update_request.source,
+            app_id=app_id
+        ))
+        try:
+            rows_counts = self._updater.update_range(
+                app_id, dates, self._table_suffixes(app_id, dates),
+                db_controller, processing_definition, loading_definition,
+                check
+            )
+        except DateRangeMismatchError:
+            # Dates are left not loaded, so they are reloaded by days
+            self._scheduler.disable_date_ranges(update_request)
+            raise
+        for date in dates:
+            self._scheduler.observe_date_rows(
+                update_request, date, rows_counts[date.strftime('%Y-%m-%d')]
+            )
+        self._scheduler.observe_rows(update_request,
+                                     sum(rows_counts.values()))
+
+    def _update(self, update_request: UpdateRequest,
+                check: Callable[[], None]):
         source = update_request.source
         app_id = update_request.app_id
         date = update_request.date
@@ -67,28 +141,82 @@ class UpdatesController(object):
         else:
             table_suffix = '{}_{}'.format(app_id, DbController.LATEST_SUFFIX)
 
-        loading_definition = \
-            self._sources_collection.loading_definition(source)
-        processing_definition = \
-            self._sources_collection.processing_definition(source)
+        source_plan = self._sources_collection.source_plan(source)
+        loading_definition = source_plan.loading_definition
+        processing_definition = source_plan.processing_definition
         db_controller = \
             self._db_controllers_collection.db_controller(source)
 
-        if update_type == UpdateRequest.LOAD_ONE_DATE:
-            self._load_into_table(app_id, date, table_suffix,
-                                  processing_definition, loading_definition,
-                                  db_controller)
+        if update_type in (UpdateRequest.LOAD_ONE_DATE,
+                           UpdateRequest.LOAD_DATE_IGNORED):
+            result = self._load_into_table(
+                app_id, date, table_suffix, processing_definition,
+                loading_definition, db_controller,
+                self._scheduler.fingerprint(update_request), check
+            )
+            if result.fingerprint is not None:
+                self._scheduler.save_fingerprint(update_request,
+                                                 result.fingerprint)
+            if result.rows_count is not None and date is not None:
+                self._scheduler.observe_date_rows(update_request, date,
+                                                  result.rows_count)
         elif update_type == UpdateRequest.ARCHIVE:
             self._archive(source, app_id, date, table_suffix, db_controller)
-        elif update_type == UpdateRequest.LOAD_DATE_IGNORED:
-            self._load_into_table(app_id, None, table_suffix,
-                                  processing_definition, loading_definition,
-                                  db_controller)
+        elif update_type == UpdateRequest.LOAD_DATE_RANGE:
+            self._load_date_range(update_request, processing_definition,
+                                  loading_definition, db_controller, check)
+        elif update_type == UpdateRequest.LOAD_INCREMENTAL:
+            self._load_incremental(update_request, processing_definition,
+                                   loading_definition, db_controller, check)
+
+    def _leased_update(self, update_request: UpdateRequest):
+        if self._lease_manager is None:
+            self._update(update_request, lambda: None)
+            self._scheduler.mark_done(update_request)
+            return
+        lease = self._lease_manager.lease(update_request)
+        if not lease.acquire():
+            raise UpdateSkippedError('"{}" is leased by another loader'
+                                     .format(lease.key))
+        try:
+            if not self._scheduler.is_pending(update_request):
+                logger.info('"{}" is already updated by another '
+                            'loader'.format(lease.key))
+                return
+            # Loading stops when another loader may have taken the lease,
+            # so the update is failed instead of being marked as done
+            self._update(update_request, lease.check)
+            lease.check()
+            # The update is marked while the lease is held, so other
+            # loaders see it as done once they take the lease
+            self._scheduler.mark_done(update_request)
+        finally:
+            lease.release()
+
+    def _timed_update(self, update_request: UpdateRequest):
+        started_at = time.monotonic()
+        self._leased_update(update_request)
+        self._scheduler.observe_duration(update_request,
+                                         time.monotonic() - started_at)
+
+    def _wait(self, until: datetime.datetime):
+        wait_time = max(until - datetime.datetime.now(), datetime.timedelta(0))
+        logger.info('Sleep for {}'.format(wait_time))
+        self._wake_up.wait(wait_time.total_seconds())
 
     def _step(self):
-        update_requests = self._scheduler.update_requests()
-        for update_request in update_requests:
-            self._update(update_request)
+        force = self._wake_up.consume()
+        update_requests = list(self._scheduler.update_requests(force))
+        if not update_requests:
+            self._wait(self._scheduler.next_update_time())
+            return
+        completed = self._updates_executor.run(update_requests,
+                                               self._timed_update)
+        if completed:
+            self._scheduler.finish_updates()
+        else:
+            # Postponed updates are still due, so they are retried soon
+            self._wait(datetime.datetime.now() + self.RETRY_DELAY)
 
     def run(self):
         logger.info("Starting updating loop")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+  updates_executor.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import datetime
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait, \
+    FIRST_COMPLETED
+from typing import Callable, List, Dict, Tuple, Optional
+
+from .update_request import UpdateRequest, UpdateSkippedError
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatesExecutor(object):
+    LOGS_API = 'logs_api'
+    APP = 'app'
+    DB = 'db'
+
+    def __init__(self, workers_count: int, logs_api_limit: int = 0,
+                 app_limit: int = 0, db_limit: int = 0,
+                 cycle_deadline: Optional[datetime.timedelta] = None):
+        self._workers_count = workers_count
+        self._cycle_deadline = cycle_deadline
+        self._limits = {
+            self.LOGS_API: logs_api_limit,
+            self.APP: app_limit,
+            self.DB: db_limit,
+        }
+
+    def _resources(self, update_request: UpdateRequest) -> List[Tuple]:
+        resources = [(self.APP, update_request.app_id), (self.DB,)]
+        if update_request.update_type != UpdateRequest.ARCHIVE:
+            resources.append((self.LOGS_API,))
+        return resources
+
+    def _is_available(self, usage: Counter, resources: List[Tuple]) -> bool:
+        for resource in resources:
+            limit = self._limits[resource[0]]
+            if 0 < limit <= usage[resource]:
+                return False
+        return True
+
+    @staticmethod
+    def _skip(update_request: UpdateRequest):
+        logger.warning('Skipping {} of "{}" for {} of "{}": previous '
+                       'updates failed'.format(update_request.update_type,
+                                               update_request.source,
+                                               update_request.date,
+                                               update_request.app_id))
+        update_request.finish(False)
+
+    @staticmethod
+    def _log_skipped(update_request: UpdateRequest, error: Exception):
+        logger.info('Skipping {} of "{}" for {} of "{}": {}'.format(
+            update_request.update_type, update_request.source,
+            update_request.date, update_request.app_id, error
+        ))
+
+    @staticmethod
+    def _is_expired(deadline: Optional[datetime.datetime]) -> bool:
+        return deadline is not None and datetime.datetime.now() >= deadline
+
+    def _run_serially(self, update_requests: List[UpdateRequest],
+                      fn: Callable[[UpdateRequest], None],
+                      deadline: Optional[datetime.datetime]) -> int:
+        skipped = 0
+        for index, update_request in enumerate(update_requests):
+            if self._is_expired(deadline):
+                logger.info('Cycle deadline is reached')
+                return skipped + len(update_requests) - index
+            after = update_request.after
+            if after is not None and after.failed:
+                self._skip(update_request)
+                continue
+            try:
+                fn(update_request)
+            except UpdateSkippedError as e:
+                self._log_skipped(update_request, e)
+                update_request.finish(False)
+                skipped += 1
+                continue
+            except Exception:
+                update_request.finish(False)
+                raise
+            update_request.finish(True)
+        return skipped
+
+    def _run_concurrently(self, update_requests: List[UpdateRequest],
+                          fn: Callable[[UpdateRequest], None],
+                          deadline: Optional[datetime.datetime]) -> int:
+        pending = list(update_requests)
+        running = dict()  # type: Dict[Future, UpdateRequest]
+        usage = Counter()
+        busy_tables = set()
+        errors = []
+        postponed = 0
+        with ThreadPoolExecutor(max_workers=self._workers_count) as executor:
+            while pending or running:
+                if pending and self._is_expired(deadline):
+                    logger.info('Cycle deadline is reached')
+                    postponed += len(pending)
+                    pending = []
+                # Requests for the same table keep their order
+                blocked_tables = set(busy_tables)
+                for update_request in list(pending):
+                    if len(running) >= self._workers_count:
+                        break
+                    table_keys = update_request.table_keys
+                    if not blocked_tables.isdisjoint(table_keys):
+                        continue
+                    after = update_request.after
+                    if after is not None and after.failed:
+                        pending.remove(update_request)
+                        self._skip(update_request)
+                        continue
+                    resources = self._resources(update_request)
+                    if after is not None and not after.completed \
+                            or not self._is_available(usage, resources):
+                        blocked_tables.update(table_keys)
+                        continue
+                    pending.remove(update_request)
+                    usage.update(resources)
+                    busy_tables.update(table_keys)
+                    future = executor.submit(fn, update_request)
+                    running[future] = update_request
+                if not running:
+                    # Nothing left can unblock them in this cycle
+                    if pending:
+                        logger.info('{} updates are blocked by not finished '
+                                    'ones'.format(len(pending)))
+                    for update_request in pending:
+                        update_request.finish(False)
+                    postponed += len(pending)
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    update_request = running.pop(future)
+                    usage.subtract(self._resources(update_request))
+                    busy_tables.difference_update(update_request.table_keys)
+                    error = future.exception()
+                    if isinstance(error, UpdateSkippedError):
+                        self._log_skipped(update_request, error)
+                        postponed += 1
+                    elif error is not None:
+                        logger.warning(error)
+                        errors.append(error)
+                    update_request.finish(error is None)
+        if errors:
+            raise errors[0]
+        return postponed
+
+    def run(self, update_requests: List[UpdateRequest],
+            fn: Callable[[UpdateRequest], None]) -> bool:
+        deadline = None
+        if self._cycle_deadline:
+            deadline = datetime.datetime.now() + self._cycle_deadline
+        if self._workers_count <= 1:
+            postponed = self._run_serially(update_requests, fn, deadline)
+        else:
+            postponed = self._run_concurrently(update_requests, fn, deadline)
+        # Skipped updates are postponed as well, as they are still due
+        if postponed:
+            logger.info('{} of {} updates are postponed'.format(
+                postponed, len(update_requests)
+            ))
+        return postponed == 0
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+  wake_up.py
+
+  This file is a part of the AppMetrica.
+
+  Copyright 2017 YANDEX
+
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at:
+        https://yandex.com/legal/metrica_termsofuse/
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WakeUp(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._socket = None  # type: Optional[socket.socket]
+        self._socket_path = None  # type: Optional[str]
+
+    def trigger(self):
+        self._event.set()
+
+    def _handle_signal(self, signum, frame):
+        logger.info('Woken up by signal {}'.format(signum))
+        # Setting the event may block, so it is not done in the handler
+        threading.Thread(target=self.trigger, daemon=True).start()
+
+    def install_signal_handler(self, signum: int = signal.SIGUSR1):
+        signal.signal(signum, self._handle_signal)
+
+    def _accept_connections(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            connection.close()
+            logger.info('Woken up by socket connection')
+            self.trigger()
+
+    def listen(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(1)
+        self._socket_path = path
+        threading.Thread(target=self._accept_connections, daemon=True).start()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        return self._event.wait(timeout)
+
+    def consume(self) -> bool:
+        triggered = self._event.is_set()
+        self._event.clear()
+        return triggered
+
+    def close(self):
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)